@@ -5,9 +5,18 @@ import os
 import sys
 import json
 import pathlib
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, List
+import inspect
 import tifffile
 
 import numpy as np
+import pandas as pd
+from scipy import ndimage
+from skimage import segmentation
 
 from cellpose import models
 from cellpose import utils, io
@@ -19,6 +28,7 @@ from aicssegmentation.core.pre_processing_utils import intensity_normalization,
 #import oligoanalysis
 from napari_dapi_ring_analysis import oligoAnalysisFolder
 from napari_dapi_ring_analysis._logger import logger
+from napari_dapi_ring_analysis.oligoStore import _getBaseSaveFile, loadSavedRgb, getSavedRgbMtime
 
 def getCellposeLog():
     """Get the full path to the <user> cellpose log file.
@@ -56,17 +66,284 @@ def getModels():
                     for file in sorted(files)]
     return fileList
 
-def runModelOnImage(imgPath : str, imgData : np.ndarray = None, setupLogger=True):
+def getDefaultModel() -> str:
+    """Full path to the pretrained model we use in runModelOnImage().
+    """
+    pretrained_models = getModels()
+    if pretrained_models is None:
+        return
+    # made new model at sfn CP_20221115_123812
+    return pretrained_models[3]
+
+cellposeOptions = {
+    'device': os.environ.get('OLIGO_CELLPOSE_DEVICE', 'auto'),
+    # In ['auto', 'cpu', 'cuda', 'mps'], 'auto' uses cuda or mps if available
+
+    'numThreads': int(os.environ.get('OLIGO_CELLPOSE_THREADS', 0)) or None,
+    # torch intra-op threads when running on cpu, None for torch default (all cores)
+
+    'precision': os.environ.get('OLIGO_CELLPOSE_PRECISION', 'float32'),
+    # In cellposePrecisions, see getCellposeModel()
+
+    'tileSize': int(os.environ.get('OLIGO_CELLPOSE_TILE', 0)) or None,
+    # xy pixels per tile, None to run the whole stack at once, see evalTiled()
+
+    'tileOverlap': None,
+    # xy pixels each tile extends past its core, None for 2 * diameter
+}
+# how we run cellpose, defaults can be set with environment variables
+
+cellposePrecisions = ['float32', 'bfloat16', 'qint8']
+
+_modelCache = {}
+# loaded cellpose models, keys are (pretrained_model, model_type, gpu, device, precision)
+# see getCellposeModel()
+
+_modelCacheLock = threading.Lock()
+
+def getCellposeDevice(device : str = None):
+    """Get the torch device to run cellpose on.
+
+    Args:
+        device: In ['auto', 'cpu', 'cuda', 'mps'], if None then use cellposeOptions['device']
+
+    Returns:
+        gpu: bool for models.CellposeModel()
+        device: torch.device
+    """
+    import torch
+
+    if device is None:
+        device = cellposeOptions['device']
+    if device == 'auto':
+        if torch.cuda.is_available():
+            device = 'cuda'
+        elif getattr(torch.backends, 'mps', None) is not None and torch.backends.mps.is_available():
+            device = 'mps'
+        else:
+            device = 'cpu'
+    return device != 'cpu', torch.device(device)
+
+def setCellposeThreads(numThreads : int = None):
+    """Set the number of torch cpu threads for this process.
+
+    Args:
+        numThreads: if None then use cellposeOptions['numThreads'],
+            if that is None do nothing (torch default)
+    """
+    if numThreads is None:
+        numThreads = cellposeOptions['numThreads']
+    if numThreads is None:
+        return
+
+    import torch
+    if torch.get_num_threads() != numThreads:
+        logger.info(f'  setting torch threads to {numThreads}')
+        torch.set_num_threads(numThreads)
+    try:
+        # can only be set once, before any parallel work
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+def _getModelKey(pretrained_model : str, model_type : str = None,
+                    gpu : bool = True, device = None, precision : str = 'float32') -> tuple:
+    if pretrained_model is not None and os.path.exists(pretrained_model):
+        pretrained_model = os.path.abspath(pretrained_model)
+    return (pretrained_model, model_type, gpu, str(device), precision)
+
+def getCellposeModel(pretrained_model : str, model_type : str = None,
+                        gpu : bool = True, device = None,
+                        precision : str = 'float32') -> models.CellposeModel:
+    """Get a cellpose model, it is loaded once per process and then reused.
+
+    Args:
+        pretrained_model: full path to a trained model
+        model_type: 'cyto' or 'nuclei' or 'cyto2', None if using pretrained_model
+        gpu: passed to models.CellposeModel()
+        device: torch device, passed to models.CellposeModel()
+        precision: In cellposePrecisions
+            'bfloat16' needs a cellpose with use_bfloat16 (>= 4), otherwise float32
+            'qint8' is torch dynamic quantization of linear layers, cpu only
+    """
+    if precision not in cellposePrecisions:
+        raise ValueError(f'Did not understand precision "{precision}", expecting one of {cellposePrecisions}')
+
+    key = _getModelKey(pretrained_model, model_type, gpu, device, precision)
+    with _modelCacheLock:
+        model = _modelCache.get(key)
+        if model is None:
+            logger.info(f'  instantiating model with models.CellposeModel()')
+            logger.info(f'    gpu: {gpu}')
+            logger.info(f'    device: {device}')
+            logger.info(f'    precision: {precision}')
+            logger.info(f'    model_type: {model_type}')
+            logger.info(f'    pretrained_model: {pretrained_model}')
+            kwargs = {}
+            if 'use_bfloat16' in inspect.signature(models.CellposeModel).parameters:
+                kwargs['use_bfloat16'] = precision == 'bfloat16'
+            elif precision == 'bfloat16':
+                logger.warning(f'  this cellpose does not support bfloat16, using float32')
+            model = models.CellposeModel(gpu=gpu, model_type=model_type,
+                                            pretrained_model=pretrained_model,
+                                            device=device, **kwargs)
+            if precision == 'qint8':
+                if str(device) != 'cpu':
+                    logger.warning(f'  qint8 is only for cpu, using float32 on {device}')
+                else:
+                    import torch
+                    model.net = torch.quantization.quantize_dynamic(model.net, {torch.nn.Linear},
+                                                                    dtype=torch.qint8)
+            _modelCache[key] = model
+    return model
+
+def warmupModel(pretrained_model : str, model_type : str = None,
+                    gpu : bool = True, device = None,
+                    precision : str = 'float32',
+                    runEval : bool = True) -> models.CellposeModel:
+    """Load a cellpose model into the model cache before the first image.
+
+    Args:
+        runEval: if True run the model on a small blank image
+            so one time initialization (cuda, allocations) is done
+    """
+    model = getCellposeModel(pretrained_model, model_type=model_type, gpu=gpu,
+                                device=device, precision=precision)
+    if runEval:
+        logger.info(f'  warming up {os.path.split(str(pretrained_model))[1]}')
+        _imgData = np.zeros((64, 64, 3), dtype=np.uint8)
+        model.eval(_imgData, channels=[[2,2]], diameter=30)
+    return model
+
+def unloadModel(pretrained_model : str = None):
+    """Remove models from the model cache.
+
+    Args:
+        pretrained_model: if None then remove all models
+    """
+    with _modelCacheLock:
+        if pretrained_model is None:
+            _keys = list(_modelCache.keys())
+        else:
+            _key = _getModelKey(pretrained_model)[0]
+            _keys = [k for k in _modelCache.keys() if k[0] == _key]
+        for k in _keys:
+            logger.info(f'  unloading model {k}')
+            del _modelCache[k]
+
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+def getTiles(length : int, tileSize : int, overlap : int) -> List[tuple]:
+    """Split one axis into overlapping tiles.
+
+    Tile cores do not overlap and cover the axis, each tile extends overlap past its core.
+
+    Returns:
+        list of (start, stop, coreStart, coreStop)
+    """
+    if tileSize >= length:
+        return [(0, length, 0, length)]
+    coreSize = tileSize - 2 * overlap
+    if coreSize <= 0:
+        raise ValueError(f'tileSize {tileSize} must be more than 2 * overlap {overlap}')
+    numTiles = int(np.ceil(length / coreSize))
+    coreEdges = np.linspace(0, length, numTiles+1).round().astype(int)
+    tileList = []
+    for coreStart, coreStop in zip(coreEdges[:-1], coreEdges[1:]):
+        tileList.append((max(0, coreStart - overlap), min(length, coreStop + overlap),
+                            int(coreStart), int(coreStop)))
+    return tileList
+
+def _pasteTileMasks(masks : np.ndarray, tileMasks : np.ndarray,
+                        yTile : tuple, xTile : tuple, nextLabel : int) -> int:
+    """Paste labels from one tile into the full masks.
+
+    Only labels with their centroid in the tile core are pasted, cores do not overlap
+    so each object is taken from exactly one tile. Pixels already labelled by a
+    neighboring tile are not overwritten.
+
+    Returns:
+        next free label
+    """
+    y0, _, yCore0, yCore1 = yTile
+    x0, _, xCore0, xCore1 = xTile
+    for _label, _objSlice in enumerate(ndimage.find_objects(tileMasks), start=1):
+        if _objSlice is None:
+            continue
+        _objMask = tileMasks[_objSlice] == _label
+        _, _yy, _xx = np.nonzero(_objMask)
+        yCentroid = _yy.mean() + _objSlice[1].start + y0
+        xCentroid = _xx.mean() + _objSlice[2].start + x0
+        if not (yCore0 <= yCentroid < yCore1 and xCore0 <= xCentroid < xCore1):
+            continue
+        _globalSlice = (_objSlice[0],
+                        slice(_objSlice[1].start + y0, _objSlice[1].stop + y0),
+                        slice(_objSlice[2].start + x0, _objSlice[2].stop + x0))
+        _region = masks[_globalSlice]
+        _free = _objMask & (_region == 0)
+        if not _free.any():
+            continue
+        _region[_free] = nextLabel
+        nextLabel += 1
+    return nextLabel
+
+def evalTiled(model, imgData : np.ndarray, tileSize : int, tileOverlap : int,
+                **evalKwargs) -> np.ndarray:
+    """Run model.eval on overlapping xy tiles and stitch the labels.
+
+    Model memory is bounded by the tile size. Overlap should be more than
+    one object diameter so objects on a core edge are whole in their tile.
+
+    Args:
+        model: cellpose model
+        imgData: (z, y, x, rgb) stack
+        tileSize: xy pixels per tile
+        tileOverlap: xy pixels each tile extends past its core
+        evalKwargs: passed to model.eval()
+
+    Returns:
+        (z, y, x) labels, numbered 1..n
+    """
+    masks = np.zeros(imgData.shape[0:3], dtype=np.uint32)
+    yTiles = getTiles(imgData.shape[1], tileSize, tileOverlap)
+    xTiles = getTiles(imgData.shape[2], tileSize, tileOverlap)
+    nextLabel = 1
+    for _idx, (yTile, xTile) in enumerate([(_y, _x) for _y in yTiles for _x in xTiles]):
+        logger.info(f'    tile {_idx+1} of {len(yTiles)*len(xTiles)} y:{yTile[0:2]} x:{xTile[0:2]}')
+        _tileData = imgData[:, yTile[0]:yTile[1], xTile[0]:xTile[1], ...]
+        tileMasks, _flows, _styles = model.eval(_tileData, **evalKwargs)
+        nextLabel = _pasteTileMasks(masks, np.asarray(tileMasks), yTile, xTile, nextLabel)
+
+    # objects that lost all pixels to a neighbor leave gaps in the numbering
+    masks, _, _ = segmentation.relabel_sequential(masks)
+    return masks
+
+def runModelOnImage(imgPath : str, imgData : np.ndarray = None, setupLogger=True,
+                        tileSize : int = None, tileOverlap : int = None):
     """Run our pre-defined (trained) model on one 3D RGB stack.
     
     Args:
         imgPath: full path to 3D rgb stack
         imgData: image data for 3D rgb stack
         setupLogger: if True will re-init logger in <user>/.cellpose/run.log
+        tileSize: if not None, run the model on overlapping xy tiles of this size, see evalTiled()
+            if None then use cellposeOptions['tileSize']
+        tileOverlap: xy pixels each tile extends past its core
+            if None then use cellposeOptions['tileOverlap'] or 2 * diameter
 
     Output (saved)
         -cp,json with model parameters
         -seg.npy with cellpose output (mask is in there, it is hdf5 file)
+
+    Device, cpu threads and precision are from cellposeOptions.
+
+    Returns:
+        dict of cellpose parameters, device and evalSeconds (also saved in -cp.json)
     """
     
     # setup cellpose logging to file
@@ -75,8 +352,10 @@ def runModelOnImage(imgPath : str, imgData : np.ndarray = None, setupLogger=True
         logger_setup()
     
     if imgData is None:
-        # load small 3d rgb stack
-        imgData = tifffile.imread(imgPath)
+        # load small 3d rgb stack, from the zarr container if there is no tif
+        imgData = loadSavedRgb(imgPath)
+        if imgData is None:
+            raise FileNotFoundError(f'Did not find saved rgb stack for {imgPath}')
 
     logger.info('cellpose runModelOnImage()')
     logger.info(f'  {imgPath}')  # (7, 196, 196, 3)
@@ -93,11 +372,15 @@ def runModelOnImage(imgPath : str, imgData : np.ndarray = None, setupLogger=True
     # logger.info(f'  intensity_scaling_param: {intensity_scaling_param}')
     # logger.info(f'  {_imgDataGray.shape} max:{np.max(_imgDataGray)}')
 
-    gpu = True
+    # from cellposeOptions, our processing nodes do not have a gpu
+    gpu, device = getCellposeDevice()
+    precision = cellposeOptions['precision']
+    if not gpu:
+        setCellposeThreads()
     model_type = None  # 'cyto' or 'nuclei' or 'cyto2'
     
-    pretrained_models = getModels()
-    if pretrained_models is None:
+    pretrained_model = getDefaultModel()
+    if pretrained_model is None:
         logger.warning('Did not find any models, cellpose is not running')
         return
 
@@ -109,7 +392,7 @@ def runModelOnImage(imgPath : str, imgData : np.ndarray = None, setupLogger=True
     # made new model at sfn CP_20221115_123812
     #pretrained_model = pretrained_models[2]  # '/Users/cudmore/Sites/oligo-analysis/models/CP_20221008_110626'
 
-    pretrained_model = pretrained_models[3]  # '/Users/cudmore/Sites/oligo-analysis/models/CP_20221008_110626'
+    # see getDefaultModel()
 
     #channels = [[2,1]]  # # grayscale=0, R=1, G=2, B=3
     channels = [[2,2]]  # # grayscale=0, R=1, G=2, B=3
@@ -137,16 +420,13 @@ def runModelOnImage(imgPath : str, imgData : np.ndarray = None, setupLogger=True
         'min_size': min_size,
         'do_3D': do_3D,
         #'net_avg': net_avg,
+        'device': str(device),
+        'precision': precision,
     }
 
-    logger.info(f'  instantiating model with models.CellposeModel()')
-    logger.info(f'    gpu: {gpu}')
-    logger.info(f'    model_type: {model_type}')
-    logger.info(f'    pretrained_model: {pretrained_model}')
-    #logger.info(f'    net_avg: {net_avg}')
-
-    model = models.CellposeModel(gpu=gpu, model_type=model_type,
-                                    pretrained_model=pretrained_model)
+    # loaded once per process, see getCellposeModel()
+    model = getCellposeModel(pretrained_model, model_type=model_type, gpu=gpu,
+                                device=device, precision=precision)
 
     logger.info('  running model.eval')
     logger.info(f'    diameter: {diameter}')
@@ -156,21 +436,53 @@ def runModelOnImage(imgPath : str, imgData : np.ndarray = None, setupLogger=True
     logger.info(f'    do_3D: {do_3D}')
 
 
+    if tileSize is None:
+        tileSize = cellposeOptions['tileSize']
+    if tileOverlap is None:
+        tileOverlap = cellposeOptions['tileOverlap'] or 2 * diameter
+    if tileSize is not None:
+        logger.info(f'    tileSize: {tileSize} tileOverlap: {tileOverlap}')
+        cellPoseDict['tileSize'] = tileSize
+        cellPoseDict['tileOverlap'] = tileOverlap
+
     # jan2023, flow_threshold = 0.4
     # try 0.8
-    masks, flows, styles = model.eval(imgData,
-                                        diameter=diameter,
-                                        flow_threshold=flow_threshold,  # added jan2023
-                                        cellprob_threshold=cellprob_threshold,
-                                        channels=channels,
-                                        do_3D=do_3D,
-                                        anisotropy=anisotropy,
-                                        min_size=min_size)
+    evalKwargs = {
+        'diameter': diameter,
+        'flow_threshold': flow_threshold,  # added jan2023
+        'cellprob_threshold': cellprob_threshold,
+        'channels': channels,
+        'do_3D': do_3D,
+        'anisotropy': anisotropy,
+        'min_size': min_size,
+    }
+    _startTime = time.perf_counter()
+    if tileSize is None:
+        masks, flows, styles = model.eval(imgData, **evalKwargs)
+    else:
+        masks = evalTiled(model, imgData, tileSize, tileOverlap, **evalKwargs)
+    evalSeconds = time.perf_counter() - _startTime
+    cellPoseDict['evalSeconds'] = round(evalSeconds, 3)
+    if not gpu:
+        import torch
+        cellPoseDict['numThreads'] = torch.get_num_threads()
+    logger.info(f'  model.eval took {round(evalSeconds, 2)} seconds on {device}')
 
     # save
     logger.info(f'  saving cellpose _seg.npy into folder {os.path.split(imgPath)[0]}')
-    # models.CellposeModel.eval does not return 'diams', using diameter
-    io.masks_flows_to_seg(imgData, masks, flows, diameter, imgPath, channels)
+    if tileSize is None:
+        # models.CellposeModel.eval does not return 'diams', using diameter
+        io.masks_flows_to_seg(imgData, masks, flows, diameter, imgPath, channels)
+    else:
+        # no full size flows when tiled, save what oligoAnalysis and the cellpose gui read
+        segDict = {
+            'masks': masks,
+            'outlines': utils.masks_to_outlines(masks),
+            'filename': imgPath,
+            'diameter': diameter,
+            'chan_choose': channels,
+        }
+        np.save(os.path.splitext(imgPath)[0] + '_seg.npy', segDict)
     
     # save parameters
     paramPath = os.path.splitext(imgPath)[0]
@@ -184,6 +496,8 @@ def runModelOnImage(imgPath : str, imgData : np.ndarray = None, setupLogger=True
     # can't save 3d output as png
     # io.save_to_png(imgData, masks, flows, imgPath)
 
+    return cellPoseDict
+
 def batchRunFolder0():
     """run a cellpose model on entire folders of czi rgb stack
     """
@@ -218,9 +532,9 @@ def batchRunFolder0():
             print(f'  error: folder does not exist: {folderPath}')
             return
 
-    for folderPath in folderPathList:
-        print(' . === ', folderPath)
-        batchRunFolder(folderPath)
+    # one warm model per worker process, skips stacks that already have _seg.npy
+    dfTiming = segmentFolders(folderPathList, numWorkers=2)
+    print(dfTiming)
 
     print('DONE with _cellpose.py __main__')
     for folderPath in folderPathList:
@@ -262,6 +576,156 @@ def batchRunFolder(folderPath : str):
         # TODO: unload oligoAnalysis
         oa = None  # does this free memory ?
 
+def needsSegmentation(cziPath : str) -> bool:
+    """True if a czi file does not have a cellpose _seg.npy newer than its rgb stack.
+
+    The rgb stack is the rgb tif or the rgb array in the zarr container, see oligoStore.
+    """
+    _baseSaveFile = _getBaseSaveFile(cziPath)
+    rgbMtime = getSavedRgbMtime(_baseSaveFile + '.tif')
+    segPath = _baseSaveFile + '_seg.npy'
+    if rgbMtime is None or not os.path.isfile(segPath):
+        return True
+    return os.path.getmtime(segPath) <= rgbMtime
+
+def _getCoreShare(workerIdx : int, numWorkers : int) -> List[int]:
+    """Get the cpu cores for one worker, cores are split evenly between workers.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    if numWorkers >= len(cores):
+        return [cores[workerIdx % len(cores)]]
+    return [int(_core) for _core in np.array_split(cores, numWorkers)[workerIdx]]
+
+def _initSegmentWorker(workerCounter, numWorkers : int, options : dict):
+    """Initialize one worker process of segmentFolders().
+
+    Pin the process to its share of cores and load a warm model.
+    """
+    with workerCounter.get_lock():
+        workerIdx = workerCounter.value
+        workerCounter.value += 1
+
+    cellposeOptions.update(options)
+
+    gpu, device = getCellposeDevice()
+    if not gpu:
+        cores = _getCoreShare(workerIdx, numWorkers)
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+        if cellposeOptions['numThreads'] is None:
+            cellposeOptions['numThreads'] = len(cores)
+        setCellposeThreads()
+        logger.info(f'worker {workerIdx} pid:{os.getpid()} cores:{cores}')
+
+    pretrained_model = getDefaultModel()
+    if pretrained_model is not None:
+        warmupModel(pretrained_model, gpu=gpu, device=device,
+                    precision=cellposeOptions['precision'])
+
+def _segmentStack(cziPath : str) -> dict:
+    """Make rgb stack and run cellpose for one czi file, used by segmentFolders().
+    """
+    from napari_dapi_ring_analysis.oligoAnalysis import oligoAnalysis
+
+    resultDict = {
+        'folder': os.path.split(cziPath)[0],
+        'file': os.path.split(cziPath)[1],
+        'status': 'done',
+        'error': '',
+        'pid': os.getpid(),
+        'rgbSeconds': float('nan'),
+        'evalSeconds': float('nan'),
+        'totalSeconds': float('nan'),
+    }
+    _startTime = time.perf_counter()
+    try:
+        oa = oligoAnalysis(cziPath)
+        rgbStack = oa._getRgbStack()
+        resultDict['rgbSeconds'] = round(time.perf_counter() - _startTime, 3)
+
+        cellPoseDict = runModelOnImage(imgPath=oa._getRgbPath(), imgData=rgbStack, setupLogger=False)
+        if cellPoseDict is None:
+            resultDict['status'] = 'error'
+            resultDict['error'] = 'did not find cellpose model'
+        else:
+            resultDict['evalSeconds'] = cellPoseDict['evalSeconds']
+    except Exception as e:
+        logger.error(f'cellpose failed for {cziPath}: {e}')
+        resultDict['status'] = 'error'
+        resultDict['error'] = str(e)
+    resultDict['totalSeconds'] = round(time.perf_counter() - _startTime, 3)
+    return resultDict
+
+def iterSegmentFolders(folderPathList : List[str], numWorkers : int = 2,
+                        forceRun : bool = False) -> Iterator[dict]:
+    """Run cellpose on all czi files in a list of folders, in a pool of worker processes.
+
+    Each worker holds one warm model and, on cpu, is pinned to its share of the cores.
+    Results are yielded as each stack finishes (not in order).
+
+    Args:
+        folderPathList: list of folders with czi files
+        numWorkers: number of worker processes, if <= 1 then run in this process
+        forceRun: if False then skip stacks with a _seg.npy newer than the rgb stack
+            (see needsSegmentation())
+
+    Yields:
+        dict with folder, file, status ('done', 'skipped', 'error'), rgbSeconds, evalSeconds, totalSeconds
+    """
+    from napari_dapi_ring_analysis.loadCzi import _getFolderFiles
+
+    cziPathList = []
+    for folderPath in folderPathList:
+        if not os.path.isdir(folderPath):
+            logger.error(f'folder does not exist: {folderPath}')
+            continue
+        for cziPath in _getFolderFiles(folderPath):
+            if forceRun or needsSegmentation(cziPath):
+                cziPathList.append(cziPath)
+            else:
+                # same folder as _segmentStack(), not the folder argument
+                yield {
+                    'folder': os.path.split(cziPath)[0],
+                    'file': os.path.split(cziPath)[1],
+                    'status': 'skipped',
+                }
+
+    logger.info(f'running cellpose on {len(cziPathList)} stacks with {numWorkers} workers')
+
+    if numWorkers <= 1 or len(cziPathList) <= 1:
+        for cziPath in cziPathList:
+            yield _segmentStack(cziPath)
+        return
+
+    # spawn, torch is not fork safe
+    _context = multiprocessing.get_context('spawn')
+    workerCounter = _context.Value('i', 0)
+    with ProcessPoolExecutor(max_workers=numWorkers, mp_context=_context,
+                                initializer=_initSegmentWorker,
+                                initargs=(workerCounter, numWorkers, dict(cellposeOptions))) as executor:
+        futures = [executor.submit(_segmentStack, cziPath) for cziPath in cziPathList]
+        for future in as_completed(futures):
+            yield future.result()
+
+def segmentFolders(folderPathList : List[str], numWorkers : int = 2,
+                    forceRun : bool = False) -> pd.DataFrame:
+    """Run cellpose on all czi files in a list of folders, see iterSegmentFolders().
+
+    Returns:
+        pd.DataFrame with one row per stack and its timing
+    """
+    dictList = []
+    for _idx, resultDict in enumerate(iterSegmentFolders(folderPathList,
+                                                            numWorkers=numWorkers,
+                                                            forceRun=forceRun)):
+        logger.info(f'  {_idx+1} {resultDict["status"]} {resultDict["file"]} '
+                    f'total seconds:{resultDict.get("totalSeconds", 0)}')
+        dictList.append(resultDict)
+    return pd.DataFrame(dictList)
+
 def saveSlicesForCellPose():
     """Open a 3d rgb and save the 2-channel slices
         Each slice will be rgb 8-bit without histogram normalization
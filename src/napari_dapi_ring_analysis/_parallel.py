@@ -0,0 +1,50 @@
+"""
+Run a function over a list of items in a thread or process pool.
+"""
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from typing import Callable, List
+
+from napari_dapi_ring_analysis._logger import logger
+
+def parallelMap(func : Callable, items : List,
+                numWorkers : int = 1,
+                progressCallback : Callable = None,
+                useProcesses : bool = False) -> List:
+    """Apply func to each item, results are in the same order as items.
+
+    Args:
+        func: called as func(item)
+        items: list of items
+        numWorkers: if <= 1 then run in the calling thread
+        progressCallback: called as progressCallback(numDone, numTotal) as each item finishes
+        useProcesses: if True use a spawn process pool (func and items must pickle),
+            spawn because fork is not safe after torch (cellpose) has run threads
+
+    Returns:
+        list of func(item)
+    """
+    numTotal = len(items)
+    results = [None] * numTotal
+
+    if numWorkers <= 1 or numTotal <= 1:
+        for idx, item in enumerate(items):
+            results[idx] = func(item)
+            if progressCallback is not None:
+                progressCallback(idx+1, numTotal)
+        return results
+
+    if useProcesses:
+        executor = ProcessPoolExecutor(max_workers=numWorkers,
+                                        mp_context=multiprocessing.get_context('spawn'))
+    else:
+        executor = ThreadPoolExecutor(max_workers=numWorkers)
+    logger.info(f'running {numTotal} items with {numWorkers} {type(executor).__name__} workers')
+    with executor:
+        futures = {executor.submit(func, item): idx for idx, item in enumerate(items)}
+        for numDone, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            if progressCallback is not None:
+                progressCallback(numDone, numTotal)
+
+    return results
@@ -0,0 +1,194 @@
+import os
+
+import pytest
+
+from napari_dapi_ring_analysis import _cellpose
+
+
+class _fakeModel():
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.numEval = 0
+
+    def eval(self, imgData, **kwargs):
+        self.numEval += 1
+
+
+def test_model_cache(monkeypatch):
+    monkeypatch.setattr(_cellpose.models, 'CellposeModel', _fakeModel)
+    _cellpose.unloadModel()
+
+    model = _cellpose.getCellposeModel('/models/a', gpu=False)
+    assert _cellpose.getCellposeModel('/models/a', gpu=False) is model
+    assert _cellpose.getCellposeModel('/models/a', gpu=False, device='cpu') is not model
+
+    warm = _cellpose.warmupModel('/models/b', gpu=False)
+    assert warm.numEval == 1
+    assert _cellpose.getCellposeModel('/models/b', gpu=False) is warm
+
+    _cellpose.unloadModel('/models/a')
+    assert _cellpose.getCellposeModel('/models/a', gpu=False) is not model
+    assert _cellpose.getCellposeModel('/models/b', gpu=False) is warm
+
+    _cellpose.unloadModel()
+    assert len(_cellpose._modelCache) == 0
+
+def test_cpu_options(monkeypatch):
+    monkeypatch.setattr(_cellpose.models, 'CellposeModel', _fakeModel)
+    _cellpose.unloadModel()
+
+    gpu, device = _cellpose.getCellposeDevice('cpu')
+    assert not gpu
+    assert str(device) == 'cpu'
+
+    model = _cellpose.getCellposeModel('/models/a', gpu=False, device=device)
+    bf16 = _cellpose.getCellposeModel('/models/a', gpu=False, device=device, precision='bfloat16')
+    assert bf16 is not model
+
+    with pytest.raises(ValueError):
+        _cellpose.getCellposeModel('/models/a', gpu=False, precision='float8')
+
+    _cellpose.unloadModel()
+
+def test_needs_segmentation(tmp_path):
+    from napari_dapi_ring_analysis.oligoStore import _getBaseSaveFile
+
+    cziPath = str(tmp_path / 'FST' / 'B35_Slice2_RS_DS1.czi')
+    baseSaveFile = _getBaseSaveFile(cziPath)
+    os.makedirs(os.path.split(baseSaveFile)[0])
+    assert _cellpose.needsSegmentation(cziPath)
+
+    open(baseSaveFile + '.tif', 'w').close()
+    open(baseSaveFile + '_seg.npy', 'w').close()
+    os.utime(baseSaveFile + '.tif', (1000, 1000))
+    os.utime(baseSaveFile + '_seg.npy', (2000, 2000))
+    assert not _cellpose.needsSegmentation(cziPath)
+
+    # rgb was remade after segmentation
+    os.utime(baseSaveFile + '.tif', (3000, 3000))
+    assert _cellpose.needsSegmentation(cziPath)
+
+def test_needs_segmentation_zarr(tmp_path):
+    import numpy as np
+    from napari_dapi_ring_analysis import oligoStore
+
+    cziPath = str(tmp_path / 'FST' / 'B35_Slice2_RS_DS1.czi')
+    store = oligoStore.getStore(cziPath, 'zarr')
+    store.saveArray('rgb', np.zeros((2, 8, 8, 3), dtype=np.uint8))
+    assert _cellpose.needsSegmentation(cziPath)
+
+    # no rgb tif, compare with the rgb array in the container
+    rgbArrayPath = os.path.join(store._zarrPath, 'rgb')
+    os.utime(rgbArrayPath, (1000, 1000))
+    np.save(store._getSegPath(), {'masks': np.zeros((2, 8, 8), dtype=np.uint16)}, allow_pickle=True)
+    os.utime(store._getSegPath(), (2000, 2000))
+    assert not _cellpose.needsSegmentation(cziPath)
+
+    os.utime(rgbArrayPath, (3000, 3000))
+    assert _cellpose.needsSegmentation(cziPath)
+
+def _checkCoreShares(cores, numWorkers):
+    shares = [_cellpose._getCoreShare(_idx, numWorkers) for _idx in range(numWorkers)]
+    assert all(len(_share) >= 1 for _share in shares)
+    # disjoint and together all the cores
+    assert sum(len(_share) for _share in shares) == len(cores)
+    assert set().union(*shares) == set(cores)
+
+def test_core_share(monkeypatch):
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    for numWorkers in range(1, min(len(cores), 4) + 1):
+        _checkCoreShares(cores, numWorkers)
+
+    # more workers than cores share cores
+    assert _cellpose._getCoreShare(len(cores), len(cores) + 1) == [cores[0]]
+
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: {0, 1, 2, 3, 8, 9, 10}, raising=False)
+    for numWorkers in range(1, 8):
+        _checkCoreShares([0, 1, 2, 3, 8, 9, 10], numWorkers)
+
+def _makeRgbAndSeg(cziPath, rgbMtime, segMtime):
+    from napari_dapi_ring_analysis.oligoStore import _getBaseSaveFile
+    baseSaveFile = _getBaseSaveFile(cziPath)
+    os.makedirs(os.path.split(baseSaveFile)[0], exist_ok=True)
+    open(baseSaveFile + '.tif', 'w').close()
+    os.utime(baseSaveFile + '.tif', (rgbMtime, rgbMtime))
+    if segMtime is not None:
+        open(baseSaveFile + '_seg.npy', 'w').close()
+        os.utime(baseSaveFile + '_seg.npy', (segMtime, segMtime))
+
+def test_segment_folders(tmp_path, monkeypatch):
+    folderPath = str(tmp_path / 'FST')
+    os.makedirs(folderPath)
+    cziPaths = [os.path.join(folderPath, f'{_name}.czi') for _name in ['a', 'b', 'c']]
+    for cziPath in cziPaths:
+        open(cziPath, 'w').close()
+    # a was segmented before
+    _makeRgbAndSeg(cziPaths[0], 1000, 2000)
+
+    segmented = []
+    failFiles = ['c.czi']
+    def _fakeSegmentStack(cziPath):
+        # stands in for rgb stack and cellpose model
+        segmented.append(os.path.split(cziPath)[1])
+        if os.path.split(cziPath)[1] in failFiles:
+            return {'folder': os.path.split(cziPath)[0], 'file': os.path.split(cziPath)[1], 'status': 'error'}
+        _makeRgbAndSeg(cziPath, 1000, 2000)
+        return {'folder': os.path.split(cziPath)[0], 'file': os.path.split(cziPath)[1], 'status': 'done'}
+    monkeypatch.setattr(_cellpose, '_segmentStack', _fakeSegmentStack)
+
+    # results stream as each stack finishes
+    resultIter = _cellpose.iterSegmentFolders([folderPath], numWorkers=1)
+    assert next(resultIter)['status'] == 'skipped'
+    assert segmented == []
+    assert next(resultIter)['file'] == 'b.czi'
+    assert segmented == ['b.czi']
+    assert next(resultIter)['status'] == 'error'
+    assert next(resultIter, None) is None
+
+    # resume only runs the stack that failed
+    failFiles = []
+    segmented.clear()
+    # a trailing slash is the same folder
+    df = _cellpose.segmentFolders([folderPath + os.sep], numWorkers=1)
+    assert df['status'].tolist() == ['skipped', 'skipped', 'done']
+    assert df['folder'].unique().tolist() == [folderPath]
+    assert segmented == ['c.czi']
+
+    # forceRun runs everything
+    segmented.clear()
+    df = _cellpose.segmentFolders([folderPath], numWorkers=1, forceRun=True)
+    assert df['status'].tolist() == ['done'] * 3
+
+class _labelModel():
+    """Label thresholded blobs, stands in for cellpose in tiled eval.
+    """
+    def eval(self, imgData, **kwargs):
+        from scipy import ndimage
+        masks, _ = ndimage.label(imgData[..., 1] > 0)
+        return masks, None, None
+
+def test_eval_tiled():
+    import numpy as np
+    from scipy import ndimage
+
+    assert _cellpose.getTiles(100, 200, 10) == [(0, 100, 0, 100)]
+    tiles = _cellpose.getTiles(100, 40, 10)
+    assert tiles[0][2] == 0 and tiles[-1][3] == 100
+    assert all(_a[3] == _b[2] for _a, _b in zip(tiles[:-1], tiles[1:]))
+
+    # 3 x 12 x 12 blobs on a 120 x 120 grid, some on tile seams
+    imgData = np.zeros((3, 120, 120, 3), dtype=np.uint8)
+    for y in range(4, 120, 20):
+        for x in range(4, 120, 20):
+            imgData[:, y:y+12, x:x+12, 1] = 255
+
+    masks = _cellpose.evalTiled(_labelModel(), imgData, tileSize=50, tileOverlap=14)
+    _, numObjects = ndimage.label(imgData[..., 1] > 0)
+    assert masks.max() == numObjects
+    assert np.array_equal(masks > 0, imgData[..., 1] > 0)
+    # each blob has exactly one label
+    for _objSlice in ndimage.find_objects(masks):
+        assert len(np.unique(masks[_objSlice])) == 1
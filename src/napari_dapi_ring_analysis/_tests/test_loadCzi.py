@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import tifffile
+
+from napari_dapi_ring_analysis import loadCzi
+
+
+def _makeStack(path):
+    tifffile.imwrite(path, np.zeros((3, 2, 16, 16), dtype=np.uint16),
+                        imagej=True, metadata={'axes': 'ZCYX'})
+    return str(path)
+
+
+def test_get_reader_is_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(loadCzi, 'readerCacheSize', 2)
+    loadCzi.closeReader()
+
+    path1 = _makeStack(tmp_path / 'a.tif')
+    path2 = _makeStack(tmp_path / 'b.tif')
+    path3 = _makeStack(tmp_path / 'c.tif')
+
+    img1 = loadCzi.getReader(path1)
+    assert loadCzi.getReader(path1) is img1
+
+    # modified file gets a new reader
+    _stat = os.stat(path1)
+    os.utime(path1, (_stat.st_atime, _stat.st_mtime + 10))
+    img1 = loadCzi.getReader(path1)
+    assert loadCzi.getReader(path1) is img1
+
+    # least recently used is evicted
+    img2 = loadCzi.getReader(path2)
+    loadCzi.getReader(path1)
+    loadCzi.getReader(path3)
+    assert loadCzi.getReader(path1) is img1
+    assert loadCzi.getReader(path2) is not img2
+
+    loadCzi.closeReader(path1)
+    assert loadCzi.getReader(path1) is not img1
+
+    loadCzi.closeReader()
+
+
+def test_lazy_czi_channel(tmp_path):
+    data = np.arange(3 * 2 * 4 * 5, dtype=np.uint16).reshape(3, 2, 4, 5)
+    path = str(tmp_path / 'lazy.tif')
+    tifffile.imwrite(path, data, imagej=True, metadata={'axes': 'ZCYX'})
+
+    lazy = loadCzi.lazyCziChannel(path, 1)
+
+    assert lazy.shape == (3, 4, 5)
+    assert lazy.dtype == np.uint16
+    assert np.array_equal(lazy[1], data[1, 1])
+    assert np.array_equal(lazy[0:2], data[0:2, 1])
+    assert np.array_equal(np.asarray(lazy), data[:, 1])
+    assert int(np.min(lazy)) == data[:, 1].min()
+    assert int(np.max(lazy)) == data[:, 1].max()
+
+    loadCzi.closeReader()
+
+
+def test_load_folder_index(tmp_path, monkeypatch):
+    loadedPaths = []
+
+    def _fakeLoadHeader(path):
+        loadedPaths.append(path)
+        return {'file': os.path.split(path)[1], 'zPixels': 3, 'path': path}
+
+    monkeypatch.setattr(loadCzi, '_loadHeader', _fakeLoadHeader)
+
+    folderPath = str(tmp_path)
+    for _folder in ['a', 'b']:
+        os.mkdir(os.path.join(folderPath, _folder))
+        with open(os.path.join(folderPath, _folder, f'{_folder}.czi'), 'w') as f:
+            f.write('czi')
+
+    df = loadCzi.loadFolder(folderPath)
+    assert df['path'].tolist() == ['a/a.czi', 'b/b.czi']
+    assert len(loadedPaths) == 2
+
+    # second load is all from the index
+    df2 = loadCzi.loadFolder(folderPath)
+    assert len(loadedPaths) == 2
+    assert df2.equals(df)
+
+    # only changed and new files are loaded
+    with open(os.path.join(folderPath, 'a', 'a.czi'), 'w') as f:
+        f.write('czi changed')
+    with open(os.path.join(folderPath, 'c.czi'), 'w') as f:
+        f.write('czi')
+    os.remove(os.path.join(folderPath, 'b', 'b.czi'))
+
+    df3 = loadCzi.loadFolder(folderPath)
+    assert df3['path'].tolist() == ['a/a.czi', 'c.czi']
+    assert len(loadedPaths) == 4
+
+
+def test_load_folder_parallel(tmp_path, monkeypatch):
+    monkeypatch.setattr(loadCzi, '_loadHeader',
+                        lambda path: {'file': os.path.split(path)[1], 'path': path})
+
+    folderPath = str(tmp_path)
+    fileList = [f'{idx:02d}.czi' for idx in range(20)]
+    for file in fileList:
+        with open(os.path.join(folderPath, file), 'w') as f:
+            f.write('czi')
+
+    progress = []
+    df = loadCzi.loadFolder(folderPath, useIndex=False, numWorkers=4,
+                    progressCallback=lambda numDone, numTotal: progress.append(numDone))
+
+    assert df['path'].tolist() == fileList
+    assert sorted(progress) == list(range(1, 21))
@@ -0,0 +1,27 @@
+import os
+
+from napari_dapi_ring_analysis import loadCzi
+from napari_dapi_ring_analysis.oligoAnalysisFolder import oligoAnalysisFolder
+
+
+def test_folder_is_lazy(tmp_path, monkeypatch):
+    monkeypatch.setattr(loadCzi, '_loadHeader',
+                        lambda path: {'file': os.path.split(path)[1], 'path': path,
+                                        'zPixels': 3, 'xPixels': 16, 'yPixels': 16})
+
+    folderPath = str(tmp_path)
+    fileList = ['B35_Slice2_RS_DS1.czi', 'B36_Slice1_LS_DS2.czi']
+    for file in fileList:
+        with open(os.path.join(folderPath, file), 'w') as f:
+            f.write('czi')
+
+    oaf = oligoAnalysisFolder(folderPath, numWorkers=2)
+    df = oaf.getAnalysisDataFrame()
+    assert df['file'].tolist() == fileList
+    assert not any(_lazy.isMade() for _lazy in oaf._analysisList.values())
+
+    filePath = os.path.join(folderPath, fileList[0])
+    oa = oaf.getOligoAnalysis(filePath, loadImages=False)
+    assert oa.getHeader()['file'] == fileList[0]
+    assert oaf._analysisList[filePath].isMade()
+    assert oaf.getOligoAnalysis(filePath, loadImages=False) is oa
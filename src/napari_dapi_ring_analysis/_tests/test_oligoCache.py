@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import tifffile
+
+from napari_dapi_ring_analysis import oligoCache, oligoUtils
+from napari_dapi_ring_analysis.oligoAnalysis import oligoAnalysis, imageChannels
+
+
+def test_cache_key():
+    assert oligoCache.makeCacheKey(a=1, b=[1, 2]) == oligoCache.makeCacheKey(b=(1, 2), a=1)
+    assert oligoCache.makeCacheKey(a=1) != oligoCache.makeCacheKey(a=2)
+
+
+def test_cache_lru(tmp_path):
+    data = np.zeros((4, 32, 32), dtype=np.float32)
+    cache = oligoCache.artifactCache(str(tmp_path))
+    cache.save('a', data)
+    oneSize = os.path.getsize(os.path.join(str(tmp_path), 'a.tif'))
+
+    cache = oligoCache.artifactCache(str(tmp_path), maxBytes=2 * oneSize)
+    cache.save('b', data)
+    os.utime(os.path.join(str(tmp_path), 'a.tif'), ns=(1, 1))
+    os.utime(os.path.join(str(tmp_path), 'b.tif'), ns=(2, 2))
+    assert cache.load('a') is not None  # a is now most recently used
+    cache.save('c', data)
+
+    assert cache.has('a')
+    assert not cache.has('b')
+    assert cache.has('c')
+
+
+def test_analysis_cache(tmp_path, monkeypatch):
+    folderPath = os.path.join(str(tmp_path), 'FST')
+    os.mkdir(folderPath)
+    path = os.path.join(folderPath, 'B35_Slice2_RS_DS1.tif')
+    imgData = (np.random.default_rng(0).random((4, 2, 32, 32)) * 4000).astype(np.uint16)
+    tifffile.imwrite(path, imgData, imagej=True, metadata={'axes': 'ZCYX'})
+
+    numOtsu = []
+    _getOtsuThreshold = oligoUtils.getOtsuThreshold
+    def _countOtsu(*args, **kwargs):
+        numOtsu.append(1)
+        return _getOtsuThreshold(*args, **kwargs)
+    monkeypatch.setattr(oligoUtils, 'getOtsuThreshold', _countOtsu)
+
+    oa = oligoAnalysis(path)
+    oa.load()
+    oa.save()
+    assert len(numOtsu) == 2  # cyto and dapi
+    mask1 = oa.getImageMask(imageChannels.cyto)
+    key1 = oa.getCacheKey('mask-cyto')
+    assert not oa._cache.has(key1)  # only in the store
+
+    # saved with current parameters
+    oa = oligoAnalysis(path)
+    oa.load()
+    assert len(numOtsu) == 3  # only dapi, it is not saved
+
+    # new sigma invalidates the saved cyto mask
+    oa.analyzeImageMask(imageChannels.cyto, gaussianSigma=2)
+    oa.save()
+    assert len(numOtsu) == 4
+    key2 = oa.getCacheKey('mask-cyto')
+    assert oa._cache.has(key1)  # replaced, moved to the cache
+    assert not oa._cache.has(key2)
+
+    # back to sigma 1 loads from the cache
+    oa._header['cytoGausSigma'] = 1
+    assert np.array_equal(oa.loadImageMask(imageChannels.cyto), mask1)
+    assert len(numOtsu) == 4
+    assert not oa._cache.has(key1)
+    assert oa._cache.has(key2)
+
+    # otsu method is part of the key
+    _key = oa.getCacheKey('mask-cyto')
+    oa._header['otsuMethod'] = 'skimage'
+    assert oa.getCacheKey('mask-cyto') != _key
+    assert oa.loadImageMask(imageChannels.cyto) is None
+    oa._header['otsuMethod'] = 'histogram'
+
+    # saved without a cache key is recomputed
+    oa._header['cacheKeys'].pop('mask-cyto')
+    assert oa.loadImageMask(imageChannels.cyto) is None
+
+    # a new raw file invalidates everything
+    _mtime = os.stat(path).st_mtime_ns
+    tifffile.imwrite(path, imgData[:, ::-1], imagej=True, metadata={'axes': 'ZCYX'})
+    os.utime(path, ns=(_mtime + 10**9, _mtime + 10**9))
+    oa = oligoAnalysis(path)
+    assert oa.loadImageMask(imageChannels.cyto) is None
@@ -0,0 +1,113 @@
+import os
+import time
+
+import numpy as np
+import pytest
+import tifffile
+
+from napari_dapi_ring_analysis import oligoAnalysisBatch, oligoPipeline, oligoUtils
+from napari_dapi_ring_analysis.oligoAnalysis import oligoAnalysis
+
+
+def test_file_pipeline(tmp_path, monkeypatch):
+    folderPath = os.path.join(str(tmp_path), 'FST')
+    os.mkdir(folderPath)
+    path = os.path.join(folderPath, 'B35_Slice2_RS_DS1.tif')
+    imgData = (np.random.default_rng(0).random((4, 2, 32, 32)) * 4000).astype(np.uint16)
+    tifffile.imwrite(path, imgData, imagej=True, metadata={'axes': 'ZCYX'})
+
+    numOtsu = []
+    _getOtsuThreshold = oligoUtils.getOtsuThreshold
+    def _countOtsu(*args, **kwargs):
+        numOtsu.append(1)
+        return _getOtsuThreshold(*args, **kwargs)
+    monkeypatch.setattr(oligoUtils, 'getOtsuThreshold', _countOtsu)
+
+    params = {'cytoSigma': 0.7, 'dapiSigma': 3}
+    stageNames = ['masks']
+
+    # stop after rgb, like a crash
+    def _crash(oa, params):
+        raise RuntimeError('crash')
+    monkeypatch.setattr(oligoPipeline.pipelineStages[2], 'run', _crash)
+    oa = oligoAnalysis(path)
+    with pytest.raises(RuntimeError):
+        oligoPipeline.runFilePipeline(oa, params, stageNames=stageNames)
+    monkeypatch.undo()
+    monkeypatch.setattr(oligoUtils, 'getOtsuThreshold', _countOtsu)
+
+    # resume at masks
+    oa = oligoAnalysis(path)
+    results = oligoPipeline.runFilePipeline(oa, params, stageNames=stageNames)
+    assert [_result['status'] for _result in results] == ['skipped', 'done']
+    assert len(numOtsu) == 2
+
+    # up to date, nothing is loaded
+    oa = oligoAnalysis(path)
+    results = oligoPipeline.runFilePipeline(oa, params, stageNames=stageNames)
+    assert [_result['status'] for _result in results] == ['skipped', 'skipped']
+    assert oa._rgbStack is None
+    assert oa.getHeader()['cytoDapiRatio'] is not None
+
+    # new parameters only rerun masks
+    params['cytoSigma'] = 1
+    results = oligoPipeline.runFilePipeline(oa, params, stageNames=stageNames)
+    assert [_result['status'] for _result in results] == ['skipped', 'done']
+    assert len(numOtsu) == 4
+
+def _fakeRunFile(task):
+    # runs in a spawned worker, uneven durations so tasks finish out of order
+    _start = time.time()
+    time.sleep(task['sleep'])
+    return {'header': {'path': task['path']}, 'results': [],
+            'start': _start, 'stop': time.time()}
+
+def test_run_parallel(monkeypatch):
+    monkeypatch.setattr(oligoPipeline, '_runFile', _fakeRunFile)
+    budgetBytes = 4
+    stackBytesList = [3, 1, 1, 2, 6, 1, 2]  # 6 is over the budget and runs alone
+    sleepList = [0.6, 0.1, 0.4, 0.2, 0.3, 0.1, 0.2]
+    taskList = [{'path': f'/data/FST/B{_idx}.czi', 'stackBytes': _bytes, 'sleep': _sleep}
+                for _idx, (_bytes, _sleep) in enumerate(zip(stackBytesList, sleepList))]
+
+    finished = []
+    resultList = oligoPipeline._runParallel(taskList, numWorkers=3, budgetBytes=budgetBytes,
+                                            resultCallback=finished.append)
+    assert [_result['header']['path'] for _result in resultList] == [_task['path'] for _task in taskList]
+    assert len(finished) == len(taskList)
+
+    # bytes of tasks running at the same time, at each task start
+    for _idx, _result in enumerate(resultList):
+        _running = [_other for _other, _otherResult in enumerate(resultList)
+                    if _otherResult['start'] <= _result['start'] < _otherResult['stop']]
+        runningBytes = sum(stackBytesList[_other] for _other in _running)
+        if stackBytesList[_idx] > budgetBytes:
+            assert _running == [_idx]
+        else:
+            assert runningBytes <= budgetBytes
+
+def test_batch_runs_parallel(monkeypatch):
+    taskList = [{'folderPath': '/data/FST', 'path': f'/data/FST/B{_idx}.czi', 'stackBytes': 100}
+                for _idx in range(4)]
+    monkeypatch.setattr(oligoPipeline, 'getTaskList', lambda *args, **kwargs: taskList)
+
+    calls = []
+    def _fakeRunParallel(taskList, numWorkers, budgetBytes, resultCallback=None):
+        calls.append((numWorkers, budgetBytes))
+        return [{'header': {'path': _task['path']}, 'results': []} for _task in taskList]
+    monkeypatch.setattr(oligoPipeline, '_runParallel', _fakeRunParallel)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 8)
+
+    # pool is sized from the budget by default
+    df = oligoAnalysisBatch.batchMakeAnalysis(['/data/FST'], budgetBytes=250)
+    assert calls == [(2, 250)]
+    assert df['path'].tolist() == [_task['path'] for _task in taskList]
+
+def test_num_workers():
+    header = {'xPixels': 1024, 'yPixels': 1024, 'zPixels': 20}
+    stackBytes = oligoPipeline.estimateStackBytes(header)
+    assert stackBytes > 1024 * 1024 * 20 * 2
+
+    assert oligoPipeline.getNumWorkers([stackBytes] * 8, budgetBytes=3 * stackBytes, maxWorkers=16) == 3
+    assert oligoPipeline.getNumWorkers([stackBytes] * 2, budgetBytes=3 * stackBytes, maxWorkers=16) == 2
+    assert oligoPipeline.getNumWorkers([stackBytes] * 8, budgetBytes=stackBytes // 2) == 1
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.ndimage
+
+from napari_dapi_ring_analysis import oligoRing
+
+
+def _ringAnalysisFullVolume(labelMask, cytoMask, dilateIterations, erodeIterations):
+    """Reference, full volume dilate/erode for each label."""
+    dapi_final_mask = np.zeros(labelMask.shape, dtype=np.int64)
+    listOfDict = []
+    for maskLabel in np.unique(labelMask)[1:]:
+        _oneMask = labelMask == maskLabel
+        _dilatedMask = _oneMask
+        if dilateIterations > 0:
+            _dilatedMask = scipy.ndimage.binary_dilation(_oneMask, iterations=dilateIterations)
+        _erodedMask = _oneMask
+        if erodeIterations > 0:
+            _erodedMask = scipy.ndimage.binary_erosion(_oneMask, iterations=erodeIterations)
+        finalMask = _dilatedMask ^ _erodedMask
+        dapi_final_mask[finalMask] += maskLabel + 1
+        listOfDict.append({
+            'label': maskLabel,
+            'finalMaskCount': np.count_nonzero(finalMask),
+            'cytoImageMaskSum': np.sum(np.where(finalMask, cytoMask, 0)),
+        })
+    return dapi_final_mask, pd.DataFrame(listOfDict)
+
+
+@pytest.mark.parametrize("dilateIterations, erodeIterations",
+                            [(2, 2), (0, 2), (2, 0), (3, 1), (1, 3)])
+def test_ring_analysis_matches_per_label(dilateIterations, erodeIterations):
+    # touching labels and labels on the image border
+    labelMask, cytoMask = oligoRing.makeTestLabels((9, 48, 48), numLabels=30,
+                                                    radius=6, seed=1)
+
+    finalMask, dfLabels = oligoRing.ringAnalysis(labelMask, cytoMask,
+                                    dilateIterations, erodeIterations,
+                                    chunkSize=128)
+    finalMask0, dfLabels0 = oligoRing.ringAnalysisPerLabel(labelMask, cytoMask,
+                                    dilateIterations, erodeIterations)
+
+    assert finalMask.dtype == finalMask0.dtype
+    assert np.array_equal(finalMask, finalMask0)
+    pd.testing.assert_frame_equal(dfLabels, dfLabels0)
+
+    finalMaskRef, dfRef = _ringAnalysisFullVolume(labelMask, cytoMask,
+                                    dilateIterations, erodeIterations)
+    assert np.array_equal(finalMask0, finalMaskRef)
+    pd.testing.assert_frame_equal(dfLabels0[dfRef.columns], dfRef)
+
+
+def test_ring_analysis_no_labels():
+    labelMask = np.zeros((3, 10, 10), dtype=np.uint16)
+    cytoMask = np.ones((3, 10, 10), dtype=bool)
+
+    finalMask, dfLabels = oligoRing.ringAnalysis(labelMask, cytoMask)
+
+    assert not finalMask.any()
+    assert len(dfLabels) == 0
+
+
+def test_sweep_ring_analysis_matches_ring_analysis():
+    labelMask, cytoMask = oligoRing.makeTestLabels((9, 48, 48), numLabels=30,
+                                                    radius=6, seed=2)
+    dilateRange = range(0, 4)
+    erodeRange = [0, 1, 3]
+
+    dfSweep = oligoRing.sweepRingAnalysis(labelMask, cytoMask,
+                                            dilateRange, erodeRange)
+
+    assert len(dfSweep) == len(dilateRange) * len(erodeRange) * 30
+    for dilateIterations in dilateRange:
+        for erodeIterations in erodeRange:
+            _, dfLabels = oligoRing.ringAnalysis(labelMask, cytoMask,
+                                    dilateIterations, erodeIterations)
+            _rows = (dfSweep['dilateIterations'] == dilateIterations) \
+                        & (dfSweep['erodeIterations'] == erodeIterations)
+            dfOne = dfSweep[_rows].reset_index(drop=True)
+            _columns = ['label', 'finalMaskCount', 'cytoImageMaskSum',
+                        'cytoImageMaskPercent']
+            pd.testing.assert_frame_equal(dfOne[_columns], dfLabels[_columns])
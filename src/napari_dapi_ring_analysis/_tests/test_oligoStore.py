@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from napari_dapi_ring_analysis import oligoStore
+
+
+@pytest.mark.parametrize('storage', oligoStore.storageBackends)
+def test_store_round_trip(tmp_path, storage):
+    rawPath = os.path.join(str(tmp_path), 'B35_Slice2_RS_DS1.czi')
+    store = oligoStore.getStore(rawPath, storage)
+
+    assert store.loadArray('mask-cyto') is None
+    assert store.loadHeader() is None
+    assert store.loadLabels() is None
+    assert oligoStore.loadSavedRgb(store._baseSaveFile + '.tif') is None
+
+    rng = np.random.default_rng(0)
+    mask = rng.random((4, 8, 8)) > 0.5
+    store.saveArray('mask-cyto', mask)
+    assert store.hasArray('mask-cyto')
+    assert np.array_equal(store.loadArray('mask-cyto'), mask)
+    assert np.array_equal(store.loadArray('mask-cyto', zSlice=2), mask[2])
+    assert np.array_equal(store.loadArray('mask-cyto', zSlice=slice(1, 3)), mask[1:3])
+
+    rgb = rng.integers(0, 255, (4, 8, 8, 3), dtype=np.uint8)
+    with store.arrayWriter('rgb', rgb.shape, np.uint8, photometric='rgb') as _rgb:
+        _rgb[:] = rgb
+    assert np.array_equal(store.loadArray('rgb'), rgb)
+    assert np.array_equal(store.loadArray('rgb', zSlice=1), rgb[1])
+    # cellpose is given the rgb tif path, the zarr backend has no tif
+    assert np.array_equal(oligoStore.loadSavedRgb(store._baseSaveFile + '.tif'), rgb)
+
+    header = {'gaussianSigma': 1, 'cytoOtsuThreshold': 12.5, 'cellpose': ''}
+    store.saveHeader(header)
+    assert store.loadHeader() == header
+    with pytest.raises(TypeError):
+        store.saveHeader({'bad': object()})
+    assert store.loadHeader() == header
+
+    df = pd.DataFrame({'label': [1, 2], 'cytoImageMaskPercent': [0.5, 1.5],
+                        'accept': ['', 'no']})
+    store.saveLabels(df)
+    dfLoaded = store.loadLabels()
+    assert dfLoaded['label'].tolist() == [1, 2]
+    assert dfLoaded['cytoImageMaskPercent'].tolist() == [0.5, 1.5]
+    assert dfLoaded['accept'].fillna('').tolist() == ['', 'no']
+
+
+def test_zarr_store_imports_cellpose(tmp_path):
+    rawPath = os.path.join(str(tmp_path), 'B35_Slice2_RS_DS1.czi')
+    store = oligoStore.getStore(rawPath, 'zarr')
+    assert not store.hasArray('cellpose-mask')
+
+    masks = np.arange(4 * 8 * 8, dtype=np.uint16).reshape(4, 8, 8)
+    store.getSaveFolder()
+    np.save(store._getSegPath(), {'masks': masks}, allow_pickle=True)
+    assert store.hasArray('cellpose-mask')
+    assert np.array_equal(store.loadArray('cellpose-mask'), masks)
+    assert np.array_equal(store.loadArray('cellpose-mask', zSlice=3), masks[3])
+
+
+@pytest.mark.parametrize('storage', oligoStore.storageBackends)
+def test_store_load_mask(tmp_path, storage):
+    rawPath = os.path.join(str(tmp_path), 'B35_Slice2_RS_DS1.czi')
+    store = oligoStore.getStore(rawPath, storage)
+
+    mask = np.random.default_rng(1).random((3, 16, 16)) > 0.7
+    store.saveArray('mask-cyto', mask)
+    out = np.zeros(mask.shape, dtype=bool)
+    assert store.loadMask('mask-cyto', out=out) is out
+    assert np.array_equal(out, mask)
+
+    # masks saved one byte per voxel still load as bool
+    store.saveArray('mask-dapi', mask.astype(np.uint8) * 255)
+    loaded = store.loadMask('mask-dapi')
+    assert loaded.dtype == bool
+    assert np.array_equal(loaded, mask)
+
+    assert store.loadMask('dapi-final-mask') is None
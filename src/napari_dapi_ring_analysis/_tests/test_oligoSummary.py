@@ -0,0 +1,36 @@
+import os
+
+import numpy as np
+
+from napari_dapi_ring_analysis import oligoSummary
+
+
+def _header(folder, file, percent):
+    return {'path': os.path.join(folder, file), 'cytoMaskPercent': np.float64(percent),
+            'num labels': np.int64(3), 'cacheKeys': {'rgb': 'abc'}}
+
+
+def test_summary_upsert(tmp_path):
+    dbPath = os.path.join(str(tmp_path), 'summary.sqlite')
+    fst = '/data/20221010/FST'
+    saline = '/data/20221010/Saline'
+
+    oligoSummary.replaceFolder(dbPath, fst, [_header(fst, 'a.czi', 1), _header(fst, 'b.czi', 2)])
+    oligoSummary.replaceFolder(dbPath, saline, [_header(saline, 'c.czi', 3)])
+    oligoSummary.upsertRows(dbPath, [_header(fst, 'a.czi', 10)])
+
+    df = oligoSummary.loadSummary(dbPath)
+    assert df['cytoMaskPercent'].tolist() == [10, 2, 3]
+    assert 'cacheKeys' not in df.columns
+
+    # b.czi was removed from the folder, only FST is changed
+    oligoSummary.replaceFolder(dbPath, fst, [_header(fst, 'a.czi', 10)])
+    assert oligoSummary.loadSummary(dbPath, [fst])['path'].tolist() == [os.path.join(fst, 'a.czi')]
+    assert len(oligoSummary.loadSummary(dbPath)) == 2
+
+    # a sibling folder with the same prefix is not part of the folder
+    assert len(oligoSummary.loadSummary(dbPath, ['/data/20221010/FS'])) == 0
+
+    # folders in any order, nested folders do not duplicate rows
+    _paths = oligoSummary.loadSummary(dbPath, [saline, '/data/20221010', fst])['path'].tolist()
+    assert _paths == [os.path.join(fst, 'a.czi'), os.path.join(saline, 'c.czi')]
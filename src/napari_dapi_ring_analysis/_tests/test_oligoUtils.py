@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from napari_dapi_ring_analysis import oligoUtils
+
+
+@pytest.mark.parametrize("dtype, maxValue", [(np.uint8, 255), (np.uint16, 4000)])
+def test_get_channel_stats(dtype, maxValue):
+    rng = np.random.default_rng(0)
+    imgData = rng.integers(3, maxValue, (4, 37, 23)).astype(dtype)
+    percentiles = [0, 1, 33.3, 50, 99, 100]
+
+    stats = oligoUtils.getChannelStats(imgData, percentiles)
+
+    assert stats['min'] == imgData.min()
+    assert stats['max'] == imgData.max()
+    assert stats['mean'] == pytest.approx(imgData.mean())
+    for p in percentiles:
+        assert stats['percentiles'][p] == pytest.approx(np.percentile(imgData, p))
+    assert stats['histogram'].sum() == imgData.size
+
+
+@pytest.mark.parametrize("dtype", oligoUtils.filteredDtypes)
+def test_reduce_precision(dtype):
+    imgData = np.random.default_rng(0).random((3, 16, 16)) * 0.2 + 0.1
+
+    imgReduced, scale, offset = oligoUtils.reducePrecision(imgData, dtype)
+    assert imgReduced.dtype == np.dtype(dtype)
+
+    restored = oligoUtils.restorePrecision(imgReduced, scale, offset)
+    assert restored.dtype == np.float32
+    # half an integer step, or float rounding
+    tolerance = max(scale / 2, 1e-3 * imgData.max())
+    assert np.abs(restored - imgData).max() <= tolerance * 1.01
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+@pytest.mark.parametrize("sigma", [1, (0, 1, 1), (2, 1, 0.5)])
+def test_otsu_histogram(dtype, sigma):
+    rng = np.random.default_rng(0)
+    # continuous histogram, with a gap any threshold in the gap is an otsu threshold
+    imgData = (rng.beta(2, 5, (6, 40, 30)) * np.iinfo(dtype).max).astype(dtype)
+
+    threshold, blurred, binary = oligoUtils.getOtsuThreshold(imgData, sigma, method='histogram')
+    skThreshold, skBlurred, skBinary = oligoUtils.getOtsuThreshold(imgData, sigma, method='skimage')
+
+    assert blurred.dtype == np.float32
+    assert np.allclose(blurred, skBlurred, atol=1e-6)
+    # within one skimage histogram bin
+    binWidth = (skBlurred.max() - skBlurred.min()) / 256
+    assert abs(threshold - skThreshold) <= binWidth
+    assert np.array_equal(binary, blurred > threshold)
+
+
+def test_sweep_otsu_threshold():
+    rng = np.random.default_rng(0)
+    imgData = (rng.beta(2, 5, (6, 40, 30)) * 255).astype(np.uint8)
+    sigmas = [2, 0.7, (0, 1, 1), 1]
+
+    results, masks = oligoUtils.sweepOtsuThreshold(imgData, sigmas, returnMasks=True)
+    for sigma, oneResult, mask in zip(sigmas, results, masks):
+        threshold, _, binary = oligoUtils.getOtsuThreshold(imgData, sigma)
+        assert oneResult['sigma'] == sigma
+        assert oneResult['otsuThreshold'] == threshold
+        assert oneResult['maskPixels'] == np.count_nonzero(binary)
+        assert np.array_equal(mask, binary)
+
+    cascaded = oligoUtils.sweepOtsuThreshold(imgData, sigmas, cascade=True)
+    for oneResult, oneCascaded in zip(results, cascaded):
+        assert oneCascaded['maskPercent'] == pytest.approx(oneResult['maskPercent'], abs=1)
+
+
+def test_aics_segment_slices():
+    from aicssegmentation.core.pre_processing_utils import intensity_normalization, image_smoothing_gaussian_3d
+    from aicssegmentation.core.vessel import filament_2d_wrapper
+
+    rng = np.random.default_rng(0)
+    imgData = (rng.random((9, 48, 40)) * 3000).astype(np.uint16)
+    imgData[:, 20:23, :] += 3000
+    f2_param = [[1.25, 0.16], [2.5, 0.16/2]]
+
+    # aicsSegment() with numWorkers=1, without remove_small_objects
+    imgNorm = intensity_normalization(imgData.copy(), scaling_param=[1, 17])
+    imgSmooth = image_smoothing_gaussian_3d(imgNorm, sigma=1)
+    imgFilament = filament_2d_wrapper(imgSmooth, f2_param)
+
+    retDict = oligoUtils.aicsSegment(imgData.copy(), f2_param=f2_param, numWorkers=2)
+    assert np.allclose(retDict['imgSmooth'], imgSmooth, rtol=0, atol=1e-12)
+    assert np.array_equal(retDict['imgFilament'], imgFilament)
+
+    processDict = oligoUtils.aicsSegment(imgData.copy(), f2_param=f2_param, numWorkers=2,
+                                            useProcesses=True)
+    assert np.array_equal(processDict['imgFilament'], imgFilament)
+
+    leanDict = oligoUtils.aicsSegment(imgData, f2_param=f2_param, numWorkers=2, lean=True)
+    assert list(leanDict.keys()) == ['imgRemoveSmall']
+    assert np.array_equal(leanDict['imgRemoveSmall'], retDict['imgRemoveSmall'])
+    assert np.count_nonzero(leanDict['imgRemoveSmall']) > 0
@@ -0,0 +1,174 @@
+import os
+import time
+import hashlib
+
+from napari_dapi_ring_analysis import oligoWorkQueue
+
+
+def _fakeTask(task):
+    # more than one node must get work
+    time.sleep(0.05)
+    if 'fail' in task['path']:
+        raise ValueError('bad file')
+    markerFolder = task.get('markerFolder')
+    if markerFolder is not None:
+        _hash = hashlib.sha1(task['path'].encode('utf-8')).hexdigest()[0:12]
+        if 'die' in task['path'] and not os.path.isfile(os.path.join(markerFolder, f'died-{_hash}')):
+            # the node dies holding the lease, only the first time
+            open(os.path.join(markerFolder, f'died-{_hash}'), 'w').close()
+            os._exit(1)
+        # one marker per run
+        open(os.path.join(markerFolder, f'{_hash}.{os.getpid()}.{time.time_ns()}'), 'w').close()
+    return {'header': {'path': task['path'], 'pid': os.getpid()}, 'results': []}
+
+
+def _makeTasks(numTasks, markerFolder=None):
+    return [{'path': f'/data/FST/B{idx}_Slice1_LS_DS1.czi', 'markerFolder': markerFolder}
+            for idx in range(numTasks)]
+
+
+def _getRunCounts(markerFolder):
+    runCounts = {}
+    for _file in os.listdir(markerFolder):
+        if not _file.startswith('died-'):
+            _hash = _file.split('.')[0]
+            runCounts[_hash] = runCounts.get(_hash, 0) + 1
+    return runCounts
+
+
+def test_lease(tmp_path):
+    queue = oligoWorkQueue.workQueue(str(tmp_path), leaseSeconds=60)
+    queue.addTasks(_makeTasks(2))
+
+    task0 = queue.claim('a')
+    task1 = queue.claim('b')
+    assert task0['taskId'] != task1['taskId']
+    assert queue.claim('c') is None
+
+    # expired lease is taken over
+    leasePath = os.path.join(str(tmp_path), 'leases', task0['taskId'] + '.lease')
+    os.utime(leasePath, (time.time() - 120, time.time() - 120))
+    assert queue.claim('c')['taskId'] == task0['taskId']
+
+    # a can not renew or release the lease of c
+    assert not queue.renew(task0['taskId'], 'a')
+    queue.release(task0['taskId'], 'a')
+    assert queue._readLease(task0['taskId'])['workerId'] == 'c'
+    assert queue.renew(task0['taskId'], 'c')
+
+    queue.complete(task0['taskId'], 'c', {'header': {}})
+    queue.fail(task1['taskId'], 'b', 'error')
+    assert queue.getStatus() == {'done': 1, 'running': 0, 'failed': 0, 'pending': 1}
+
+
+def test_add_tasks(tmp_path):
+    queue = oligoWorkQueue.workQueue(str(tmp_path), leaseSeconds=60)
+    taskList = [dict(_task, params={'cytoSigma': 0.7}) for _task in _makeTasks(3)]
+    # order continues across calls
+    taskList = [taskList[2], taskList[0], taskList[1]]
+    queue.addTasks(taskList[0:1])
+    queue.addTasks(taskList[1:3])
+
+    for _task in taskList:
+        _claimed = queue.claim('a')
+        queue.complete(_claimed['taskId'], 'a', {'header': {'path': _claimed['path']}})
+    assert [_result['header']['path'] for _result in queue.getResults()] == [_task['path'] for _task in taskList]
+
+    # same parameters stay done
+    queue.addTasks(taskList[0:1])
+    assert queue.getStatus() == {'done': 3, 'running': 0, 'failed': 0, 'pending': 0}
+
+    # new parameters replace the task and its result, the order is kept
+    newTask = dict(taskList[1], params={'cytoSigma': 1})
+    assert oligoWorkQueue.getTaskId(newTask) != oligoWorkQueue.getTaskId(taskList[1])
+    queue.addTasks([newTask])
+    assert queue.getStatus() == {'done': 2, 'running': 0, 'failed': 0, 'pending': 1}
+    _claimed = queue.claim('a')
+    assert _claimed['params'] == {'cytoSigma': 1}
+    queue.complete(_claimed['taskId'], 'a', {'header': {'path': _claimed['path']}})
+    assert [_result['header']['path'] for _result in queue.getResults()] == [_task['path'] for _task in taskList]
+
+
+def test_claim_removed_task(tmp_path, monkeypatch):
+    queue = oligoWorkQueue.workQueue(str(tmp_path), leaseSeconds=60)
+    queue.addTasks(_makeTasks(2))
+    taskId0, taskId1 = queue.getTaskIds()
+
+    # task 0 is removed after we leased it
+    _tryLease = queue._tryLease
+    def _removeAfterLease(taskId, workerId):
+        _leased = _tryLease(taskId, workerId)
+        if taskId == taskId0:
+            queue._removeTask(taskId0)
+        return _leased
+    monkeypatch.setattr(queue, '_tryLease', _removeAfterLease)
+
+    assert queue.claim('a')['taskId'] == taskId1
+    assert queue._readLease(taskId0) is None
+
+
+def test_lease_race(tmp_path, monkeypatch):
+    queue = oligoWorkQueue.workQueue(str(tmp_path), leaseSeconds=60)
+    queue.addTasks(_makeTasks(1))
+    taskId = queue.getTaskIds()[0]
+    assert queue._tryLease(taskId, 'dead')
+    leasePath = os.path.join(str(tmp_path), 'leases', taskId + '.lease')
+    os.utime(leasePath, (time.time() - 120, time.time() - 120))
+
+    # a takes over the expired lease after b checked it but before b renames it
+    _rename = os.rename
+    claimed = {}
+    def _racingRename(src, dst):
+        if '.b.' in dst and 'a' not in claimed:
+            claimed['a'] = queue._tryLease(taskId, 'a')
+        _rename(src, dst)
+    monkeypatch.setattr(os, 'rename', _racingRename)
+
+    claimed['b'] = queue._tryLease(taskId, 'b')
+    assert claimed == {'a': True, 'b': False}
+    assert queue._readLease(taskId)['workerId'] == 'a'
+    assert os.listdir(os.path.join(str(tmp_path), 'leases')) == [taskId + '.lease']
+
+
+def test_simulate_nodes(tmp_path):
+    queueFolder = str(tmp_path / 'queue')
+    markerFolder = str(tmp_path / 'markers')
+    os.makedirs(markerFolder)
+    taskList = _makeTasks(12, markerFolder) + [{'path': '/data/FST/fail.czi'}]
+    oligoWorkQueue.workQueue(queueFolder).addTasks(taskList)
+
+    exitCodes = oligoWorkQueue.simulateNodes(queueFolder, numNodes=3, runTask=_fakeTask,
+                                                leaseSeconds=2)
+    assert exitCodes == [0, 0, 0]
+
+    queue = oligoWorkQueue.workQueue(queueFolder)
+    assert queue.getStatus() == {'done': 12, 'running': 0, 'failed': 1, 'pending': 0}
+
+    # each task ran once
+    runCounts = _getRunCounts(markerFolder)
+    assert len(runCounts) == 12
+    assert set(runCounts.values()) == {1}
+
+    # results are in the order they were added
+    resultList = queue.getResults()
+    assert [_result['header']['path'] for _result in resultList] == [_task['path'] for _task in taskList[:12]]
+    assert len(set(_result['workerId'] for _result in resultList)) > 1
+
+
+def test_simulate_nodes_dead_node(tmp_path):
+    queueFolder = str(tmp_path / 'queue')
+    markerFolder = str(tmp_path / 'markers')
+    os.makedirs(markerFolder)
+    taskList = _makeTasks(4, markerFolder) + [{'path': '/data/FST/die.czi', 'markerFolder': markerFolder}]
+    oligoWorkQueue.workQueue(queueFolder).addTasks(taskList)
+
+    # the node that dies leaves its lease, a live node takes it over when it expires
+    exitCodes = oligoWorkQueue.simulateNodes(queueFolder, numNodes=2, runTask=_fakeTask,
+                                                leaseSeconds=2)
+    assert sorted(exitCodes) == [0, 1]
+
+    queue = oligoWorkQueue.workQueue(queueFolder)
+    assert queue.getStatus() == {'done': 5, 'running': 0, 'failed': 0, 'pending': 0}
+    runCounts = _getRunCounts(markerFolder)
+    assert len(runCounts) == 5
+    assert set(runCounts.values()) == {1}
@@ -27,6 +27,7 @@ import napari_dapi_ring_analysis.oligoUtils
 from napari_dapi_ring_analysis import oligoAnalysis
 from napari_dapi_ring_analysis import oligoAnalysisFolder
 from napari_dapi_ring_analysis import imageChannels
+from napari_dapi_ring_analysis import oligoSummary
 
 from napari_dapi_ring_analysis.interface import myTableView
 from napari_dapi_ring_analysis.interface._data_model import pandasModel
@@ -128,7 +129,14 @@ class oligoInterface(QtWidgets.QWidget):
         
         self._folderPath : str = folderPath
         
-        self._oligoAnalysisFolder = oligoAnalysisFolder(folderPath)
+        def _progress(numDone, numTotal):
+            self.updateStatus(f'Loading {numDone} of {numTotal}')
+            QtWidgets.QApplication.processEvents()
+
+        _numWorkers = min(8, os.cpu_count() or 1)
+        self._oligoAnalysisFolder = oligoAnalysisFolder(folderPath,
+                                                        numWorkers=_numWorkers,
+                                                        progressCallback=_progress)
 
         self._selectedFile : str = None
         self._selectedRow : int = None
@@ -451,7 +459,8 @@ class oligoInterface(QtWidgets.QWidget):
         if oa is None:
             return
         rgbPath = oa._getRgbPath()
-        oligoanalysis.runModelOnImage(rgbPath)
+        # rgb stack from the store, there is no rgb tif with the 'zarr' backend
+        napari_dapi_ring_analysis.runModelOnImage(rgbPath, imgData=oa._getRgbStack())
 
     def on_histogram_checkbox(self, state):
         logger.info(f'state:{state}')
@@ -1092,14 +1101,21 @@ class oligoInterface(QtWidgets.QWidget):
         except (KeyError) as e:
             logger.warning('Did not find napari layer named "{_title}"')
 
-def showScatterPlots(oi :oligoInterface):
-    
-    path = '/Users/cudmore/Dropbox/data/whistler/cudmore/oligo-simmary-20230112-cs-0.7.csv'
-    if not os.path.isdir(path):
+def showScatterPlots(oi :oligoInterface, path : str = None):
+    """
+    Args:
+        path: summary sqlite (see oligoSummary) or csv
+    """
+    if path is None:
+        path = '/Users/cudmore/Dropbox/data/whistler/cudmore/oligo-simmary-20230112-cs-0.7.csv'
+    if not os.path.isfile(path):
         logger.error(f'did not find path: {path}')
         return
     
-    df = pd.read_csv(path)
+    if path.endswith('.csv'):
+        df = pd.read_csv(path)
+    else:
+        df = oligoSummary.loadSummary(path)
     df = df[df.parentFolder != 'Adolescent']
     df = df.reset_index()
 
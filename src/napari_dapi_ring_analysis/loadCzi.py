@@ -7,7 +7,13 @@ import sys
 from pprint import pprint
 from datetime import datetime
 import glob
+import json
+import sqlite3
+import threading
+from typing import Callable, List
+from collections import OrderedDict
 
+import numpy as np
 import pandas as pd
 
 import tifffile
@@ -16,20 +22,118 @@ from aicsimageio import AICSImage
 from aicspylibczi import CziFile
 
 from napari_dapi_ring_analysis._logger import logger
+from napari_dapi_ring_analysis._parallel import parallelMap
 
 loadFileTypes = ['.czi', '.tif', '.oir']
 
-def loadFolder(folderPath : str) -> pd.DataFrame:
-    """Load headers for a folder of czi files.
-    
-    Returns:
-        pd.DataFrame of file headers, one per row
+readerCacheSize = 8
+# max number of AICSImage readers to keep open, see getReader()
+
+readerChunkDims = 'YXS'
+# one dask chunk per image plane, so reading a few z planes does not read the stack
+
+_readerCache = OrderedDict()
+# keys are full path, values are (mtime, AICSImage), oldest first
+
+_readerCacheLock = threading.Lock()
+
+def getReader(path : str) -> AICSImage:
+    """Get a (cached) AICSImage for a file.
+
+    Readers are cached per process, keyed on path and modification time,
+    so header, rgb and raw loads all share one parsed czi metadata.
+    The least recently used reader is closed when there are more than readerCacheSize.
+
+    Notes:
+        Do not use AICSImage.get_image_data() or .data on a cached reader,
+        it keeps the full image in the reader. Use get_image_dask_data().compute().
     """
-    # _folder, parentFolder = os.path.split(folderPath)
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    with _readerCacheLock:
+        if path in _readerCache:
+            _mtime, img = _readerCache[path]
+            if _mtime == mtime:
+                _readerCache.move_to_end(path)
+                return img
+
+    # open outside the lock so other threads can open other files
+    img = AICSImage(path, chunk_dims=readerChunkDims)  # selects the first scene found
+
+    with _readerCacheLock:
+        _readerCache[path] = (mtime, img)
+        _readerCache.move_to_end(path)
+
+        while len(_readerCache) > readerCacheSize:
+            _readerCache.popitem(last=False)
+
+    return img
+
+def closeReader(path : str = None):
+    """Remove a reader from the cache, if path is None then remove all.
+    """
+    with _readerCacheLock:
+        if path is None:
+            _readerCache.clear()
+        else:
+            _readerCache.pop(os.path.abspath(path), None)
+
+class lazyCziChannel():
+    """A lazy (z, y, x) array for one channel of a raw image.
+
+    Nothing is read until indexed or converted to np.ndarray.
+        - Indexing like [z] or [z0:z1] only reads the requested z planes.
+        - np.min() and np.max() are computed one plane at a time.
+        - np.asarray() reads the full channel, it is not cached.
+    """
+    def __init__(self, path : str, channel : int):
+        """
+        Args:
+            path: Full path to raw image (czi file)
+            channel: channel index (0 based)
+        """
+        self._path = path
+        self._channel = channel
+        self._daskData = getReader(path).get_image_dask_data("ZYX", T=0, C=channel)
+
+    @property
+    def shape(self):
+        return self._daskData.shape
+
+    @property
+    def dtype(self):
+        return self._daskData.dtype
+
+    @property
+    def ndim(self):
+        return self._daskData.ndim
+
+    @property
+    def size(self):
+        return self._daskData.size
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        return np.asarray(self._daskData[key].compute())
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        logger.info(f'reading channel {self._channel} {self.shape} {os.path.split(self._path)[1]}')
+        return np.asarray(self._daskData.compute(), dtype=dtype)
+
+    def min(self, axis=None, out=None, **kwargs):
+        return self._daskData.min(axis=axis).compute()
 
-    # fileList = os.listdir(folderPath)
-    # fileList = sorted(fileList)
+    def max(self, axis=None, out=None, **kwargs):
+        return self._daskData.max(axis=axis).compute()
 
+folderIndexFile = 'oligo-folder-index.sqlite'
+# saved in the root of each folder, see loadFolder()
+
+def _getFolderFiles(folderPath : str) -> List[str]:
+    """Get sorted list of full path to czi files in a folder (recursive).
+    """
     files = glob.glob(os.path.join(folderPath, '**/*.czi'), recursive=True)
     fileList = []
     for file in files:
@@ -38,35 +142,99 @@ def loadFolder(folderPath : str) -> pd.DataFrame:
         fileList.append(file)
 
     fileList = sorted(fileList)
+    return fileList
 
-    headerList = []
-    #sumSlices = 0
-    for filePath in fileList:
-        
-        # glob gives us only .czi
-        # _filestub, _ext = os.path.splitext(file)
-        # if not _ext in loadFileTypes:
-        #     continue
-        
-        # glob gives us the path
-        # filePath = os.path.join(folderPath, file)
+def _openFolderIndex(folderPath : str) -> sqlite3.Connection:
+    """Open (and make if necc) the sqlite header index for a folder.
 
-        #header = loadCziHeader(filePath)
-        header = _loadHeader(filePath)
-        
+    Returns None if the index can not be opened (e.g. read only folder).
+    """
+    indexPath = os.path.join(folderPath, folderIndexFile)
+    try:
+        conn = sqlite3.connect(indexPath)
+        conn.execute("""CREATE TABLE IF NOT EXISTS headers (
+                            path TEXT PRIMARY KEY,
+                            size INTEGER,
+                            mtime REAL,
+                            header TEXT)""")
+    except (sqlite3.Error) as e:
+        logger.warning(f'Did not open folder index: {indexPath}')
+        logger.warning(f'  {e}')
+        return None
+    return conn
+
+def loadFolder(folderPath : str, useIndex : bool = True,
+                numWorkers : int = 1,
+                progressCallback : Callable = None) -> pd.DataFrame:
+    """Load headers for a folder of czi files.
+
+    Headers are kept in an sqlite index in the folder (folderIndexFile),
+    keyed on relative path, file size and modification time.
+    We only open czi files that are new or changed since the last load.
+
+    Args:
+        folderPath:
+        useIndex: If False then open every czi file and do not use the index
+        numWorkers: number of threads to open czi files
+        progressCallback: called as progressCallback(numDone, numTotal)
+            as each czi file is opened
+    
+    Returns:
+        pd.DataFrame of file headers, one per row, sorted by path
+    """
+    fileList = _getFolderFiles(folderPath)
+
+    conn = _openFolderIndex(folderPath) if useIndex else None
+
+    indexDict = {}
+    # keys are relative path, values are (size, mtime, header json)
+    if conn is not None:
+        for _path, _size, _mtime, _header in conn.execute('SELECT path, size, mtime, header FROM headers'):
+            indexDict[_path] = (_size, _mtime, _header)
+
+    headerDict = {}
+    # keys are full path, values are header dict
+
+    # czi files that are new or changed
+    loadList = []
+    for filePath in fileList:
         # path is stub based on folderPath
-        header['path'] = header['path'].replace(folderPath + '/', '')
+        relPath = filePath.replace(folderPath + '/', '')
+
+        _stat = os.stat(filePath)
+        _indexRow = indexDict.get(relPath)
+        if _indexRow is not None and _indexRow[0] == _stat.st_size and _indexRow[1] == _stat.st_mtime:
+            headerDict[filePath] = json.loads(_indexRow[2])
+        else:
+            loadList.append((filePath, relPath, _stat))
+
+    _loadedHeaders = parallelMap(_loadHeader, [_load[0] for _load in loadList],
+                                    numWorkers=numWorkers, progressCallback=progressCallback)
+
+    newRows = []
+    for (filePath, relPath, _stat), header in zip(loadList, _loadedHeaders):
+        header['path'] = relPath
+        headerDict[filePath] = header
+        try:
+            newRows.append((relPath, _stat.st_size, _stat.st_mtime, json.dumps(header)))
+        except (TypeError) as e:
+            logger.warning(f'Did not add header to folder index: {relPath}')
+            logger.warning(f'  {e}')
 
-        #zPixels = header['zPixels']
+    headerList = [headerDict[filePath] for filePath in fileList]
 
-        # header['firstSlice_mask'] = sumSlices
-        # header['lastSlice_mask'] = sumSlices + zPixels - 1
-        
-        # header['parentFolder'] = parentFolder
-        
-        #sumSlices += zPixels
-        
-        headerList.append(header)
+    if conn is not None:
+        _relPaths = [header['path'] for header in headerList]
+        _removed = [(_path,) for _path in indexDict.keys() if _path not in _relPaths]
+        try:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?)', newRows)
+                conn.executemany('DELETE FROM headers WHERE path = ?', _removed)
+        except (sqlite3.Error) as e:
+            logger.warning(f'Did not update folder index: {e}')
+        conn.close()
+
+    logger.info(f'{len(fileList)} files, loaded {len(loadList)} headers from czi files')
 
     df = pd.DataFrame(headerList)
     return df
@@ -76,7 +244,7 @@ def _loadHeader(path : str) -> dict:
     """
     #logger.info(f'{path}')
     
-    img = AICSImage(path)  # selects the first scene found
+    img = getReader(path)
     
     xVoxel = img.physical_pixel_sizes.X
     yVoxel = img.physical_pixel_sizes.Y
@@ -229,7 +397,7 @@ def loadCziHeader(cziPath : str) -> dict:
             print(f'EXCEPTION IN PARSING TIME STR "{_datetimeText}"')
             print(e)
 
-        img = AICSImage(cziPath)  # selects the first scene found
+        img = getReader(cziPath)
     
         xVoxel = img.physical_pixel_sizes.X
         yVoxel = img.physical_pixel_sizes.Y
@@ -3,40 +3,149 @@
 """
 import os
 from pprint import pprint
-import json
+import contextlib
 import enum
 from typing import List, Union  # , Callable, Iterator, Optional
 
 import numpy as np
 import pandas as pd
 
-import tifffile
-
 #from skimage.transform import resize  # rescale, downscale_local_mean
 #from skimage.filters import gaussian
 #from skimage.filters import threshold_otsu
 
-from scipy.ndimage import zoom  # to redice x/y size of image
 import scipy.ndimage
 
-from aicsimageio import AICSImage
-
 #from oligoanalysis.loadCzi import loadCziHeader  # , loadFolder
+from napari_dapi_ring_analysis import loadCzi
 from napari_dapi_ring_analysis.loadCzi import _loadHeader
 from napari_dapi_ring_analysis._logger import logger
 from napari_dapi_ring_analysis import oligoUtils
+from napari_dapi_ring_analysis import oligoRing
+from napari_dapi_ring_analysis.oligoStore import getStore, _getBaseSaveFile
+from napari_dapi_ring_analysis import oligoCache
 
 class imageChannels(enum.Enum):
     dapi = 'dapi'
     cyto = 'cyto'
 
+rawStatsPercentiles = [1, 50, 99]
+# percentiles of raw czi intensity saved in header, see getRawChannelStats()
+
+rawStatsKeys = ['RawMin', 'RawMax', 'RawMean'] + [f'RawP{p}' for p in rawStatsPercentiles]
+# header keys are prepended with channel, like 'cytoRawMin'
+
+def _mergeSavedHeader(header : dict, loadedHeader : dict):
+    """Update header with values from a saved header.
+
+    Only keys already in header are loaded.
+    """
+    if loadedHeader is None:
+        # no header to load
+        return
+
+    # only load keys we already have in header
+    for k in header.keys():
+        try:
+            header[k] = loadedHeader[k]
+        except (KeyError) as e:
+            logger.warning(f'Did not find key "{k}" in loaded header')
+
+def loadAnalysisHeader(path : str, xyScaleFactor : float = 0.25,
+                        cziHeader : dict = None, storage : str = None) -> dict:
+    """Make the default analysis header and load previously saved values.
+
+    This does not load any images or the labels csv.
+
+    Args:
+        path: Full path to raw image (czi file)
+        xyScaleFactor: fraction to zoom x/y
+        cziHeader: header from loadCzi._loadHeader(), if None then load from path
+        storage: storage backend, see oligoStore.getStore()
+    """
+    # default header
+    # load header from raw image stack (czi)
+    if cziHeader is None:
+        header = _loadHeader(path)
+    else:
+        header = dict(cziHeader)
+        header['path'] = path
+
+    christineDict = oligoUtils.parseFileName(path)
+    if christineDict is None:
+        logger.error(f'DID NOT GET CHRISTINE FILE NAME DICTIONARY')
+    else:
+        for k,v in christineDict.items():
+            header[k] = v
+
+    header['dapiChannel'] = 1
+    header['cytoChannel'] = 0
+
+    header['dapiMinInt'] = np.nan # assigned in analyzeIntensity
+    header['dapiMaxInt'] = np.nan
+    header['cytoMinInt'] = np.nan
+    header['cytoMaxInt'] = np.nan
+
+    header['cellpose'] = ''  # if we have a cell pose _seg.pny file
+    header['num labels'] = ''  # number of labels if we have a cell pose _seg.pny file
+    header['xyScaleFactor'] = xyScaleFactor
+    #
+    header['gaussianSigma'] = 1  # can be scalar like 1 or tuple like (z,y,x)
+    header['filteredDtype'] = 'float32'  # dtype of saved filtered image, see oligoUtils.reducePrecision()
+    header['otsuMethod'] = 'histogram'  # see oligoUtils.getOtsuThreshold()
+    header['cytoFilteredScale'] = None  # set for integer filteredDtype
+    header['cytoFilteredOffset'] = None
+    header['dapiFilteredScale'] = None
+    header['dapiFilteredOffset'] = None
+    header['rgbDownscale'] = 'zoom'  # see oligoUtils.downscaleXY()
+    header['cytoGausSigma'] = None  # sigma of the last cyto mask, see analyzeImageMask()
+    header['cytoOtsuThreshold'] = None
+    header['cytoStackPixels'] = None
+    header['cytoMaskPixels'] = None
+    header['cytoMaskPercent'] = None
+    #
+    header['dapiGausSigma'] = None
+    header['dapiOtsuThreshold'] = None
+    header['dapiStackPixels'] = None
+    header['dapiMaskPixels'] = None
+    header['dapiMaskPercent'] = None
+    header['cytoDapiRatio'] = None  # cytoMaskPercent / dapiMaskPercent
+    #
+    header['aicsMaskPixels'] = None  # see aicsAnalysis()
+    header['aicsMaskPercent'] = None
+    #
+    header['erodeIterations'] = 2
+    header['dilateIterations'] = 2
+    #
+    header['cacheKeys'] = {}  # key of each saved derived array, see oligoAnalysis.getCacheKey()
+    header['pipeline'] = {}  # key of each finished stage, see oligoPipeline.runFilePipeline()
+    #
+    # raw czi intensity stats, see getRawChannelStats()
+    for _chStr in [imageChannels.cyto.value, imageChannels.dapi.value]:
+        for _stat in rawStatsKeys:
+            header[f'{_chStr}{_stat}'] = None
+    
+    store = getStore(path, storage)
+    _mergeSavedHeader(header, store.loadHeader())  # load previously saved
+
+    # update header if we have a cellpose _seg.npy file
+    hasCellPose = store.hasArray('cellpose-mask')
+    if hasCellPose:
+        header['cellpose'] = 'Yes'
+
+    return header
+
 class oligoAnalysis():
-    def __init__(self, path : str, xyScaleFactor : float = 0.25):
+    def __init__(self, path : str, xyScaleFactor : float = 0.25,
+                    cziHeader : dict = None, storage : str = None):
         """
         Args:
             path: Full path to raw image (czi file)
             xyScaleFactor: fraction to zoom x/y
                 cellpose wants nuclei to be ~10 pixels but our are ~30 pixels
+            cziHeader: header from loadCzi._loadHeader(), if None then load from path
+            storage: In ['tif', 'zarr'], how analysis is saved, see oligoStore.getStore()
+                if None then use oligoStore.defaultStorage
         """
         #logger.info(f'path: {path} xyScaleFactor:{xyScaleFactor}')
         
@@ -48,50 +157,18 @@ class oligoAnalysis():
 
         self._imgDataCzi = None # for raw czi images
 
-        # default header
-        # load header from raw image stack (czi)
-        self._header : dict = _loadHeader(path)
+        self._store = getStore(path, storage)
+        # saves and loads all analysis results
 
-        christineDict = oligoUtils.parseFileName(path)
-        if christineDict is None:
-            logger.error(f'DID NOT GET CHRISTINE FILE NAME DICTIONARY')
-        else:
-            for k,v in christineDict.items():
-                self._header[k] = v
-
-        self._header['dapiChannel'] = 1
-        self._header['cytoChannel'] = 0
-
-        self._header['dapiMinInt'] = np.nan # assigned in analyzeIntensity
-        self._header['dapiMaxInt'] = np.nan
-        self._header['cytoMinInt'] = np.nan
-        self._header['cytoMaxInt'] = np.nan
-
-        self._header['cellpose'] = ''  # if we have a cell pose _seg.pny file
-        self._header['num labels'] = ''  # number of labels if we have a cell pose _seg.pny file
-        self._header['xyScaleFactor'] = xyScaleFactor
-        #
-        self._header['gaussianSigma'] = 1  # can be scalar like 1 or tuple like (z,y,x)
-        self._header['cytoOtsuThreshold'] = None
-        self._header['cytoStackPixels'] = None
-        self._header['cytoMaskPixels'] = None
-        self._header['cytoMaskPercent'] = None
-        #
-        self._header['dapiOtsuThreshold'] = None
-        self._header['dapiStackPixels'] = None
-        self._header['dapiMaskPixels'] = None
-        self._header['dapiMaskPercent'] = None
-        #
-        self._header['erodeIterations'] = 2
-        self._header['dilateIterations'] = 2
-        
-        self.loadHeader()  # load previously saved, assigns self._header
+        self._cache = oligoCache.artifactCache(oligoCache.getCacheFolder(path))
+        # previous versions of derived arrays, keyed on their inputs
+
+        self._arrayKeys = {}
+        # cache key of each derived array in memory, see getCacheKey()
+
+        # default header and previously saved header
+        self._header : dict = loadAnalysisHeader(path, xyScaleFactor, cziHeader, storage)
 
-        # update header if we have a cellpose _seg.npy file
-        hasCellPose = os.path.isfile(self._getCellPoseDapiMaskPath())
-        if hasCellPose:
-            self._header['cellpose'] = 'Yes'
-            
         self._dfLabels : pd.DataFrame = self.loadLabelDf()
         # Created in analizeOligoDapi()
 
@@ -117,8 +194,15 @@ class oligoAnalysis():
         self._isLoaded = False
         # True if raw images have been loaded, see load()
 
-    def aicsAnalysis(self):
+    def aicsAnalysis(self, numWorkers : int = 1, lean : bool = False,
+                        useProcesses : bool = False):
+        """AICS filament segmentation of the raw cyto channel, results are in the header.
 
+        Args:
+            numWorkers: number of threads (or processes) for blocks of z planes, see oligoUtils.aicsSegment()
+            lean: if True only keep the final mask in _aicsDict (no intermediate steps)
+            useProcesses: if True use a process pool, otherwise threads
+        """
         logger.info('calculating aics segmentation and storing results in _header')
         
         # this is the 4x reduced version
@@ -126,14 +210,16 @@ class oligoAnalysis():
         
         # load raw czi
         self._loadCzi()
-        imgData = self._imgDataCzi[1]
+        imgData = np.asarray(self._imgDataCzi[1])
 
-        _suggestedNorm = oligoUtils.aicsSuggestedNorm(imgData)
-        logger.info(f'_suggestedNorm: {_suggestedNorm}')
+        if not lean:
+            _suggestedNorm = oligoUtils.aicsSuggestedNorm(imgData)
+            logger.info(f'_suggestedNorm: {_suggestedNorm}')
 
         
         # analyze (lots of default params)
-        retDict = oligoUtils.aicsSegment(imgData)
+        retDict = oligoUtils.aicsSegment(imgData, numWorkers=numWorkers,
+                                            useProcesses=useProcesses, lean=lean)
 
         self._aicsDict = retDict
 
@@ -152,23 +238,18 @@ class oligoAnalysis():
 
     def _loadCzi(self):
         """Load raw czi into self._imgDataCzi : dict with key of channel [1, 2]
+
+        Values are loadCzi.lazyCziChannel, no pixels are read until needed.
         """
         logger.info(f'{self._path}')
 
         if self._imgDataCzi is None:
             logger.info('  loading')
-            img = AICSImage(self._path)
-            imgData = img.get_image_data("ZYXC", T=0)
-            # imgData is like: (21, 784, 784, 2)
-            logger.info(f'  AICSImage loaded raw imgData: {imgData.shape} {imgData.dtype}')
-
-            # convert to 8 bit, we need to do each channel to maximize histogram
-            imgData_ch1 = imgData[:,:,:,0]
-            imgData_ch2 = imgData[:,:,:,1]
-
             self._imgDataCzi = {}
-            self._imgDataCzi[1] = imgData_ch1
-            self._imgDataCzi[2] = imgData_ch2
+            self._imgDataCzi[1] = loadCzi.lazyCziChannel(self._path, 0)
+            self._imgDataCzi[2] = loadCzi.lazyCziChannel(self._path, 1)
+            # like: (21, 784, 784)
+            logger.info(f'  lazy raw channels: {self._imgDataCzi[1].shape} {self._imgDataCzi[1].dtype}')
         else:
             logger.info('  already loaded into _imgDataCzi')
 
@@ -182,9 +263,11 @@ class oligoAnalysis():
         
         self._cellPoseMask = None
         self._dapiFinalMask = None
+        self._arrayKeys = {}
 
         # raw czi
         self._imgDataCzi = None
+        loadCzi.closeReader(self._path)
 
     def setLabelRowAccept(self, rowList : List[int], df : pd.DataFrame):
         """
@@ -228,10 +311,8 @@ class oligoAnalysis():
         
         All saved files should append to this stub.
         """
-        saveFile = os.path.split(self._path)[1]
-        saveFile, _ext = os.path.splitext(saveFile)
-        saveFile += f'-rgb-small'
-        baseSavePath = os.path.join(self._getSaveFolder(), saveFile)
+        self._getSaveFolder()  # make if necc
+        baseSavePath = _getBaseSaveFile(self._path)
         return baseSavePath
 
     # def getImageFilePath(self, typeStr : str):
@@ -251,6 +332,9 @@ class oligoAnalysis():
 
     def _getRgbPath(self) -> str:
         """Get full path to saved rgb tif.
+
+        Cellpose saves its _seg.npy next to this path. With the 'zarr' backend
+        the tif does not exist, load the rgb stack with _getRgbStack().
         """
         rgbSavePath = self.getBaseSaveFile()
         rgbSavePath += '.tif'
@@ -286,22 +370,19 @@ class oligoAnalysis():
             # need to update the table
             self._header['num labels'] = len(np.unique(self._cellPoseMask))
 
+        # saved arrays are only used if made with the current parameters,
+        # see getCacheKey()
+
         # _dict, self._redImageMask = self.makeImageMask()
         self._redImageMask = self.loadImageMask(imageChannels.cyto)
-        if self._redImageMask is None:
-            self.analyzeImageMask(imageChannels.cyto)
-
         self._redImageFiltered = self.loadImageFiltered(imageChannels.cyto)
-        if self._redImageFiltered is None:
+        if self._redImageMask is None or self._redImageFiltered is None:
             self.analyzeImageMask(imageChannels.cyto)
 
         # dec 08, adding simple dapi mask
         self._greenImageMask = self.loadImageMask(imageChannels.dapi)
-        if self._greenImageMask is None:
-            self.analyzeImageMask(imageChannels.dapi)
-
         self._greenImageFiltered = self.loadImageFiltered(imageChannels.dapi)
-        if self._greenImageFiltered is None:
+        if self._greenImageMask is None or self._greenImageFiltered is None:
             self.analyzeImageMask(imageChannels.dapi)
 
         # analyze with ring
@@ -320,19 +401,134 @@ class oligoAnalysis():
         """
         logger.info(f'Saving analysis: {self.filename}')
         
-        self.saveHeader()
         self.saveLabelDf()
 
-        if self._redImageMask is not None:
-            maskPath = self._getImageMaskPath(imageChannels.cyto)
-            tifffile.imsave(maskPath, self._redImageMask)
-
-        if self._redImageFiltered is not None:
-            filteredPath = self._getImageFilteredPath(imageChannels.cyto)
-            tifffile.imsave(filteredPath, self._redImageFiltered)
+        self.saveImageMask(imageChannels.cyto)
 
         self.saveDapiFinalMask()
 
+        # last, the header has the cache key of each saved array
+        self.saveHeader()
+
+    def saveImageMask(self, imageChannel : imageChannels):
+        """Save the binary mask and filtered image of one channel.
+
+        Created in analyzeImageMask()
+        """
+        _chStr = imageChannel.value
+        imgMask = self.getImageMask(imageChannel)
+        if imgMask is not None:
+            self._saveArray(f'mask-{_chStr}', imgMask)
+
+        imgFiltered = self.getImageFiltered(imageChannel)
+        if imgFiltered is not None:
+            self._saveArray(f'filtered-{_chStr}', imgFiltered)
+
+    def getCacheKey(self, name : str) -> str:
+        """Get the key of a derived array from its inputs and the current parameters.
+
+        Keys chain, a mask key includes the rgb key which includes the raw file identity.
+
+        Args:
+            name: In ['rgb', 'mask-cyto', 'filtered-cyto', 'mask-dapi', 'filtered-dapi',
+                'dapi-final-mask']
+        """
+        if name == 'rgb':
+            return oligoCache.makeCacheKey(name=name,
+                                    source=oligoCache.fileIdentity(self._path),
+                                    xyScaleFactor=self._header['xyScaleFactor'],
+                                    downscale=self._header['rgbDownscale'])
+        elif name == 'dapi-final-mask':
+            return oligoCache.makeCacheKey(name=name,
+                                    cellpose=oligoCache.fileIdentity(self._getCellPoseDapiMaskPath()),
+                                    cytoMask=self._getArrayKey(f'mask-{imageChannels.cyto.value}'),
+                                    dilateIterations=self._header['dilateIterations'],
+                                    erodeIterations=self._header['erodeIterations'])
+
+        # masks and filtered use the sigma of the last analysis of the channel
+        _type, _chStr = name.split('-')
+        channel = self.dapiChannel if _chStr == imageChannels.dapi.value else self.cytoChannel
+        gaussianSigma = self._header[f'{_chStr}GausSigma']
+        if gaussianSigma is None:
+            gaussianSigma = self._header['gaussianSigma']
+        inputs = {
+            'name': name,
+            'rgb': self._getArrayKey('rgb'),
+            'channel': channel,
+            'gaussianSigma': gaussianSigma,
+            'otsuMethod': self._header['otsuMethod'],
+        }
+        if _type == 'filtered':
+            inputs['filteredDtype'] = self._header['filteredDtype']
+        return oligoCache.makeCacheKey(**inputs)
+
+    def _getArrayKey(self, name : str) -> str:
+        """Get the key of a derived array in memory, if not loaded then the current key.
+        """
+        key = self._arrayKeys.get(name)
+        if key is None:
+            key = self.getCacheKey(name)
+        return key
+
+    def _loadArray(self, name : str, isMask : bool = False, out : np.ndarray = None) -> np.ndarray:
+        """Load a derived array if it was made with the current parameters.
+
+        Looks in the store and then in the cache.
+        Arrays saved without a cache key (before we had keys) are recomputed.
+
+        Returns:
+            None if we need to recompute
+        """
+        key = self.getCacheKey(name)
+        savedKey = self._header['cacheKeys'].get(name)
+
+        if savedKey == key:
+            if isMask:
+                data = self._store.loadMask(name, out=out)
+            else:
+                data = self._store.loadArray(name)
+            if data is not None:
+                self._arrayKeys[name] = key
+                return data
+
+        data = self._cache.load(key)
+        if data is not None:
+            logger.info(f'{self.filename} loaded "{name}" from cache')
+            # back in the store, it does not need to also be in the cache
+            self._storeArray(name, key, data)
+            self._cache.remove(key)
+            self._arrayKeys[name] = key
+            if isMask and out is not None:
+                np.not_equal(data, 0, out=out)
+                data = out
+            elif isMask:
+                data = data.astype(bool, copy=False)
+            return data
+
+        if savedKey is None and self._store.hasArray(name):
+            logger.info(f'{self.filename} saved "{name}" does not have a cache key')
+        logger.info(f'{self.filename} "{name}" is not saved with current parameters')
+
+    def _storeArray(self, name : str, key : str, data : np.ndarray):
+        """Save an array in the store with its key.
+
+        A saved array with a different key is moved to the cache,
+        switching back to its parameters does not recompute it.
+        """
+        savedKey = self._header['cacheKeys'].get(name)
+        if savedKey is not None and savedKey != key and not self._cache.has(savedKey):
+            savedData = self._store.loadArray(name)
+            if savedData is not None:
+                logger.info(f'{self.filename} moving saved "{name}" to cache')
+                self._cache.save(savedKey, savedData)
+        self._store.saveArray(name, data)
+        self._header['cacheKeys'][name] = key
+
+    def _saveArray(self, name : str, data : np.ndarray):
+        """Save a derived array in the store with its key, see _storeArray().
+        """
+        self._storeArray(name, self._getArrayKey(name), data)
+
     @property
     def filename(self) -> str:
         """Get the original filename.
@@ -347,79 +543,28 @@ class oligoAnalysis():
         return self._header
 
     def saveHeader(self):
-        """Save image header as json.
+        """Save image header.
         
         This includes analysis parameters and results.
         """
-        headerPath = self._getHeaderFilePath()
-        logger.info(f'saving header json: {headerPath}')
-        with open(headerPath, 'w') as f:
-            try:
-                json.dump(self._header, f, indent=4)
-            except (TypeError) as e:
-                logger.error(f'Did not save header')
-                logger.error(f'{e}')
-                logger.error(f'{headerPath}')
-                logger.error(self._header)
+        try:
+            self._store.saveHeader(self._header)
+        except (TypeError) as e:
+            logger.error(f'Did not save header')
+            logger.error(f'{e}')
+            logger.error(self._header)
 
     def loadHeader(self):
-        """Load image header as json.
+        """Load previously saved image header.
         """
-        headerPath = self._getHeaderFilePath()
-        if not os.path.isfile(headerPath):
-            # no header to load
-            return
+        _mergeSavedHeader(self._header, self._store.loadHeader())
 
-        #logger.info(f'{headerPath}')
-        
-        # only load keys we already have in self._header
-        _loadedHeader = None
-        with open(headerPath, 'r') as f:
-            try:
-                _loadedHeader = json.load(f)
-            except (json.decoder.JSONDecodeError) as e:
-                logger.error(e)
-
-        if _loadedHeader is None:
-            logger.error(f'Loading header failed')
-            logger.error(f'headerPath: {headerPath}')
-        else:
-            for k in self._header.keys():
-                try:
-                    self._header[k] = _loadedHeader[k]
-                except (KeyError) as e:
-                    logger.warning(f'Did not find key "{k}" in loaded header')
-
-    def _getHeaderFilePath(self) -> str:
-        """Get path to save/load header.
-        
-        We want to save header when we change analysis params
-            - gaussianSigma
-            - dilation/erosion iteration
-            - ???
-        """
-        headerFilePath = self.getBaseSaveFile()
-        headerFilePath += f'-header.json'
-        return headerFilePath
-
-    def _getDapiFinalMaskPath(self) -> str:
-        dapiFinalMaskPath = self.getBaseSaveFile()
-        dapiFinalMaskPath += '-dapi-final-mask.tif'
-        return dapiFinalMaskPath
- 
     def loadDapiFinalMask(self) -> np.ndarray:
         """Load _dapiFinalMask, the DAPI ring mask after erode/dilate.
 
         See: AnalyzeOligoDapi()
         """
-        dapiFinalMaskPath = self._getDapiFinalMaskPath()
-        
-        if not os.path.isfile(dapiFinalMaskPath):
-            #logger.info(f'did not find dapi_final_mask: {dapiFinalMaskPath}')
-            return
-        #logger.info(f'loading dapi_final_mask: {dapiFinalMaskPath}')
-        dapiFinalMask = tifffile.imread(dapiFinalMaskPath)
-        return dapiFinalMask
+        return self._loadArray('dapi-final-mask')
 
     #def saveDapiFinalMask(self, dapi_final_mask : np.ndarray = None):
     def saveDapiFinalMask(self):
@@ -429,92 +574,44 @@ class oligoAnalysis():
         """
         if self._dapiFinalMask is None:
             return
-        dapiFinalMaskPath = self._getDapiFinalMaskPath()
-        logger.info(f'saving dapi_final_mask: {dapiFinalMaskPath}')
-        tifffile.imsave(dapiFinalMaskPath, self._dapiFinalMask)
+        logger.info(f'saving dapi_final_mask: {self.filename}')
+        self._saveArray('dapi-final-mask', self._dapiFinalMask)
 
     def saveLabelDf(self):
-        """Save a csv file where each row is stats for one mask label.
+        """Save a table where each row is stats for one mask label.
         """
-        dfPath = self._getLabelFilePath()
         if self._dfLabels is not None:
-            logger.info(f'saving label df: {dfPath}')
-            self._dfLabels.to_csv(dfPath, index=False)
+            self._store.saveLabels(self._dfLabels)
 
     def loadLabelDf(self) -> pd.DataFrame:
-        dfPath = self._getLabelFilePath()
-        if not os.path.isfile(dfPath):
-            return
-        #logger.info(f'loading label df: {dfPath}')
-        df = pd.read_csv(dfPath)
-        return df
+        return self._store.loadLabels()
 
-    def _getLabelFilePath(self) -> str:
-        """Get path to save/load label df (self._dfMaster).
-        
-        Each row has stats for one label.
+    def loadSavedPlane(self, name : str, zPlane : int) -> np.ndarray:
+        """Load one z plane of a saved array without loading the stack.
 
-        See: analizeOligoDapi()
+        Args:
+            name: Like 'rgb', 'mask-cyto', 'filtered-cyto', 'dapi-final-mask'
+            zPlane: z plane index
+
+        Returns:
+            None if the array has not been saved
         """
-        dfPath = self.getBaseSaveFile()
-        dfPath += f'-labels.csv'
-        return dfPath
+        return self._store.loadArray(name, zSlice=zPlane)
 
     def _getSaveFolder(self) -> str:
         """Get the save folder and make if neccessary.
         
-        The save folder is <parent folder>/<parent folder>-analysis
-        """
-        _folder, _file = os.path.split(self._path)
-        _, _parentFolder = os.path.split(_folder)
-        
-        # _saveFolder is shared by all files in parentFolder
-        _saveFolder = os.path.join(_folder, _parentFolder + '-analysis')
-        if not os.path.isdir(_saveFolder):
-            logger.info(f'making analysis save folder:')
-            logger.info(f'  {_saveFolder}')
-            os.mkdir(_saveFolder)
-        
-        # each raw tif/czi go into a different folder
-        #_cellFolder = os.path.splitext(_file)[0]
-        # use full file name with extension for folder, this way folders are uunique files
-        _cellFolder = os.path.join(_saveFolder, _file)
-        if not os.path.isdir(_cellFolder):
-            logger.info(f'making analysis folder for file "{_file}":')
-            logger.info(f'  {_cellFolder}')
-            os.mkdir(_cellFolder)
-
-        return _cellFolder
-
-    def _getImageMaskPath(self, imageChannel : imageChannels) -> str:
-        """Get the full path to an image mask.
-        
-        This file ends in -mask-{channelStr}.tif
-
-        Args:
-            channelStr: in ['red', 'green']
+        The save folder is <parent folder>/<parent folder>-analysis/<file>
         """
-        maskPath = self.getBaseSaveFile()
-        maskPath += f'-mask-{imageChannel.value}.tif'
-        return maskPath
-
-    def _getImageFilteredPath(self, imageChannel : imageChannels) -> str:
-        """Get the full path to a (gaussian) filtered image.
-        
-        This file ends in -filtered-{channelStr}.tif
-
-        Args:
-            channelStr: In ['red', 'green']
-        """
-        filteredPath = self.getBaseSaveFile()
-        filteredPath += f'-filtered-{imageChannel.value}.tif'
-        return filteredPath
+        return self._store.getSaveFolder()
 
     def getImageChannel(self, imageChannel : imageChannels, rawCzi = False) -> np.ndarray:
         """Get an image (color) channel from rgb stack.
         
         Args:
             channelStr: In ['red', 'green']
+            rawCzi: If True, get the raw channel as a loadCzi.lazyCziChannel,
+                pixels are only read when indexed or used as np.ndarray
 
         Assuming rgb stack has channel order (slice, y, x, channel)
         """
@@ -531,87 +628,169 @@ class oligoAnalysis():
             else:
                 return self._rgbStack[:, :, :, self.dapiChannel]  # 1
 
-    def _getRgbStack(self, forceMake=False) -> np.ndarray:
+    def getRawChannelStats(self, imageChannel : imageChannels, forceCompute = False) -> dict:
+        """Get intensity stats of a raw czi channel.
+
+        Computed in one pass over z planes and cached in the header
+        (saved with saveHeader), next time we do not read any pixels.
+        The full intensity histogram is saved as 'raw-histogram-{channelStr}'
+
+        Args:
+            imageChannel:
+            forceCompute: If True then always compute from raw czi
+
+        Returns:
+            dict with keys like 'RawMin', 'RawMax', 'RawMean', 'RawP99'
+        """
+        _chStr = imageChannel.value
+        rawStats = {_stat: self._header[f'{_chStr}{_stat}'] for _stat in rawStatsKeys}
+        if not forceCompute and all(v is not None for v in rawStats.values()):
+            return rawStats
+
+        logger.info(f'{self.filename} computing raw stats for {_chStr}')
+        imgData = self.getImageChannel(imageChannel, rawCzi=True)
+        _stats = oligoUtils.getChannelStats(imgData, percentiles=rawStatsPercentiles)
+
+        rawStats = {
+            'RawMin': _stats['min'],
+            'RawMax': _stats['max'],
+            'RawMean': _stats['mean'],
+        }
+        for _percentile, _value in _stats['percentiles'].items():
+            rawStats[f'RawP{_percentile}'] = _value
+        for _stat, _value in rawStats.items():
+            self._header[f'{_chStr}{_stat}'] = _value
+
+        if _stats['histogram'] is not None:
+            self._store.saveArray(f'raw-histogram-{_chStr}', _stats['histogram'])
+        self.saveHeader()
+
+        return rawStats
+
+    def loadRawHistogram(self, imageChannel : imageChannels) -> np.ndarray:
+        """Load the raw intensity histogram, counts per intensity.
+
+        Created in getRawChannelStats()
+        """
+        return self._store.loadArray(f'raw-histogram-{imageChannel.value}')
+
+    def _getRgbStack(self, forceMake=False, zBlockSize : int = 1,
+                        downscale : str = None) -> np.ndarray:
         """Load or make an rgb stack from raw file.
         
-        If rgb tif exists then load, otherwise make and save.
+        If rgb tif exists and was made from the current raw file and parameters then load,
+        otherwise make and save.
+
+        Args:
+            forceMake: if True then always remake from czi file
+            zBlockSize: number of z planes to make at once, see _makeRgbStack()
+            downscale: In ['zoom', 'mean'], see oligoUtils.downscaleXY()
+                if None then use header rgbDownscale
         """
-        rgbSavePath = self._getRgbPath()
+        if downscale is None:
+            downscale = self._header['rgbDownscale']
+        else:
+            self._header['rgbDownscale'] = downscale
 
         # if True then always remake from czi file
         # if False then load what we saved
         #forceMake = False # on flight to sfn2022
         logger.info(f'  forceMake:{forceMake} SFN NOT LOADING, if True then REGENERATING _rgbStack EACH TIME')
 
-        if not forceMake and os.path.isfile(rgbSavePath):
-            logger.info(f'  Loading rgb stack: {rgbSavePath}')
-            _rgbStack =  tifffile.imread(rgbSavePath)
-        else:
-            img = AICSImage(self._path)
-            imgData = img.get_image_data("ZYXC", T=0)
-            # imgData is like: (21, 784, 784, 2)
-            logger.info(f'  AICSImage loaded raw imgData: {imgData.shape} {imgData.dtype}')
+        key = self.getCacheKey('rgb')
+        savedKey = self._header['cacheKeys'].get('rgb')
+        if savedKey is None and self._store.hasArray('rgb'):
+            # saved before we had cache keys, trust it
+            savedKey = key
+        elif savedKey != key:
+            logger.info(f'  rgb stack was made from a different raw file or parameters')
 
-            # convert to 8 bit, we need to do each channel to maximize histogram
-            imgData_ch1 = imgData[:,:,:,0]
-            imgData_ch2 = imgData[:,:,:,1]
+        if forceMake or savedKey != key or not self._store.hasArray('rgb'):
+            self._makeRgbStack(zBlockSize=zBlockSize, downscale=downscale)
+        self._header['cacheKeys']['rgb'] = key
+        self._arrayKeys['rgb'] = key
 
-            # oligoUtils.printStack(imgData_ch1, ' . raw imgData_ch1')
-            # oligoUtils.printStack(imgData_ch2, ' . raw imgData_ch2')
-
-            imgData_ch1 = oligoUtils.getEightBit(imgData_ch1, maximizeHistogram=False)
-            imgData_ch2 = oligoUtils.getEightBit(imgData_ch2, maximizeHistogram=False)
-            
-            # oligoUtils.printStack(imgData_ch1, ' . 8-bit imgData_ch1')
-            # oligoUtils.printStack(imgData_ch2, ' . 8-bit imgData_ch2')
-            
-            # make rgb stack, assuming we loaded 'ZYXC'
-            _shape = imgData.shape
-            _rgbDim = (_shape[0], _shape[1], _shape[2], imgData.shape[3]+1)
-            _rgbStack = np.ndarray(_rgbDim, dtype=np.uint8)
-            _rgbStack[:,:,:,0] = imgData_ch1
-            _rgbStack[:,:,:,1] = imgData_ch2
-            _rgbStack[:,:,:,2] = 0
-
-            # for Whistler, we need to make image 1/4 size
-            # cellpose want nuclei to be about 10 pixels
-            # Whistler data is zoomed in and nuclei are like 30 pixels
-            xyScaleFactor = self._header['xyScaleFactor']
-            _zoom = (1, xyScaleFactor, xyScaleFactor, 1)
-            _rgbStack = zoom(_rgbStack, _zoom)
-            oligoUtils.printStack(_rgbStack, f'after zoom by {xyScaleFactor}, _rgbStack')
-
-            # get the min/max of each channel
-            # need to cast to int() because np return uint8 which is not json serliazable
-            dapiImg = _rgbStack[:, :, :, self.dapiChannel]
-            self._header['dapiMinInt'] = int(np.min(dapiImg))
-            self._header['dapiMaxInt'] = int(np.max(dapiImg))
-            cytoImg = _rgbStack[:, :, :, self.cytoChannel]
-            self._header['cytoMinInt'] = int(np.min(cytoImg))
-            self._header['cytoMaxInt'] = int(np.max(cytoImg))
-
-            logger.info(f'  saving rgb stack:')
-            logger.info(f'    {rgbSavePath}')
-            tifffile.imwrite(rgbSavePath, _rgbStack)
+        logger.info(f'  Loading rgb stack: {self.filename}')
+        _rgbStack = self._store.loadArray('rgb')
 
         return _rgbStack
 
+    def _makeRgbStack(self, zBlockSize : int = 1, downscale : str = 'zoom'):
+        """Make and save an rgb stack from raw file, a block of z planes at a time.
+
+        Each block is read from the czi, converted to 8-bit, downscaled in x/y,
+        and written into an on disk array (see oligoStore arrayWriter).
+        Peak memory is one block, not the stack.
+
+        For Whistler, we need to make image 1/4 size.
+        Cellpose want nuclei to be about 10 pixels,
+        Whistler data is zoomed in and nuclei are like 30 pixels.
+
+        Assigns header dapiMinInt, dapiMaxInt, cytoMinInt, cytoMaxInt
+        from the 8-bit downscaled stack.
+        """
+        img = loadCzi.getReader(self._path)
+        imgDask = img.get_image_dask_data("ZYXC", T=0)
+        # imgDask is like: (21, 784, 784, 2)
+        logger.info(f'  AICSImage raw imgData: {imgDask.shape} {imgDask.dtype}')
+
+        xyScaleFactor = self._header['xyScaleFactor']
+        numSlices, _, _, numChannels = imgDask.shape
+
+        # min/max of each channel (r, g)
+        channelMin = [None] * numChannels
+        channelMax = [None] * numChannels
+
+        # make the rgb array from the shape of the first downscaled plane
+        rgbStack = None
+        with contextlib.ExitStack() as _stack:
+            for _start in range(0, numSlices, zBlockSize):
+                _stop = min(_start + zBlockSize, numSlices)
+                imgBlock = np.asarray(imgDask[_start:_stop].compute())
+
+                for _channel in range(numChannels):
+                    # convert to 8 bit
+                    _oneChannel = oligoUtils.getEightBit(imgBlock[:, :, :, _channel], maximizeHistogram=False)
+                    _oneChannel = oligoUtils.downscaleXY(_oneChannel, xyScaleFactor, method=downscale)
+
+                    if rgbStack is None:
+                        # make rgb stack, assuming we loaded 'ZYXC'
+                        _rgbDim = (numSlices, _oneChannel.shape[1], _oneChannel.shape[2], numChannels+1)
+                        logger.info(f'  making rgb stack {_rgbDim}')
+                        rgbStack = _stack.enter_context(self._store.arrayWriter('rgb', _rgbDim,
+                                                                    np.uint8, photometric='rgb'))
+                        rgbStack[:, :, :, numChannels:] = 0
+
+                    rgbStack[_start:_stop, :, :, _channel] = _oneChannel
+
+                    _min = int(np.min(_oneChannel))
+                    _max = int(np.max(_oneChannel))
+                    channelMin[_channel] = _min if channelMin[_channel] is None else min(_min, channelMin[_channel])
+                    channelMax[_channel] = _max if channelMax[_channel] is None else max(_max, channelMax[_channel])
+
+            oligoUtils.printStack(rgbStack, f'after zoom by {xyScaleFactor}, _rgbStack')
+
+            logger.info(f'  saving rgb stack: {self.filename}')
+
+        # get the min/max of each channel
+        # need to cast to int() because np return uint8 which is not json serliazable
+        self._header['dapiMinInt'] = channelMin[self.dapiChannel]
+        self._header['dapiMaxInt'] = channelMax[self.dapiChannel]
+        self._header['cytoMinInt'] = channelMin[self.cytoChannel]
+        self._header['cytoMaxInt'] = channelMax[self.cytoChannel]
+
     def getCellPoseMask(self) -> np.ndarray:
         """Get the cellpose mask from _seg.npy file.
 
         This is saved by cellpose outside oligoAnalysis
         """
-        cellPoseSegPath = self._getCellPoseDapiMaskPath()
-        if os.path.isfile(cellPoseSegPath):
-            #self._header['cellpose'] = 'Yes'
-            pass
-        else:
+        if not self._store.hasArray('cellpose-mask'):
+            cellPoseSegPath = self._getCellPoseDapiMaskPath()
             logger.warning(f'Did not find cellpose _seg.npy file {os.path.split(cellPoseSegPath)[1]}:')
             logger.warning(f'  You need to run a model in cellpose on the 3d rgb stack.')
             #logger.warning(f'    {cellPoseSegPath}')
             return
-        dat = np.load(cellPoseSegPath, allow_pickle=True).item()
-        masks = dat['masks']
+        masks = self._store.loadArray('cellpose-mask')
 
         return masks
 
@@ -627,20 +806,17 @@ class oligoAnalysis():
         elif imageChannel == imageChannels.dapi:
             return self._greenImageFiltered
 
-    def loadImageMask(self, imageChannel : imageChannels) -> np.ndarray:
+    def loadImageMask(self, imageChannel : imageChannels, out : np.ndarray = None) -> np.ndarray:
         """Load the filtered thresholded binary mask.
 
         Args:
             channelStr: In ['red', 'green']
+            out: preallocated boolean array to unpack the saved mask into
 
         Created in analyzeImageMask()
         """
-        maskPath = self._getImageMaskPath(imageChannel)
-        if os.path.isfile(maskPath):
-            # load
-            #logger.info(f'Loading image mask "{self.filename}" {imageChannel.value} {maskPath}')
-            imgData_binary = tifffile.imread(maskPath)
-            return imgData_binary
+        #logger.info(f'Loading image mask "{self.filename}" {imageChannel.value}')
+        return self._loadArray(f'mask-{imageChannel.value}', isMask=True, out=out)
 
     def loadImageFiltered(self, imageChannel : imageChannels) -> np.ndarray:
         """Load the (gaussian) filtered image.
@@ -650,12 +826,22 @@ class oligoAnalysis():
 
         Created in analyzeImageMask()
         """
-        maskPath = self._getImageFilteredPath(imageChannel)
-        if os.path.isfile(maskPath):
-            # load
-            #logger.info(f'Loading image filtered "{self.filename}" {imageChannel.value} {maskPath}')
-            imgData_binary = tifffile.imread(maskPath)
-            return imgData_binary
+        #logger.info(f'Loading image filtered "{self.filename}" {imageChannel.value}')
+        return self._loadArray(f'filtered-{imageChannel.value}')
+
+    def getImageFilteredIntensity(self, imageChannel : imageChannels) -> np.ndarray:
+        """Get the filtered image as float32 intensities.
+
+        Undoes the rescale when filteredDtype is an integer type,
+        see oligoUtils.restorePrecision().
+        """
+        imgFiltered = self.getImageFiltered(imageChannel)
+        if imgFiltered is None:
+            return
+        _chStr = imageChannel.value
+        return oligoUtils.restorePrecision(imgFiltered,
+                                            self._header[f'{_chStr}FilteredScale'],
+                                            self._header[f'{_chStr}FilteredOffset'])
         
     def analyzeImageMask(self, imageChannel : imageChannels, gaussianSigma = None):
         """Create a binary image mask for either dapi or cyto
@@ -678,7 +864,12 @@ class oligoAnalysis():
         logger.info(f'{self.filename} imageChannel:{imageChannel.value} _gaussianSigma:{gaussianSigma}')
         
         otsuThreshold, imgData_blurred, imgData_binary = \
-            oligoUtils.getOtsuThreshold(imgData, sigma=gaussianSigma)
+            oligoUtils.getOtsuThreshold(imgData, sigma=gaussianSigma,
+                                        method=self._header['otsuMethod'])
+
+        # threshold and mask use full precision, we keep the filtered image in filteredDtype
+        imgData_blurred, _filteredScale, _filteredOffset = \
+            oligoUtils.reducePrecision(imgData_blurred, self._header['filteredDtype'])
         
         # calculate pixel stats
         numStackPixels = imgData_binary.size
@@ -695,6 +886,11 @@ class oligoAnalysis():
         self._header[f'{_chStr}StackPixels'] = numStackPixels
         self._header[f'{_chStr}MaskPixels'] = numMaskPixels
         self._header[f'{_chStr}MaskPercent'] = maskPercent
+        self._header[f'{_chStr}FilteredScale'] = _filteredScale
+        self._header[f'{_chStr}FilteredOffset'] = _filteredOffset
+
+        self._arrayKeys[f'mask-{_chStr}'] = self.getCacheKey(f'mask-{_chStr}')
+        self._arrayKeys[f'filtered-{_chStr}'] = self.getCacheKey(f'filtered-{_chStr}')
 
         if imageChannel == imageChannel.cyto:
             self._redImageMask = imgData_binary
@@ -706,8 +902,42 @@ class oligoAnalysis():
 
         return imgData_binary, imgData_blurred
 
+    def sweepImageMask(self, imageChannel : imageChannels, sigmas = (0.4, 0.7, 1.0),
+                        cascade : bool = False, returnMasks : bool = False):
+        """Otsu threshold and mask percent for a list of gaussian sigma.
+
+        The channel is loaded once for all sigma.
+        Does not change the header or the image masks, see analyzeImageMask().
+
+        Args:
+            imageChannel:
+            sigmas: list of scalar or (z,y,x)
+            cascade: if True then blur each sigma from the previous,
+                see oligoUtils.sweepOtsuThreshold()
+            returnMasks: if True also return list of binary mask, one per sigma
+
+        Returns:
+            pd.DataFrame with one row per sigma
+        """
+        logger.info(f'{self.filename} imageChannel:{imageChannel.value} sigmas:{sigmas}')
+
+        imgData = self.getImageChannel(imageChannel, rawCzi=False)
+        _results = oligoUtils.sweepOtsuThreshold(imgData, sigmas, cascade=cascade,
+                                                    returnMasks=returnMasks)
+        if returnMasks:
+            _results, masks = _results
+
+        df = pd.DataFrame(_results)
+        df.insert(0, 'imageChannel', imageChannel.value)
+        df.insert(0, 'file', self.filename)
+
+        if returnMasks:
+            return df, masks
+        return df
+
     def analyzeOligoDapi(self, dilateIterations : int = None,
-                        erodeIterations : int = None):
+                        erodeIterations : int = None,
+                        method : str = 'vectorized'):
         """
         For each labeled mask in cell pose dapi mask
             - dilate
@@ -715,6 +945,14 @@ class oligoAnalysis():
             - make a ring mask
             - sum pixels in the 'other' channel contained in this ring
 
+        Args:
+            dilateIterations:
+            erodeIterations:
+            method: In ['vectorized', 'perLabel']
+                'vectorized' does all labels at once (see oligoRing.ringAnalysis)
+                'perLabel' loops over labels in their bounding box, uses less memory
+                    (see oligoRing.ringAnalysisPerLabel)
+
         Requires:
             Cellpose dapi mask
             
@@ -724,7 +962,7 @@ class oligoAnalysis():
 
         # this is the dapi mask output by cellpose
         # it will not exist if we did not run cllpose on this stack
-        logger.info(f'{self.filename}')
+        logger.info(f'{self.filename} method:{method}')
         
         _cellPoseDapiMask = self.getCellPoseMask()
         if _cellPoseDapiMask is None:
@@ -743,68 +981,50 @@ class oligoAnalysis():
         # TODO: sloppy, we don't always need to save
         #self.saveHeader()
 
-        maskLabelList = np.unique(_cellPoseDapiMask)
-
-        dapi_final_mask = np.zeros_like(_cellPoseDapiMask)  # dapi mask after dilation
-        logger.info(f'making dapi_dilated_mask: {dapi_final_mask.shape} {dapi_final_mask.dtype}')
-
-        listOfDict = []  # convert to pandas dataframe at end
-
-        for maskLabel in maskLabelList:
-            if maskLabel == 0:
-                # background
-                continue
-            
-            _oneMask = _cellPoseDapiMask == maskLabel  # (46, 196, 196)
-            #print('_oneMask:', type(_oneMask), _oneMask.shape, _oneMask.dtype)
+        if method == 'vectorized':
+            dapi_final_mask, self._dfLabels = oligoRing.ringAnalysis(_cellPoseDapiMask,
+                                                    self._redImageMask,
+                                                    dilateIterations=dilateIterations,
+                                                    erodeIterations=erodeIterations)
+        elif method == 'perLabel':
+            dapi_final_mask, self._dfLabels = oligoRing.ringAnalysisPerLabel(_cellPoseDapiMask,
+                                                    self._redImageMask,
+                                                    dilateIterations=dilateIterations,
+                                                    erodeIterations=erodeIterations)
+        else:
+            logger.error(f'Did not understand method: {method}')
+            return
+        
+        self._arrayKeys['dapi-final-mask'] = self.getCacheKey('dapi-final-mask')
 
-            # dilate the mask
-            if dilateIterations>0:
-                _dilatedMask = scipy.ndimage.binary_dilation(_oneMask, iterations=dilateIterations)
-            else:
-                _dilatedMask = _oneMask
+        return dapi_final_mask
 
-            if erodeIterations>0:
-                _erodedMask = scipy.ndimage.binary_erosion(_oneMask, iterations=erodeIterations)
-            else:
-                _erodedMask = _oneMask
+    def sweepRingParameters(self, dilateRange = range(0, 5),
+                            erodeRange = range(0, 5)) -> pd.DataFrame:
+        """Ring analysis for all combinations of dilate and erode iterations.
 
-            #print('  dilatedMask:', type(dilatedMask), dilatedMask.shape, dilatedMask.dtype, np.sum(dilatedMask))
+        Does not change the header, _dfLabels, or _dapiFinalMask.
+        Costs about one ring analysis with the largest iterations,
+        see oligoRing.sweepRingAnalysis().
 
-            # make a ring
-            #dilatedMask = dilatedMask ^ _oneMask
-            finalMask = _dilatedMask ^ _erodedMask  # carrot (^) is xor
+        Args:
+            dilateRange: list of dilateIterations
+            erodeRange: list of erodeIterations
 
-            # the number of pixels in the dilated/eroded dapi mask
-            finalMaskCount = np.count_nonzero(finalMask)
+        Returns:
+            pd.DataFrame with one row per (dilateIterations, erodeIterations, label)
+        """
+        logger.info(f'{self.filename} dilateRange:{list(dilateRange)} erodeRange:{list(erodeRange)}')
 
-            # oligo red mask pixels in the (dilated/eroded) dapi mask
-            redImageMask = np.where(finalMask==True, self._redImageMask, 0)  # 0 is fill value
-            #print('  redImageMask:', type(redImageMask), redImageMask.shape, redImageMask.dtype, np.sum(redImageMask))
+        _cellPoseDapiMask = self.getCellPoseMask()
+        if _cellPoseDapiMask is None:
+            logger.warning('Did not perform ring sweep, no cellpose dapi mask')
+            return
 
-            # like cellpose_dapi_mask but after dilation
-            finalMaskLabel = finalMask.copy().astype(np.int64)
-            #print('1 ', dilatedMaskLabel.dtype, np.max(dilatedMaskLabel))
-            # +1 so colors are different from cellpose_dapi_mask
-            finalMaskLabel[finalMaskLabel>0] = maskLabel + 1   
-            #print('  2 ', dilatedMaskLabel.dtype, np.max(dilatedMaskLabel))
-            dapi_final_mask = dapi_final_mask + finalMaskLabel
-            #print('  dapi_dilated_mask:', dapi_dilated_mask.shape, np.sum(dapi_dilated_mask))
-            
-            redImageMaskPercent = np.sum(redImageMask) / finalMaskCount * 100
-            
-            oneDict = {
-                'label': maskLabel,
-                'finalMaskCount': finalMaskCount,  # num pixels in dilated mask
-                'cytoImageMaskSum': np.sum(redImageMask),  # sum of red mask in dilated dapi mask
-                'cytoImageMaskPercent': redImageMaskPercent,  # fraction of pixels in red mask in dilated mask
-                'accept': '',  # '' indicates False
-            }
-            listOfDict.append(oneDict)
-            
-        self._dfLabels = pd.DataFrame(listOfDict)
-        
-        return dapi_final_mask
+        df = oligoRing.sweepRingAnalysis(_cellPoseDapiMask, self._redImageMask,
+                                            dilateRange=dilateRange,
+                                            erodeRange=erodeRange)
+        return df
 
 def check_OligoAnalysis():
     cziPath = '/Users/cudmore/Dropbox/data/whistler/data-oct-10/FST/B35_Slice2_RS_DS1.czi'
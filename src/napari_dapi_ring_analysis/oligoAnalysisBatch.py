@@ -1,20 +1,47 @@
 import os
 import sys
 import pandas as pd
-import numpy as np
 
 import napari_dapi_ring_analysis as dra
 from napari_dapi_ring_analysis._logger import logger
+from napari_dapi_ring_analysis import oligoPipeline
 
-def batchMakeAnalysis(folderPathList, cytoSigma: float = 0.7):
+def batchMakeAnalysis(folderPathList, cytoSigma: float = 0.7, summaryPath : str = None,
+                        numWorkers : int = None, budgetBytes : int = None):
     """Step through all data in a list of folders.
+
+    Only files and stages that are not up to date are analyzed,
+    see oligoPipeline.runPipeline().
+
+    Args:
+        folderPathList: list of folders with czi files
+        cytoSigma: gaussian sigma for cyto mask, dapi uses 3
+        summaryPath: full path to summary sqlite, see oligoSummary.loadSummary()
+        numWorkers: number of worker processes, if None then size from budgetBytes
+            (see oligoPipeline.getNumWorkers()), 1 to run in this process
+        budgetBytes: RAM for stacks in memory at the same time,
+            if None then use oligoPipeline.getMemoryBudget()
     """
-    dfMaster = pd.DataFrame()
+    # Christine analysis, cytoDapiRatio is the ratio of percent cyto/dapi (12/13/22)
+    return oligoPipeline.runPipeline(folderPathList, summaryPath=summaryPath,
+                                        cytoSigma=cytoSigma, dapiSigma=3,
+                                        numWorkers=numWorkers, budgetBytes=budgetBytes)
+
+def batchSweepImageMask(folderPathList, cytoSigmas = (0.4, 0.7, 1.0),
+                        dapiSigmas = (3,)) -> pd.DataFrame:
+    """Otsu threshold and mask percent of each file for a list of sigma.
+
+    Each file is loaded once for all sigma, see oligoAnalysis.sweepImageMask().
+    Does not change saved analysis.
 
+    Returns:
+        pd.DataFrame with one row per (file, imageChannel, sigma)
+    """
+    dfList = []
     for folderPath in folderPathList:
-        
+
         print('== processing folderPath:', folderPath)
-        
+
         oaf = dra.oligoAnalysisFolder(folderPath)
 
         dfFolder = oaf.getDataFrame()
@@ -22,83 +49,30 @@ def batchMakeAnalysis(folderPathList, cytoSigma: float = 0.7):
             logger.error(f'Did not find image files for folder: {folderPath}')
             continue
 
-        #print(dfFolder)
-
-        files = dfFolder['file'].values
-        # dictList = []
+        files = dfFolder['path'].values
         for _fileIdx, file in enumerate(files):
-            
+
             # full path to file
             file = os.path.join(folderPath, file)
-            
+
             print(f'    === file {_fileIdx+1} of {len(files)}')
             print(f'    === file {file}')
 
-            # files = dfFolder['']
-            oa = oaf.getOligoAnalysis(file)
-
-            # run aics segmentation (fills in aics % in header)
-            oa.aicsAnalysis()
-
-            # grab cellpose mask and count number of labels
-            _cellPoseMask = oa.getCellPoseMask()
-            if _cellPoseMask is not None:
-                # need to update the table
-                oa._header['num labels'] = len(np.unique(_cellPoseMask))
-            else:
-                oa._header['num labels'] = float('nan')
+            oa = oaf.getOligoAnalysis(file, loadImages=False)
+            oa._rgbStack = oa._getRgbStack()
 
-            dapiImg = oa.getImageChannel(dra.imageChannels.dapi, rawCzi=True)
-            # dapiMin = np.min(dapiImg)
-            # dapiMax = np.max(dapiImg)
-            # dapiRange = dapiMax - dapiMin
+            _dfCyto = oa.sweepImageMask(dra.imageChannels.cyto, cytoSigmas)
+            _dfDapi = oa.sweepImageMask(dra.imageChannels.dapi, dapiSigmas)
+            _df = pd.concat([_dfCyto, _dfDapi], ignore_index=True)
+            _df.insert(0, 'folder', folderPath)
+            dfList.append(_df)
 
-            # bring cyto gaussian down to 0.7
-            cytoImg = oa.getImageChannel(dra.imageChannels.cyto, rawCzi=True)
-            # cytoMin = np.min(cytoImg)
-            # cytoMax = np.max(cytoImg)
-            # cytoRange = cytoMax - cytoMin
-
-            # these are assigned in oa when we create small-3d-rgb (need to add function)
-            oa._header['dapiMinInt'] = int(np.min(dapiImg))
-            oa._header['dapiMaxInt'] = int(np.max(dapiImg))
-
-            oa._header['cytoMinInt'] = int(np.min(cytoImg))
-            oa._header['cytoMaxInt'] = int(np.max(cytoImg))
-
-            # when oligo analysis is loaded  (by oligo analysis folder)
-            # it auto make masks with gaussianSigma=1
-            oa.analyzeImageMask(dra.imageChannels.cyto, gaussianSigma=cytoSigma)
-            oa.analyzeImageMask(dra.imageChannels.dapi, gaussianSigma=3)
-
-            oa._header['cytoDapiRatio'] = oa._header['cytoMaskPercent'] / oa._header['dapiMaskPercent']
-
-            # unload raw data
             oa.unloadRawData()
+            oa._rgbStack = None
 
-        _dfFolder = oaf.getAnalysisDataFrame()
-        
-        # Christine analysis
-        # make a new column with ration of percent cyto/dapi
-        # logger.info('MAKING cytoDapiRatio !!!! FROM 12/13/22 with Christine')
-        # _dfFolder['cytoDapiRatio'] = _dfFolder['cytoMaskPercent'] / _dfFolder['dapiMaskPercent']
-
-        dfMaster = pd.concat([dfMaster, _dfFolder])
-        
-        # save to one csv
-        # savePath = '/Users/cudmore/Dropbox/data/whistler/cudmore/oligo-simmary-20221214-v2.csv'
-        # savePath = '/Users/cudmore/Dropbox/data/whistler/cudmore/oligo-simmary-20230111-saline.csv'
-        #savePath = f'/Users/cudmore/Dropbox/data/whistler/cudmore/oligo-simmary-20230112-cs-{cytoSigma}.csv'
-        
-        # adding new aics analysis
-        # savePath = f'/media/cudmore/data/Dropbox/data/whistler/cudmore/oligo-summary-20230121-cs-{cytoSigma}-v3.csv'
-
-        savePath = f'/media/cudmore/data/Dropbox/data/whistler/cudmore/oligo-summary-20230123-Saline-{cytoSigma}-v3.csv'
-
-        
-        logger.info(f'saving to: {savePath}')
-        dfMaster.to_csv(savePath)
-
+    if len(dfList) == 0:
+        return pd.DataFrame()
+    return pd.concat(dfList, ignore_index=True)
 
 if __name__ == '__main__':
     # import sys
@@ -147,7 +121,14 @@ if __name__ == '__main__':
     #     '/Users/cudmore/Dropbox/data/whistler/cudmore/20221216/Saline',
     # ]
 
+    # save to one csv
+    # savePath = '/Users/cudmore/Dropbox/data/whistler/cudmore/oligo-simmary-20221214-v2.csv'
+    # savePath = f'/media/cudmore/data/Dropbox/data/whistler/cudmore/oligo-summary-20230121-cs-{cytoSigma}-v3.csv'
+    # savePath = f'/media/cudmore/data/Dropbox/data/whistler/cudmore/oligo-summary-20230123-Saline-{cytoSigma}-v3.csv'
+    cytoSigma = 0.7
+    summaryPath = f'/media/cudmore/data/Dropbox/data/whistler/cudmore/oligo-summary-cs-{cytoSigma}.sqlite'
+
     # batchMakeAnalysis(folderPathList, cytoSigma = 0.4)
-    batchMakeAnalysis(folderPathList, cytoSigma = 0.7)
+    batchMakeAnalysis(folderPathList, cytoSigma = cytoSigma, summaryPath = summaryPath)
     # batchMakeAnalysis(folderPathList, cytoSigma = 1.0)
     
\ No newline at end of file
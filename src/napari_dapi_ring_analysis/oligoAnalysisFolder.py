@@ -1,12 +1,14 @@
 """
 """
 import os
+from typing import Callable
 
 import pandas as pd
 
 from napari_dapi_ring_analysis import loadCzi
-from napari_dapi_ring_analysis.oligoAnalysis import oligoAnalysis
+from napari_dapi_ring_analysis.oligoAnalysis import oligoAnalysis, loadAnalysisHeader
 from napari_dapi_ring_analysis._logger import logger
+from napari_dapi_ring_analysis._parallel import parallelMap
 
 from napari_dapi_ring_analysis._cellpose import runModelOnImage
 from cellpose.io import logger_setup
@@ -42,27 +44,78 @@ def old_batchRunFolder(folderPath : str):
         # TODO: unload oligoAnalysis
         oa = None  # does this free memory ?
 
+class lazyOligoAnalysis():
+    """Placeholder for an oligoAnalysis that is only made when needed.
+
+    The header comes from the folder czi header and the saved header json,
+    no czi file, images or labels csv are loaded.
+    """
+    def __init__(self, path : str, cziHeader : dict = None, storage : str = None):
+        """
+        Args:
+            path: Full path to raw image (czi file)
+            cziHeader: header from loadCzi.loadFolder(), if None then load from path
+            storage: storage backend, see oligoStore.getStore()
+        """
+        self._path = path
+        self._cziHeader = cziHeader
+        self._storage = storage
+        self._header = None
+        self._oligoAnalysis = None
+
+    def isMade(self) -> bool:
+        """True if the full oligoAnalysis has been made.
+        """
+        return self._oligoAnalysis is not None
+
+    def getHeader(self) -> dict:
+        """Get the analysis header, same as oligoAnalysis.getHeader().
+        """
+        if self._oligoAnalysis is not None:
+            return self._oligoAnalysis.getHeader()
+        if self._header is None:
+            self._header = loadAnalysisHeader(self._path, cziHeader=self._cziHeader,
+                                                storage=self._storage)
+        return self._header
+
+    def getOligoAnalysis(self) -> oligoAnalysis:
+        """Get the full oligoAnalysis, make if necc.
+        """
+        if self._oligoAnalysis is None:
+            logger.info(f'making oligoAnalysis for {os.path.split(self._path)[1]}')
+            self._oligoAnalysis = oligoAnalysis(self._path, cziHeader=self._cziHeader,
+                                                storage=self._storage)
+            self._header = None
+        return self._oligoAnalysis
+
 class oligoAnalysisFolder():
 
-    def __init__(self, folderPath : str = None):
+    def __init__(self, folderPath : str = None, numWorkers : int = 1,
+                    progressCallback : Callable = None, storage : str = None):
         """
         
         Args:
             folderPath: Full path to raw scope stacks.
+            numWorkers: Number of threads to load file headers
+            progressCallback: called as progressCallback(numDone, numTotal)
+                while loading czi headers and again while loading analysis headers
+            storage: In ['tif', 'zarr'], how analysis is saved, see oligoStore.getStore()
         """
-        logger.info(f'{folderPath}')
+        logger.info(f'{folderPath} numWorkers:{numWorkers}')
         
         self._folderPath : str = folderPath
         # Full path to raw scope stack
 
         #logger.info(f'Loading folder: {self._folderPath}')
-        self._dfFolder = loadCzi.loadFolder(self._folderPath)
+        self._dfFolder = loadCzi.loadFolder(self._folderPath,
+                                            numWorkers=numWorkers,
+                                            progressCallback=progressCallback)
         #self._dfFolder = self._loadAllFileHeader()
         # DataFrame of headers for files in _folderPath
 
         self._analysisList = {}  #[None] * len(self._dfFolder)
         # dictionary of per file analysis
-        # keys are filename, values are oligoAnalysis
+        # keys are full path, values are lazyOligoAnalysis
 
         # load oligo analysis headers
         if len(self._dfFolder)==0:
@@ -73,12 +126,18 @@ class oligoAnalysisFolder():
             #     #logger.info(f'  loading file header for: {file}')
             #     filePath = os.path.join(self._folderPath, file)
             #     self._analysisList[file] = oligoAnalysis(filePath)
-            _paths = self._dfFolder['path'].tolist()
-            for _path in _paths:
-                _path = os.path.join(self._folderPath, _path)
-                logger.info(f' analysis key is _path: {_path}')
-                self._analysisList[_path] = oligoAnalysis(_path)
-            logger.info(f'Loaded {len(_paths)} oligoAnalysis files.')
+            _cziHeaders = self._dfFolder.to_dict('records')
+            _paths = [os.path.join(self._folderPath, _cziHeader['path']) for _cziHeader in _cziHeaders]
+            for _path, _cziHeader in zip(_paths, _cziHeaders):
+                #logger.info(f' analysis key is _path: {_path}')
+                self._analysisList[_path] = lazyOligoAnalysis(_path, cziHeader=_cziHeader,
+                                                                storage=storage)
+
+            # load saved header json, full oligoAnalysis is made in getOligoAnalysis()
+            parallelMap(lambda _lazy: _lazy.getHeader(), list(self._analysisList.values()),
+                        numWorkers=numWorkers,
+                        progressCallback=progressCallback)
+            logger.info(f'Loaded {len(_paths)} oligoAnalysis headers.')
 
     def getDataFrame(self):
         """Get the dataframe of loaded file headers.
@@ -94,12 +153,15 @@ class oligoAnalysisFolder():
         removeColumnList = ['xPixels', 'yPixels',
             'yVoxel', 'xyScaleFactor', 'oligoStackPixels', 'oligoMaskPixels']
         
+        # headers are cached until the oligoAnalysis is made
         dictList = []
         for k,v in self._analysisList.items():
-            oa = v
-            oneDict = oa.getHeader()
+            oneDict = v.getHeader()
             dictList.append(oneDict)
         df = pd.DataFrame(dictList)
+
+        # cache keys and pipeline stages are bookkeeping, see oligoAnalysis.getCacheKey()
+        df = df.drop(columns=['cacheKeys', 'pipeline'], errors='ignore')
         
         if removeColumns:
             for _col in removeColumnList:
@@ -130,7 +192,7 @@ class oligoAnalysisFolder():
         
         #logger.info(f'file:{file}')
         if filepath in self._analysisList.keys():
-            oa = self._analysisList[filepath]
+            oa = self._analysisList[filepath].getOligoAnalysis()
             if loadImages and not oa.isLoaded():
                 oa.load()
             #logger.info(f'  returning: {oa}')
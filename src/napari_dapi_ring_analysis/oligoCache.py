@@ -0,0 +1,144 @@
+"""
+Parameter keyed cache of derived volumes (masks, filtered images, ...).
+
+Each derived array has a key, a hash of everything that made it:
+the source file identity, the keys of upstream arrays and the analysis parameters.
+oligoAnalysis records the key of each saved array in its header (cacheKeys),
+a saved array is only used when its recorded key matches.
+
+When a saved array is replaced by one with a different key, the old array is moved
+to a content addressed cache folder, one file per key, shared by all files in a folder.
+Switching back to previous parameters (like gaussianSigma) loads from the cache
+instead of recomputing.
+The cache folder is bounded by cacheMaxBytes, least recently used files are removed.
+"""
+import os
+import json
+import hashlib
+
+import numpy as np
+
+import tifffile
+
+from napari_dapi_ring_analysis._logger import logger
+from napari_dapi_ring_analysis.oligoStore import _saveTif
+
+cacheMaxBytes = 2 * 1024**3
+# maximum size of one cache folder, see artifactCache.evict()
+
+cacheFolderName = 'oligo-cache'
+# in <parent folder>/<parent folder>-analysis/
+
+def fileIdentity(path : str) -> dict:
+    """Identify the version of a file by name, size and modification time.
+
+    Returns:
+        None if the file does not exist
+    """
+    if not os.path.isfile(path):
+        return
+    _stat = os.stat(path)
+    return {
+        'file': os.path.split(path)[1],
+        'size': _stat.st_size,
+        'mtime': _stat.st_mtime_ns,
+    }
+
+def makeCacheKey(**inputs) -> str:
+    """Make a key from inputs, like upstream keys and parameters.
+
+    Inputs must be json serializable (tuples are the same as lists).
+    """
+    _json = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha1(_json.encode('utf-8')).hexdigest()[0:20]
+
+def getCacheFolder(path : str) -> str:
+    """Get the cache folder for a raw image, shared by all files in its folder.
+    """
+    _folder = os.path.split(path)[0]
+    _parentFolder = os.path.split(_folder)[1]
+    return os.path.join(_folder, _parentFolder + '-analysis', cacheFolderName)
+
+class artifactCache():
+    """Content addressed folder of arrays, one tif per key.
+
+    Least recently used files are removed when the folder is over maxBytes.
+    Recency is the file modification time, updated on each load,
+    so it is shared by all processes using the folder.
+    """
+    def __init__(self, cacheFolder : str, maxBytes : int = None):
+        """
+        Args:
+            cacheFolder: made on first save
+            maxBytes: if None then use cacheMaxBytes
+        """
+        self._cacheFolder = cacheFolder
+        self._maxBytes = maxBytes
+
+    @property
+    def maxBytes(self) -> int:
+        return cacheMaxBytes if self._maxBytes is None else self._maxBytes
+
+    def _getPath(self, key : str) -> str:
+        return os.path.join(self._cacheFolder, key + '.tif')
+
+    def has(self, key : str) -> bool:
+        return os.path.isfile(self._getPath(key))
+
+    def load(self, key : str) -> np.ndarray:
+        """Load an array, None if not in the cache.
+        """
+        _path = self._getPath(key)
+        try:
+            data = tifffile.imread(_path)
+        except (FileNotFoundError):
+            return
+        try:
+            os.utime(_path)  # most recently used
+        except (FileNotFoundError):
+            pass
+        return data
+
+    def save(self, key : str, data : np.ndarray):
+        """Save an array and remove least recently used arrays if over maxBytes.
+        """
+        os.makedirs(self._cacheFolder, exist_ok=True)
+        _path = self._getPath(key)
+        _tmpPath = _path + f'.{os.getpid()}.tmp'
+        _saveTif(_tmpPath, data)
+        os.replace(_tmpPath, _path)
+        self.evict()
+
+    def remove(self, key : str):
+        try:
+            os.remove(self._getPath(key))
+        except (FileNotFoundError):
+            pass
+
+    def evict(self):
+        """Remove least recently used arrays until the folder is under maxBytes.
+        """
+        if not os.path.isdir(self._cacheFolder):
+            return
+        fileList = []
+        totalBytes = 0
+        for _entry in os.scandir(self._cacheFolder):
+            if not _entry.name.endswith('.tif'):
+                continue
+            try:
+                _stat = _entry.stat()
+            except (FileNotFoundError):
+                continue
+            fileList.append((_stat.st_mtime_ns, _stat.st_size, _entry.path))
+            totalBytes += _stat.st_size
+
+        fileList.sort()
+        for _mtime, _size, _path in fileList:
+            if totalBytes <= self.maxBytes:
+                break
+            logger.info(f'removing least recently used {os.path.split(_path)[1]}')
+            try:
+                os.remove(_path)
+            except (FileNotFoundError):
+                pass
+            totalBytes -= _size
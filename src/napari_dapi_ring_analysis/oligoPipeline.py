@@ -0,0 +1,439 @@
+"""
+Resumable batch analysis, stages of each file run in dependency order.
+
+    rgb -> cellpose -> ring
+    rgb -> masks ----> ring
+    aics (raw czi)
+    summary (all files)
+
+Each stage has a key, a hash of its inputs and the keys of the stages it depends on
+(see oligoCache.makeCacheKey()). When a stage finishes its key is saved in the
+file header ('pipeline'), a stage is skipped when its saved key matches.
+Headers are saved after every stage, if a batch stops we resume at the
+file and stage where it stopped. Files that are already analyzed with the
+current parameters do not load any images.
+
+Files can run in a pool of worker processes, the number of files running at once
+is limited by a memory budget and an estimate from each czi header.
+"""
+import os
+import time
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+
+from napari_dapi_ring_analysis._logger import logger
+from napari_dapi_ring_analysis import loadCzi
+from napari_dapi_ring_analysis import oligoCache
+from napari_dapi_ring_analysis import oligoSummary
+from napari_dapi_ring_analysis.oligoAnalysis import oligoAnalysis, imageChannels
+
+bytesPerVoxel = 32
+# peak bytes per raw voxel of one file, raw uint16 channel and float64 aics intermediates
+
+workerOverheadBytes = 512 * 1024**2
+# memory of one worker process before loading a file (python, numpy, skimage)
+
+memoryBudgetBytes = None
+# memory for all workers in runPipeline(), None for half the physical memory
+
+class pipelineStage():
+    """One stage of the per file analysis.
+    """
+    def __init__(self, name : str, dependsOn : List[str],
+                    getInputs : Callable, run : Callable):
+        """
+        Args:
+            name: stage name
+            dependsOn: names of stages that must run first
+            getInputs: called as getInputs(oa, params), returns json serializable dict,
+                None if the stage can not run (like no cellpose model)
+            run: called as run(oa, params), results are assigned to oa and saved
+        """
+        self.name = name
+        self.dependsOn = dependsOn
+        self.getInputs = getInputs
+        self.run = run
+
+def _ensureRgb(oa : oligoAnalysis):
+    if oa._rgbStack is None:
+        oa._rgbStack = oa._getRgbStack()
+
+def _ensureCytoMask(oa : oligoAnalysis, params : dict):
+    if oa._redImageMask is None:
+        oa._redImageMask = oa.loadImageMask(imageChannels.cyto)
+    if oa._redImageMask is None:
+        _ensureRgb(oa)
+        oa.analyzeImageMask(imageChannels.cyto, gaussianSigma=params['cytoSigma'])
+
+def _rgbInputs(oa : oligoAnalysis, params : dict) -> dict:
+    return {'rgb': oa.getCacheKey('rgb')}
+
+def _runRgb(oa : oligoAnalysis, params : dict):
+    _ensureRgb(oa)
+
+def _cellposeInputs(oa : oligoAnalysis, params : dict) -> dict:
+    from napari_dapi_ring_analysis._cellpose import getDefaultModel, needsSegmentation
+    pretrained_model = getDefaultModel()
+    if pretrained_model is None:
+        if needsSegmentation(oa._path):
+            return
+        # no model but we have a _seg.npy made outside the pipeline
+        return {'model': None}
+    return {'model': os.path.split(pretrained_model)[1]}
+
+def _runCellpose(oa : oligoAnalysis, params : dict):
+    from napari_dapi_ring_analysis._cellpose import runModelOnImage, needsSegmentation
+    if not needsSegmentation(oa._path):
+        # _seg.npy is newer than the rgb, made outside the pipeline
+        return
+    _ensureRgb(oa)
+    runModelOnImage(imgPath=oa._getRgbPath(), imgData=oa._rgbStack, setupLogger=False)
+
+def _masksInputs(oa : oligoAnalysis, params : dict) -> dict:
+    return {
+        'cytoSigma': params['cytoSigma'],
+        'dapiSigma': params['dapiSigma'],
+        'filteredDtype': oa._header['filteredDtype'],
+        'otsuMethod': oa._header['otsuMethod'],
+    }
+
+def _runMasks(oa : oligoAnalysis, params : dict):
+    _ensureRgb(oa)
+    oa.analyzeImageMask(imageChannels.cyto, gaussianSigma=params['cytoSigma'])
+    oa.analyzeImageMask(imageChannels.dapi, gaussianSigma=params['dapiSigma'])
+    oa.saveImageMask(imageChannels.cyto)
+    oa.saveImageMask(imageChannels.dapi)
+    header = oa.getHeader()
+    header['cytoDapiRatio'] = header['cytoMaskPercent'] / header['dapiMaskPercent']
+
+def _ringInputs(oa : oligoAnalysis, params : dict) -> dict:
+    cellpose = oligoCache.fileIdentity(oa._getCellPoseDapiMaskPath())
+    if cellpose is None:
+        return
+    return {
+        'cellpose': cellpose,
+        'dilateIterations': oa._header['dilateIterations'],
+        'erodeIterations': oa._header['erodeIterations'],
+    }
+
+def _runRing(oa : oligoAnalysis, params : dict):
+    _ensureCytoMask(oa, params)
+    oa._dapiFinalMask = oa.analyzeOligoDapi()
+    _cellPoseMask = oa.getCellPoseMask()
+    oa.getHeader()['num labels'] = len(np.unique(_cellPoseMask)) if _cellPoseMask is not None else float('nan')
+    oa.saveDapiFinalMask()
+    oa.saveLabelDf()
+
+def _aicsInputs(oa : oligoAnalysis, params : dict) -> dict:
+    return {'source': oligoCache.fileIdentity(oa._path)}
+
+def _runAics(oa : oligoAnalysis, params : dict):
+    # raw czi intensity stats, cached in the header after the first run
+    header = oa.getHeader()
+    for imageChannel in [imageChannels.cyto, imageChannels.dapi]:
+        rawStats = oa.getRawChannelStats(imageChannel)
+        header[f'{imageChannel.value}MinInt'] = int(rawStats['RawMin'])
+        header[f'{imageChannel.value}MaxInt'] = int(rawStats['RawMax'])
+    oa.aicsAnalysis(numWorkers=params.get('aicsNumWorkers', 1), lean=True)
+
+pipelineStages = [
+    pipelineStage('rgb', [], _rgbInputs, _runRgb),
+    pipelineStage('cellpose', ['rgb'], _cellposeInputs, _runCellpose),
+    pipelineStage('masks', ['rgb'], _masksInputs, _runMasks),
+    pipelineStage('ring', ['cellpose', 'masks'], _ringInputs, _runRing),
+    pipelineStage('aics', [], _aicsInputs, _runAics),
+]
+# in dependency order, the summary is made from all files in runPipeline()
+
+def getStageKeys(oa : oligoAnalysis, params : dict, stageNames : List[str] = None) -> dict:
+    """Get the current key of each stage, chained through its dependencies.
+
+    Args:
+        oa:
+        params: analysis parameters, like cytoSigma and dapiSigma
+        stageNames: stages to run, stages they depend on are added
+
+    Returns:
+        dict with keys of stage name and values of key, None if the stage can not run
+    """
+    stageKeys = {}
+    for stage in pipelineStages:
+        if stageNames is not None and stage.name not in stageNames:
+            continue
+        stageKeys[stage.name] = _getStageKey(stage, oa, params, stageKeys)
+    return stageKeys
+
+def _getStageKey(stage : pipelineStage, oa : oligoAnalysis, params : dict,
+                    stageKeys : dict) -> str:
+    _inputs = stage.getInputs(oa, params)
+    _upstream = {_name: stageKeys.get(_name) for _name in stage.dependsOn}
+    if _inputs is None or any(_key is None for _key in _upstream.values()):
+        return
+    return oligoCache.makeCacheKey(stage=stage.name, upstream=_upstream, **_inputs)
+
+def _addDependencies(stageNames : List[str]) -> List[str]:
+    stageDict = {stage.name: stage for stage in pipelineStages}
+    _todo = list(stageNames)
+    _names = set()
+    while _todo:
+        _name = _todo.pop()
+        if _name not in stageDict:
+            raise ValueError(f'Did not understand stage "{_name}", expecting one of {list(stageDict.keys())}')
+        if _name not in _names:
+            _names.add(_name)
+            _todo += stageDict[_name].dependsOn
+    return [stage.name for stage in pipelineStages if stage.name in _names]
+
+def runFilePipeline(oa : oligoAnalysis, params : dict,
+                        stageNames : List[str] = None,
+                        forceStages : List[str] = ()) -> List[dict]:
+    """Run the stages of one file that are not up to date.
+
+    Args:
+        oa:
+        params: analysis parameters, like cytoSigma and dapiSigma
+        stageNames: stages to run (and the stages they depend on), None for all
+        forceStages: stages to run even if up to date
+
+    Returns:
+        list of dict, one per stage with status in ['done', 'skipped', 'blocked']
+    """
+    if stageNames is not None:
+        stageNames = _addDependencies(stageNames)
+
+    header = oa.getHeader()
+    stageKeys = {}
+    resultList = []
+    for stage in pipelineStages:
+        if stageNames is not None and stage.name not in stageNames:
+            continue
+        # after upstream stages ran, like a new cellpose _seg.npy
+        stageKeys[stage.name] = _getStageKey(stage, oa, params, stageKeys)
+        resultDict = {
+            'file': oa.filename,
+            'stage': stage.name,
+            'status': 'skipped',
+            'seconds': 0,
+        }
+        resultList.append(resultDict)
+
+        _key = stageKeys[stage.name]
+        if _key is None:
+            resultDict['status'] = 'blocked'
+            continue
+        _saved = header['pipeline'].get(stage.name)
+        if _saved is not None and _saved['key'] == _key and stage.name not in forceStages:
+            continue
+
+        logger.info(f'{oa.filename} running stage "{stage.name}"')
+        _startTime = time.perf_counter()
+        stage.run(oa, params)
+        seconds = round(time.perf_counter() - _startTime, 3)
+
+        header['pipeline'][stage.name] = {
+            'key': _key,
+            'seconds': seconds,
+            'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        oa.saveHeader()
+
+        resultDict['status'] = 'done'
+        resultDict['seconds'] = seconds
+
+    return resultList
+
+def estimateStackBytes(header : dict) -> int:
+    """Estimate the peak memory to analyze one file from its czi header.
+
+    Stages work on one full resolution raw channel at a time (aics, raw stats),
+    see bytesPerVoxel.
+    """
+    numVoxels = header['xPixels'] * header['yPixels'] * header['zPixels']
+    return int(numVoxels * bytesPerVoxel + workerOverheadBytes)
+
+def getMemoryBudget() -> int:
+    """Get the memory budget for all workers, see memoryBudgetBytes.
+    """
+    if memoryBudgetBytes is not None:
+        return memoryBudgetBytes
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+    except (ValueError, OSError, AttributeError):
+        # not available on windows
+        return 8 * 1024**3
+
+def getNumWorkers(stackBytes : List[int], budgetBytes : int = None,
+                    maxWorkers : int = None) -> int:
+    """Number of worker processes so the largest stacks fit in the memory budget.
+
+    Args:
+        stackBytes: estimate for each file, see estimateStackBytes()
+        budgetBytes: if None then use getMemoryBudget()
+        maxWorkers: if None then use the number of cpu cores
+    """
+    if budgetBytes is None:
+        budgetBytes = getMemoryBudget()
+    if maxWorkers is None:
+        maxWorkers = os.cpu_count() or 1
+    if len(stackBytes) == 0:
+        return 1
+    numWorkers = int(budgetBytes // max(stackBytes))
+    return max(1, min(maxWorkers, numWorkers, len(stackBytes)))
+
+def getTaskList(folderPathList : List[str], params : dict,
+                    stageNames : List[str] = None,
+                    forceStages : List[str] = ()) -> List[dict]:
+    """Get one task per czi file in a list of folders, see _runFile().
+
+    Args:
+        folderPathList: list of folders with czi files
+        params: analysis parameters, like cytoSigma and dapiSigma
+        stageNames: stages to run (and the stages they depend on), None for all
+        forceStages: stages to run even if up to date
+    """
+    taskList = []
+    for folderPath in folderPathList:
+        dfFolder = loadCzi.loadFolder(folderPath)
+        if len(dfFolder) == 0:
+            logger.error(f'Did not find image files for folder: {folderPath}')
+            continue
+        for cziHeader in dfFolder.to_dict('records'):
+            taskList.append({
+                'folderPath': folderPath,
+                'path': os.path.join(folderPath, cziHeader['path']),
+                'cziHeader': cziHeader,
+                'params': params,
+                'stageNames': stageNames,
+                'forceStages': list(forceStages),
+                'stackBytes': estimateStackBytes(cziHeader),
+            })
+    return taskList
+
+def _runFile(task : dict) -> dict:
+    """Run the pipeline for one file, in a worker process or in this process.
+
+    Returns:
+        dict with the header and the per stage results
+    """
+    oa = oligoAnalysis(task['path'], cziHeader=task['cziHeader'])
+    resultList = runFilePipeline(oa, task['params'], stageNames=task['stageNames'],
+                                    forceStages=task['forceStages'])
+    oa.unloadRawData()
+    oa._rgbStack = None
+    return {
+        'header': oa.getHeader(),
+        'results': resultList,
+    }
+
+def _runParallel(taskList : List[dict], numWorkers : int, budgetBytes : int,
+                    resultCallback : Callable = None) -> List[dict]:
+    """Run tasks in a process pool, the estimated bytes of running tasks stay in the budget.
+
+    A task larger than the budget runs alone.
+
+    Args:
+        resultCallback: called as resultCallback(result) as each task finishes
+
+    Returns:
+        list of _runFile() results in the order of taskList
+    """
+    resultList = [None] * len(taskList)
+    pending = collections.deque(range(len(taskList)))
+    running = {}  # keys are future, values are task index
+    runningBytes = 0
+
+    # spawn, cellpose (torch) is not fork safe
+    _context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=numWorkers, mp_context=_context) as executor:
+        while pending or running:
+            while pending and len(running) < numWorkers:
+                _stackBytes = taskList[pending[0]]['stackBytes']
+                if running and runningBytes + _stackBytes > budgetBytes:
+                    break
+                _idx = pending.popleft()
+                running[executor.submit(_runFile, taskList[_idx])] = _idx
+                runningBytes += _stackBytes
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                _idx = running.pop(future)
+                runningBytes -= taskList[_idx]['stackBytes']
+                resultList[_idx] = future.result()
+                if resultCallback is not None:
+                    resultCallback(resultList[_idx])
+                logger.info(f'  finished {sum(_r is not None for _r in resultList)} of {len(taskList)} '
+                            f'{os.path.split(taskList[_idx]["path"])[1]}')
+    return resultList
+
+def runPipeline(folderPathList : List[str], summaryPath : str = None,
+                    cytoSigma : float = 0.7, dapiSigma : float = 3,
+                    stageNames : List[str] = None,
+                    forceStages : List[str] = (),
+                    numWorkers : int = 1,
+                    budgetBytes : int = None) -> pd.DataFrame:
+    """Run the analysis pipeline on all files in a list of folders.
+
+    Only stages that are not up to date are run, see runFilePipeline().
+    The row of each file is saved in the summary as soon as it finishes,
+    rows of files no longer in a folder are removed, see oligoSummary.
+
+    Args:
+        folderPathList: list of folders with czi files
+        summaryPath: full path to summary sqlite file, if None then do not save
+        cytoSigma: gaussian sigma for cyto mask
+        dapiSigma: gaussian sigma for dapi mask
+        stageNames: stages to run (and the stages they depend on), None for all
+        forceStages: stages to run even if up to date
+        numWorkers: number of worker processes, if None then size from budgetBytes
+            (see getNumWorkers()), if <= 1 then run in this process
+        budgetBytes: memory for all workers, if None then use getMemoryBudget()
+
+    Returns:
+        pd.DataFrame summary, one row per file in the order of folderPathList
+    """
+    params = {
+        'cytoSigma': cytoSigma,
+        'dapiSigma': dapiSigma,
+    }
+    taskList = getTaskList(folderPathList, params, stageNames=stageNames,
+                            forceStages=forceStages)
+
+    if budgetBytes is None:
+        budgetBytes = getMemoryBudget()
+    if numWorkers is None:
+        numWorkers = getNumWorkers([_task['stackBytes'] for _task in taskList], budgetBytes)
+
+    # aics runs blocks of z planes in threads, share the cores between files
+    params['aicsNumWorkers'] = max(1, (os.cpu_count() or 1) // max(1, numWorkers))
+    logger.info(f'running pipeline on {len(taskList)} files with {numWorkers} workers '
+                f'budget:{round(budgetBytes/1024**3, 1)} GB')
+
+    def _saveResult(fileResult : dict):
+        # only files with a stage that ran, the others are already in the summary
+        if summaryPath is not None and any(_result['status'] == 'done' for _result in fileResult['results']):
+            oligoSummary.upsertRows(summaryPath, [fileResult['header']])
+
+    if numWorkers <= 1 or len(taskList) <= 1:
+        resultList = []
+        for _idx, task in enumerate(taskList):
+            logger.info(f'    === file {_idx+1} of {len(taskList)} {task["path"]}')
+            resultList.append(_runFile(task))
+            _saveResult(resultList[-1])
+    else:
+        resultList = _runParallel(taskList, numWorkers, budgetBytes, resultCallback=_saveResult)
+
+    headerList = [_fileResult['header'] for _fileResult in resultList]
+    if summaryPath is not None:
+        # files that were removed and files not yet in the summary with no stage to run
+        for folderPath in folderPathList:
+            _folderHeaders = [header for task, header in zip(taskList, headerList)
+                                if task['folderPath'] == folderPath]
+            oligoSummary.replaceFolder(summaryPath, folderPath, _folderHeaders, onlyMissing=True)
+
+    dfMaster = pd.DataFrame(headerList)
+    return dfMaster.drop(columns=oligoSummary.summaryDropColumns, errors='ignore')
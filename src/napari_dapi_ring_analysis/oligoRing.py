@@ -0,0 +1,411 @@
+"""
+Ring analysis of cellpose dapi labels.
+
+For each label in a cellpose dapi mask we
+    - dilate by dilateIterations
+    - erode by erodeIterations
+    - make a ring (dilated xor eroded)
+    - sum the cyto mask pixels contained in the ring
+
+Dilation and erosion use scipy.ndimage defaults (connectivity 1),
+iterating n times is the same as taking the taxicab (L1) ball of radius n.
+"""
+import time
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import scipy.ndimage
+
+from napari_dapi_ring_analysis._logger import logger
+
+def _ballOffsets(radius : int, ndim : int) -> np.ndarray:
+    """Get all integer offsets in a taxicab ball, excluding the center.
+
+    Returns:
+        np.ndarray of shape (num offsets, ndim)
+    """
+    _range = range(-radius, radius+1)
+    offsets = [o for o in itertools.product(_range, repeat=ndim)
+                if 0 < sum(abs(x) for x in o) <= radius]
+    return np.array(offsets, dtype=np.intp).reshape(-1, ndim)
+
+def _labelErosionStep(labelMask : np.ndarray) -> np.ndarray:
+    """One label aware erosion step (connectivity 1).
+
+    A pixel keeps its label if all its neighbors have the same label.
+    Pixels on the border of the image are always eroded (border value 0).
+    """
+    keep = labelMask != 0
+    for axis in range(labelMask.ndim):
+        _lo = [slice(None)] * labelMask.ndim
+        _hi = [slice(None)] * labelMask.ndim
+        _lo[axis] = slice(None, -1)
+        _hi[axis] = slice(1, None)
+        _lo = tuple(_lo)
+        _hi = tuple(_hi)
+        _same = labelMask[_lo] == labelMask[_hi]
+        keep[_lo] &= _same
+        keep[_hi] &= _same
+
+        # border
+        _first = [slice(None)] * labelMask.ndim
+        _last = [slice(None)] * labelMask.ndim
+        _first[axis] = 0
+        _last[axis] = -1
+        keep[tuple(_first)] = False
+        keep[tuple(_last)] = False
+
+    return np.where(keep, labelMask, 0)
+
+def _ringDataFrame(labels : np.ndarray,
+                    finalMaskCount : np.ndarray,
+                    cytoImageMaskSum : np.ndarray) -> pd.DataFrame:
+    """Make the per label DataFrame from per label arrays.
+    """
+    if len(labels) == 0:
+        return pd.DataFrame()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cytoImageMaskPercent = cytoImageMaskSum / finalMaskCount * 100
+    df = pd.DataFrame({
+        'label': labels,
+        'finalMaskCount': finalMaskCount,  # num pixels in dilated mask
+        'cytoImageMaskSum': cytoImageMaskSum,  # sum of red mask in dilated dapi mask
+        'cytoImageMaskPercent': cytoImageMaskPercent,  # fraction of pixels in red mask in dilated mask
+        'accept': '',  # '' indicates False
+    })
+    return df
+
+def _erosionDepth(labelMask : np.ndarray, maxIterations : int) -> np.ndarray:
+    """Number of label aware erosion steps each pixel survives.
+
+    A labeled pixel is in the erosion by n iterations if its depth is >= n.
+    Depth is capped at maxIterations, background is 0.
+    """
+    depth = np.zeros(labelMask.shape, dtype=np.uint16)
+    eroded = labelMask
+    for _ in range(maxIterations):
+        eroded = _labelErosionStep(eroded)
+        depth += eroded != 0
+    return depth
+
+def _iterOuterRing(labelMask : np.ndarray, depth : np.ndarray,
+                    maxDilate : int, chunkSize : int = 2**18):
+    """Yield pixels in the outer ring of each label, up to maxDilate.
+
+    A pixel can only be in the outer ring of another label if it is within
+    maxDilate of some label and not deep inside its own label. For these
+    candidates we gather the labels in the taxicab ball of radius maxDilate
+    and keep the closest distance to each label.
+
+    Args:
+        labelMask:
+        depth: from _erosionDepth() with at least maxDilate iterations
+        maxDilate:
+        chunkSize: number of candidate pixels to gather at once
+
+    Yields:
+        (flat pixel index, label, distance) as 1d np.ndarray
+            one entry per pixel and label, distance is in [1, maxDilate]
+    """
+    _nearLabel = scipy.ndimage.binary_dilation(labelMask != 0, iterations=maxDilate)
+    candidateIdx = np.flatnonzero(_nearLabel & (depth < maxDilate))
+
+    labelFlat = labelMask.ravel()
+
+    # gather neighbor labels from a zero padded copy
+    _padded = np.pad(labelMask, maxDilate)
+    _paddedFlat = _padded.ravel()
+    _offsets = _ballOffsets(maxDilate, labelMask.ndim)
+    _flatOffsets = np.ravel_multi_index((_offsets + maxDilate).T, _padded.shape) \
+                    - np.ravel_multi_index([maxDilate]*labelMask.ndim, _padded.shape)
+    _offsetDist = np.abs(_offsets).sum(axis=1)
+
+    # sort key is label then distance, so first of each label is the closest
+    _numDist = maxDilate + 1
+
+    for _start in range(0, len(candidateIdx), chunkSize):
+        _idx = candidateIdx[_start:_start+chunkSize]
+        _coords = np.unravel_index(_idx, labelMask.shape)
+        _paddedIdx = np.ravel_multi_index(tuple(c + maxDilate for c in _coords), _padded.shape)
+        _neighbors = _paddedFlat[_paddedIdx[:, None] + _flatOffsets[None, :]]
+
+        # remove own label (background is already 0)
+        _neighbors[_neighbors == labelFlat[_idx][:, None]] = 0
+
+        _key = _neighbors.astype(np.int64) * _numDist + _offsetDist[None, :]
+        _key.sort(axis=1)
+        _labels = _key // _numDist
+        _keep = _labels != 0
+        _keep[:, 1:] &= _labels[:, 1:] != _labels[:, :-1]
+
+        _row, _col = np.nonzero(_keep)
+        yield _idx[_row], _labels[_row, _col], _key[_row, _col] % _numDist
+
+def ringAnalysis(labelMask : np.ndarray,
+                    cytoMask : np.ndarray,
+                    dilateIterations : int = 2,
+                    erodeIterations : int = 2,
+                    chunkSize : int = 2**18):
+    """Ring analysis of all labels in a few whole volume passes.
+
+    Each ring is split into an inner part (inside the label, not eroded)
+    and an outer part (outside the label, within dilation).
+    The inner part comes from a label aware erosion.
+    The outer part is only possible for pixels near a label boundary,
+    for these we gather the labels within the dilation ball.
+    Per label stats are then reduced with np.bincount().
+
+    Rings of different labels can overlap, like the per label loop,
+    overlapping pixels in dapi_final_mask are the sum of (label+1).
+
+    Args:
+        labelMask: cellpose dapi mask, 0 is background
+        cytoMask: binary cyto mask, same shape as labelMask
+        dilateIterations:
+        erodeIterations:
+        chunkSize: number of boundary pixels to gather at once
+
+    Returns:
+        dapi_final_mask: like labelMask with ring pixels set to label+1
+        dfLabels: pd.DataFrame with one row per label
+    """
+    labels = np.unique(labelMask)
+    labels = labels[labels != 0]
+    if len(labels) == 0:
+        return np.zeros_like(labelMask), _ringDataFrame(labels, None, None)
+
+    numBins = int(labels[-1]) + 1
+    cytoFlat = np.asarray(cytoMask).ravel()
+    labelFlat = labelMask.ravel()
+    dapi_final_mask = np.zeros(labelMask.shape, dtype=np.int64)
+    finalFlat = dapi_final_mask.ravel()
+
+    depth = _erosionDepth(labelMask, max(erodeIterations, dilateIterations))
+
+    # inner ring, inside each label but not in its erosion
+    innerIdx = np.flatnonzero((labelMask != 0) & (depth < erodeIterations))
+    innerLabels = labelFlat[innerIdx]
+    finalFlat[innerIdx] += innerLabels.astype(np.int64) + 1
+    finalMaskCount = np.bincount(innerLabels, minlength=numBins)
+    cytoImageMaskSum = np.bincount(innerLabels, weights=cytoFlat[innerIdx], minlength=numBins).astype(np.int64)
+
+    # outer ring, outside each label but within its dilation
+    if dilateIterations > 0:
+        for _outerIdx, _outerLabels, _ in _iterOuterRing(labelMask, depth, dilateIterations, chunkSize):
+            np.add.at(finalFlat, _outerIdx, _outerLabels + 1)
+            finalMaskCount += np.bincount(_outerLabels, minlength=numBins)
+            cytoImageMaskSum += np.bincount(_outerLabels, weights=cytoFlat[_outerIdx], minlength=numBins).astype(np.int64)
+
+    finalMaskCount = finalMaskCount[labels]
+    cytoImageMaskSum = cytoImageMaskSum[labels]
+
+    dfLabels = _ringDataFrame(labels, finalMaskCount, cytoImageMaskSum)
+    return dapi_final_mask, dfLabels
+
+def sweepRingAnalysis(labelMask : np.ndarray,
+                        cytoMask : np.ndarray,
+                        dilateRange = range(0, 5),
+                        erodeRange = range(0, 5),
+                        chunkSize : int = 2**18) -> pd.DataFrame:
+    """Ring analysis for all combinations of dilate and erode iterations.
+
+    Rings are nested, a pixel in the dilation by k is in the dilation by k+1.
+    We compute the erosion depth of each pixel and the distance of each
+    outer pixel to each nearby label once, for the largest iterations,
+    then get every combination with a cumulative histogram.
+
+    Returns:
+        pd.DataFrame with one row per (dilateIterations, erodeIterations, label)
+    """
+    dilateRange = sorted(dilateRange)
+    erodeRange = sorted(erodeRange)
+
+    labels = np.unique(labelMask)
+    labels = labels[labels != 0]
+    if len(labels) == 0 or len(dilateRange) == 0 or len(erodeRange) == 0:
+        return pd.DataFrame()
+
+    maxDilate = dilateRange[-1]
+    maxErode = erodeRange[-1]
+    numBins = int(labels[-1]) + 1
+    cytoFlat = np.asarray(cytoMask).ravel()
+    labelFlat = labelMask.ravel()
+
+    depth = _erosionDepth(labelMask, max(maxDilate, maxErode))
+
+    # inner[label, n] is the number of label pixels with erosion depth < n
+    _numErode = maxErode + 1
+    _labelIdx = np.flatnonzero(labelFlat)
+    _key = labelFlat[_labelIdx].astype(np.int64) * _numErode \
+            + np.minimum(depth.ravel()[_labelIdx], maxErode)
+    _innerCount = np.bincount(_key, minlength=numBins*_numErode).reshape(numBins, _numErode)
+    _innerCyto = np.bincount(_key, weights=cytoFlat[_labelIdx],
+                                minlength=numBins*_numErode).reshape(numBins, _numErode)
+    innerCount = np.zeros((numBins, _numErode))
+    innerCyto = np.zeros((numBins, _numErode))
+    innerCount[:, 1:] = np.cumsum(_innerCount, axis=1)[:, :-1]
+    innerCyto[:, 1:] = np.cumsum(_innerCyto, axis=1)[:, :-1]
+
+    # outer[label, n] is the number of pixels outside label within distance n
+    _numDilate = maxDilate + 1
+    outerCount = np.zeros(numBins*_numDilate)
+    outerCyto = np.zeros(numBins*_numDilate)
+    if maxDilate > 0:
+        for _outerIdx, _outerLabels, _outerDist in _iterOuterRing(labelMask, depth, maxDilate, chunkSize):
+            _key = _outerLabels * _numDilate + _outerDist
+            outerCount += np.bincount(_key, minlength=numBins*_numDilate)
+            outerCyto += np.bincount(_key, weights=cytoFlat[_outerIdx], minlength=numBins*_numDilate)
+    outerCount = np.cumsum(outerCount.reshape(numBins, _numDilate), axis=1)
+    outerCyto = np.cumsum(outerCyto.reshape(numBins, _numDilate), axis=1)
+
+    dfList = []
+    for dilateIterations in dilateRange:
+        for erodeIterations in erodeRange:
+            finalMaskCount = (innerCount[labels, erodeIterations]
+                                + outerCount[labels, dilateIterations]).astype(np.int64)
+            cytoImageMaskSum = (innerCyto[labels, erodeIterations]
+                                + outerCyto[labels, dilateIterations]).astype(np.int64)
+            df = _ringDataFrame(labels, finalMaskCount, cytoImageMaskSum)
+            df = df.drop('accept', axis=1)
+            df.insert(0, 'erodeIterations', erodeIterations)
+            df.insert(0, 'dilateIterations', dilateIterations)
+            dfList.append(df)
+
+    return pd.concat(dfList, ignore_index=True)
+
+def ringAnalysisPerLabel(labelMask : np.ndarray,
+                    cytoMask : np.ndarray,
+                    dilateIterations : int = 2,
+                    erodeIterations : int = 2):
+    """Ring analysis looping over each label.
+
+    Each label is only processed inside its bounding box (scipy.ndimage.find_objects),
+    padded by dilateIterations so the dilation fits. The crop border is never part
+    of the label, so erosion is the same as in the full volume.
+    Per label cost depends on the size of the label, not the size of the stack.
+
+    This is slower than ringAnalysis() with many labels but uses less memory.
+
+    Returns:
+        dapi_final_mask: like labelMask with ring pixels set to label+1
+        dfLabels: pd.DataFrame with one row per label
+    """
+    maskLabelList = np.unique(labelMask)
+    maskLabelList = maskLabelList[maskLabelList != 0]
+
+    if len(maskLabelList) == 0:
+        dapi_final_mask = np.zeros_like(labelMask)
+    else:
+        dapi_final_mask = np.zeros(labelMask.shape, dtype=np.int64)  # dapi mask after dilation
+    logger.info(f'making dapi_dilated_mask: {dapi_final_mask.shape} {dapi_final_mask.dtype}')
+
+    cytoMask = np.asarray(cytoMask)
+    boundingBoxes = scipy.ndimage.find_objects(labelMask)
+
+    listOfDict = []  # convert to pandas dataframe at end
+
+    for maskLabel in maskLabelList:
+        # bounding box padded by dilation, clipped to the stack
+        _slices = tuple(slice(max(_sl.start - dilateIterations, 0),
+                                min(_sl.stop + dilateIterations, _size))
+                        for _sl, _size in zip(boundingBoxes[maskLabel-1], labelMask.shape))
+
+        _oneMask = labelMask[_slices] == maskLabel
+
+        # dilate the mask
+        if dilateIterations>0:
+            _dilatedMask = scipy.ndimage.binary_dilation(_oneMask, iterations=dilateIterations)
+        else:
+            _dilatedMask = _oneMask
+
+        if erodeIterations>0:
+            _erodedMask = scipy.ndimage.binary_erosion(_oneMask, iterations=erodeIterations)
+        else:
+            _erodedMask = _oneMask
+
+        # make a ring
+        finalMask = _dilatedMask ^ _erodedMask  # carrot (^) is xor
+
+        # the number of pixels in the dilated/eroded dapi mask
+        finalMaskCount = np.count_nonzero(finalMask)
+
+        # oligo red mask pixels in the (dilated/eroded) dapi mask
+        cytoImageMaskSum = np.sum(cytoMask[_slices][finalMask], dtype=np.int64)
+
+        # like cellpose_dapi_mask but after dilation
+        # +1 so colors are different from cellpose_dapi_mask
+        _finalView = dapi_final_mask[_slices]
+        _finalView[finalMask] += maskLabel + 1
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            redImageMaskPercent = cytoImageMaskSum / finalMaskCount * 100
+
+        oneDict = {
+            'label': maskLabel,
+            'finalMaskCount': finalMaskCount,  # num pixels in dilated mask
+            'cytoImageMaskSum': cytoImageMaskSum,  # sum of red mask in dilated dapi mask
+            'cytoImageMaskPercent': redImageMaskPercent,  # fraction of pixels in red mask in dilated mask
+            'accept': '',  # '' indicates False
+        }
+        listOfDict.append(oneDict)
+
+    dfLabels = pd.DataFrame(listOfDict)
+
+    return dapi_final_mask, dfLabels
+
+def makeTestLabels(shape = (21, 196, 196), numLabels : int = 100,
+                    radius : int = 6, seed : int = 0):
+    """Make a synthetic label mask of (possibly touching) spheres.
+
+    Returns:
+        labelMask: np.ndarray of labels, 0 is background
+        cytoMask: random binary np.ndarray
+    """
+    rng = np.random.default_rng(seed)
+    labelMask = np.zeros(shape, dtype=np.uint16)
+    grid = np.indices(shape, sparse=True)
+    for _label in range(1, numLabels+1):
+        center = [rng.integers(0, s) for s in shape]
+        _dist = sum(((g - c) / (radius/3 if axis==0 else radius)) ** 2
+                        for axis, (g, c) in enumerate(zip(grid, center)))
+        labelMask[_dist <= 1] = _label
+    cytoMask = rng.random(shape) > 0.7
+    return labelMask, cytoMask
+
+def benchmarkRingAnalysis(labelCounts = (10, 50, 100, 200, 300),
+                            shape = (21, 196, 196),
+                            dilateIterations : int = 2,
+                            erodeIterations : int = 2,
+                            doPerLabel : bool = True) -> pd.DataFrame:
+    """Time ringAnalysis() and ringAnalysisPerLabel() vs number of labels.
+
+    Returns:
+        pd.DataFrame with one row per label count
+    """
+    dictList = []
+    for numLabels in labelCounts:
+        labelMask, cytoMask = makeTestLabels(shape, numLabels)
+        oneDict = {
+            'numLabels': len(np.unique(labelMask)) - 1,
+            'shape': shape,
+        }
+
+        _start = time.perf_counter()
+        ringAnalysis(labelMask, cytoMask, dilateIterations, erodeIterations)
+        oneDict['vectorizedSec'] = round(time.perf_counter() - _start, 4)
+
+        if doPerLabel:
+            _start = time.perf_counter()
+            ringAnalysisPerLabel(labelMask, cytoMask, dilateIterations, erodeIterations)
+            oneDict['perLabelSec'] = round(time.perf_counter() - _start, 4)
+
+        logger.info(oneDict)
+        dictList.append(oneDict)
+
+    return pd.DataFrame(dictList)
+
+if __name__ == '__main__':
+    df = benchmarkRingAnalysis()
+    print(df)
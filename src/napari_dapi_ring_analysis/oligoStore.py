@@ -0,0 +1,473 @@
+"""
+Storage backends for saved oligoAnalysis results.
+
+Saved results are named arrays (rgb stack, masks, filtered images, ...),
+the analysis header (dict) and the label stats (pd.DataFrame).
+
+Backends:
+    'tif': one file per array in the per file analysis folder (original layout)
+        <file stub>-rgb-small.tif, -mask-cyto.tif, -header.json, -labels.csv, ...
+    'zarr': one chunked and compressed zarr container per file
+        <file stub>-rgb-small.zarr, one z plane per chunk,
+        header and labels are stored in the container.
+
+Cellpose always writes its _seg.npy next to the rgb tif path,
+the 'zarr' backend imports the masks on first load.
+"""
+import os
+import json
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+import tifffile
+
+from napari_dapi_ring_analysis._logger import logger
+
+storageBackends = ['tif', 'zarr']
+
+defaultStorage = 'tif'
+# used when oligoAnalysis is not given a storage backend
+
+zarrCompressionLevel = 3
+# blosc zstd compression level for the 'zarr' backend
+
+tifCompression = 'zlib'
+# lossless compression for integer arrays (like label masks) in the 'tif' backend
+
+def _getBaseSaveFile(path : str) -> str:
+    """Get the base save file stub for a raw image, see oligoAnalysis.getBaseSaveFile().
+
+    Does not make the save folder.
+    """
+    _folder, _file = os.path.split(path)
+    _, _parentFolder = os.path.split(_folder)
+
+    # <parent folder>/<parent folder>-analysis/<file>/<file stub>-rgb-small
+    _cellFolder = os.path.join(_folder, _parentFolder + '-analysis', _file)
+    saveFile, _ext = os.path.splitext(_file)
+    saveFile += f'-rgb-small'
+    return os.path.join(_cellFolder, saveFile)
+
+def _saveTif(path : str, data : np.ndarray):
+    """Save an array as tif, bit packed or compressed by dtype.
+    """
+    # minisblack so a stack with 3 or 4 z planes is not saved as rgb
+    if data.dtype == bool:
+        # tifffile writes bool as bilevel, 1 bit per voxel (can not be compressed)
+        tifffile.imwrite(path, data, photometric='minisblack')
+    elif np.issubdtype(data.dtype, np.integer):
+        tifffile.imwrite(path, data, photometric='minisblack', compression=tifCompression)
+    else:
+        tifffile.imwrite(path, data, photometric='minisblack')
+
+def _getSavedRgbPath(rgbPath : str) -> str:
+    """Get the rgb tif or the rgb array folder in the zarr container, None if neither exists.
+    """
+    if os.path.isfile(rgbPath):
+        return rgbPath
+    # zarr arrays are a folder in the container, its mtime changes when chunks are written
+    _zarrRgbPath = os.path.join(os.path.splitext(rgbPath)[0] + '.zarr', 'rgb')
+    if os.path.isfile(os.path.join(_zarrRgbPath, '.zarray')):
+        return _zarrRgbPath
+
+def loadSavedRgb(rgbPath : str) -> np.ndarray:
+    """Load a saved rgb stack from the path of its rgb tif, like the imgPath given to cellpose.
+
+    The 'zarr' backend does not save an rgb tif, the stack is loaded
+    from the zarr container with the same file stub.
+
+    Returns:
+        None if the rgb stack has not been saved
+    """
+    _savedPath = _getSavedRgbPath(rgbPath)
+    if _savedPath is None:
+        return
+    if _savedPath == rgbPath:
+        return tifffile.imread(rgbPath)
+    import zarr
+    return zarr.open_array(_savedPath, mode='r')[...]
+
+def getSavedRgbMtime(rgbPath : str) -> float:
+    """Get the modification time of a saved rgb stack, see loadSavedRgb().
+
+    Returns:
+        None if the rgb stack has not been saved
+    """
+    _savedPath = _getSavedRgbPath(rgbPath)
+    if _savedPath is None:
+        return
+    return os.path.getmtime(_savedPath)
+
+def getStore(path : str, storage : str = None) -> 'analysisStore':
+    """Get the storage backend for a raw image.
+
+    Args:
+        path: Full path to raw image (czi file)
+        storage: In storageBackends, if None then use defaultStorage
+    """
+    if storage is None:
+        storage = defaultStorage
+    if storage == 'tif':
+        return tifStore(path)
+    elif storage == 'zarr':
+        return zarrStore(path)
+    else:
+        raise ValueError(f'Did not understand storage "{storage}", expecting one of {storageBackends}')
+
+class analysisStore(ABC):
+    """Interface to save and load the analysis of one raw image.
+
+    Array names are like 'rgb', 'mask-cyto', 'filtered-cyto', 'dapi-final-mask',
+    'cellpose-mask' and 'raw-histogram-cyto'.
+    """
+    def __init__(self, path : str):
+        """
+        Args:
+            path: Full path to raw image (czi file)
+        """
+        self._path = path
+        self._baseSaveFile = _getBaseSaveFile(path)
+
+    def getSaveFolder(self) -> str:
+        """Get the per file analysis folder and make if neccessary.
+        """
+        _cellFolder = os.path.split(self._baseSaveFile)[0]
+        if not os.path.isdir(_cellFolder):
+            logger.info(f'making analysis folder:')
+            logger.info(f'  {_cellFolder}')
+            os.makedirs(_cellFolder, exist_ok=True)
+        return _cellFolder
+
+    def _getSegPath(self) -> str:
+        """Get the path to the cellpose _seg.npy, written by cellpose next to the rgb tif.
+        """
+        return self._baseSaveFile + '_seg.npy'
+
+    def _loadSegMasks(self) -> np.ndarray:
+        dat = np.load(self._getSegPath(), allow_pickle=True).item()
+        return dat['masks']
+
+    @abstractmethod
+    def hasArray(self, name : str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def loadArray(self, name : str, zSlice : Union[int, slice] = None) -> np.ndarray:
+        """Load a saved array, None if it has not been saved.
+
+        Args:
+            name: array name
+            zSlice: if not None, only load these z planes (first axis)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def saveArray(self, name : str, data : np.ndarray):
+        """Save an array.
+
+        Boolean masks are stored bit packed (1 bit per voxel).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def loadMask(self, name : str, out : np.ndarray = None) -> np.ndarray:
+        """Load a saved binary mask into a boolean array, None if it has not been saved.
+
+        Bit packed masks are unpacked directly into out.
+        Masks saved as one byte per voxel are converted with (data != 0).
+
+        Args:
+            name: array name
+            out: preallocated boolean array with the shape of the saved mask,
+                if None then allocate
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    @contextmanager
+    def arrayWriter(self, name : str, shape : tuple, dtype, photometric : str = None):
+        """Context manager yielding a writable on disk array.
+
+        The array is only visible to loadArray() after the context exits.
+
+        Args:
+            photometric: passed to tifffile, like 'rgb'
+        """
+
+    @abstractmethod
+    def loadHeader(self) -> dict:
+        """Load the saved header, None if it has not been saved.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def saveHeader(self, header : dict):
+        """Save the header.
+
+        Raises TypeError if the header is not json serializable.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def loadLabels(self) -> pd.DataFrame:
+        """Load the saved label stats, None if they have not been saved.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def saveLabels(self, df : pd.DataFrame):
+        raise NotImplementedError
+
+class tifStore(analysisStore):
+    """One file per array next to a -header.json and -labels.csv.
+    """
+    def _getArrayPath(self, name : str) -> str:
+        if name == 'rgb':
+            return self._baseSaveFile + '.tif'
+        elif name == 'cellpose-mask':
+            return self._getSegPath()
+        elif name.startswith('raw-histogram'):
+            return self._baseSaveFile + f'-{name}.npy'
+        else:
+            return self._baseSaveFile + f'-{name}.tif'
+
+    def hasArray(self, name : str) -> bool:
+        return os.path.isfile(self._getArrayPath(name))
+
+    def loadArray(self, name : str, zSlice : Union[int, slice] = None) -> np.ndarray:
+        arrayPath = self._getArrayPath(name)
+        if not os.path.isfile(arrayPath):
+            return
+
+        if name == 'cellpose-mask':
+            data = self._loadSegMasks()
+        elif arrayPath.endswith('.npy'):
+            data = np.load(arrayPath)
+        elif zSlice is None:
+            data = tifffile.imread(arrayPath)
+        else:
+            # one tif page per z plane
+            if isinstance(zSlice, slice):
+                with tifffile.TiffFile(arrayPath) as tif:
+                    numPages = len(tif.pages)
+                zSlice = range(*zSlice.indices(numPages))
+            return tifffile.imread(arrayPath, key=zSlice)
+
+        if zSlice is not None:
+            data = data[zSlice]
+        return data
+
+    def saveArray(self, name : str, data : np.ndarray):
+        if name == 'cellpose-mask':
+            raise ValueError('cellpose-mask is written by cellpose')
+        self.getSaveFolder()
+        arrayPath = self._getArrayPath(name)
+        if arrayPath.endswith('.npy'):
+            np.save(arrayPath, data)
+        else:
+            _saveTif(arrayPath, data)
+
+    def loadMask(self, name : str, out : np.ndarray = None) -> np.ndarray:
+        arrayPath = self._getArrayPath(name)
+        if not os.path.isfile(arrayPath):
+            return
+
+        with tifffile.TiffFile(arrayPath) as tif:
+            series = tif.series[0]
+            if out is None:
+                out = np.empty(series.shape, dtype=bool)
+            if series.dtype == bool:
+                # bilevel tif
+                series.asarray(out=out)
+            else:
+                # older masks were saved as one byte per voxel
+                np.not_equal(series.asarray(), 0, out=out)
+        return out
+
+    @contextmanager
+    def arrayWriter(self, name : str, shape : tuple, dtype, photometric : str = None):
+        self.getSaveFolder()
+        arrayPath = self._getArrayPath(name)
+        _tmpPath = arrayPath + '.tmp'
+        data = tifffile.memmap(_tmpPath, shape=shape, dtype=dtype, photometric=photometric)
+        try:
+            yield data
+            data.flush()
+            del data
+            os.replace(_tmpPath, arrayPath)
+        finally:
+            if os.path.isfile(_tmpPath):
+                os.remove(_tmpPath)
+
+    def loadHeader(self) -> dict:
+        headerPath = self._baseSaveFile + '-header.json'
+        if not os.path.isfile(headerPath):
+            return
+        with open(headerPath, 'r') as f:
+            try:
+                return json.load(f)
+            except (json.decoder.JSONDecodeError) as e:
+                logger.error(e)
+                logger.error(f'headerPath: {headerPath}')
+
+    def saveHeader(self, header : dict):
+        # dumps first so we do not leave a partial json
+        _json = json.dumps(header, indent=4)
+        self.getSaveFolder()
+        headerPath = self._baseSaveFile + '-header.json'
+        logger.info(f'saving header json: {headerPath}')
+        with open(headerPath, 'w') as f:
+            f.write(_json)
+
+    def loadLabels(self) -> pd.DataFrame:
+        dfPath = self._baseSaveFile + '-labels.csv'
+        if not os.path.isfile(dfPath):
+            return
+        return pd.read_csv(dfPath)
+
+    def saveLabels(self, df : pd.DataFrame):
+        self.getSaveFolder()
+        dfPath = self._baseSaveFile + '-labels.csv'
+        logger.info(f'saving label df: {dfPath}')
+        df.to_csv(dfPath, index=False)
+
+class zarrStore(analysisStore):
+    """One zarr container per file.
+
+    Arrays are chunked by z plane and blosc zstd compressed,
+    the header is in the root attrs and labels are a group with one array per column.
+    """
+    def __init__(self, path : str):
+        super().__init__(path)
+        # zarr is optional, only needed for this backend
+        import zarr
+        self._zarr = zarr
+        self._zarrPath = self._baseSaveFile + '.zarr'
+        self._group = None
+
+    def _getGroup(self, create : bool = False):
+        """Get the root group, None if it does not exist and not create.
+        """
+        if self._group is None:
+            if os.path.isdir(self._zarrPath):
+                self._group = self._zarr.open_group(self._zarrPath, mode='a')
+            elif create:
+                self.getSaveFolder()
+                self._group = self._zarr.open_group(self._zarrPath, mode='a')
+        return self._group
+
+    def _arrayKwargs(self, shape : tuple, dtype) -> dict:
+        from numcodecs import Blosc, PackBits
+        if len(shape) >= 3:
+            chunks = (1,) + tuple(shape[1:])
+        else:
+            chunks = True
+        compressor = Blosc(cname='zstd', clevel=zarrCompressionLevel, shuffle=Blosc.BITSHUFFLE)
+        # bit pack boolean masks before compression
+        filters = [PackBits()] if np.dtype(dtype) == bool else None
+        return {'shape': shape, 'dtype': dtype, 'chunks': chunks,
+                'compressor': compressor, 'filters': filters, 'overwrite': True}
+
+    def _hasSegUpdate(self) -> bool:
+        """True if cellpose _seg.npy is newer than the masks in the container.
+        """
+        segPath = self._getSegPath()
+        if not os.path.isfile(segPath):
+            return False
+        group = self._getGroup()
+        if group is None or 'cellpose-mask' not in group:
+            return True
+        return group['cellpose-mask'].attrs.get('segMtime') != os.path.getmtime(segPath)
+
+    def hasArray(self, name : str) -> bool:
+        group = self._getGroup()
+        if group is not None and name in group:
+            return True
+        if name == 'cellpose-mask':
+            return os.path.isfile(self._getSegPath())
+        return False
+
+    def loadArray(self, name : str, zSlice : Union[int, slice] = None) -> np.ndarray:
+        if name == 'cellpose-mask' and self._hasSegUpdate():
+            logger.info(f'importing cellpose masks into {self._zarrPath}')
+            masks = self._loadSegMasks()
+            self.saveArray(name, masks)
+            self._getGroup()[name].attrs['segMtime'] = os.path.getmtime(self._getSegPath())
+
+        group = self._getGroup()
+        if group is None or name not in group:
+            return
+        if zSlice is None:
+            return group[name][...]
+        return group[name][zSlice]
+
+    def saveArray(self, name : str, data : np.ndarray):
+        group = self._getGroup(create=True)
+        group.create_dataset(name, data=data, **self._arrayKwargs(data.shape, data.dtype))
+
+    def loadMask(self, name : str, out : np.ndarray = None) -> np.ndarray:
+        group = self._getGroup()
+        if group is None or name not in group:
+            return
+        data = group[name]
+        if out is None:
+            out = np.empty(data.shape, dtype=bool)
+        if data.dtype == bool:
+            data.get_basic_selection(Ellipsis, out=out)
+        else:
+            np.not_equal(data[...], 0, out=out)
+        return out
+
+    @contextmanager
+    def arrayWriter(self, name : str, shape : tuple, dtype, photometric : str = None):
+        group = self._getGroup(create=True)
+        _tmpName = name + '-tmp'
+        data = group.create_dataset(_tmpName, **self._arrayKwargs(shape, dtype))
+        try:
+            yield data
+            if name in group:
+                del group[name]
+            group.move(_tmpName, name)
+        finally:
+            if _tmpName in group:
+                del group[_tmpName]
+
+    def loadHeader(self) -> dict:
+        group = self._getGroup()
+        if group is None:
+            return
+        return group.attrs.get('header')
+
+    def saveHeader(self, header : dict):
+        # dumps first so a bad header raises TypeError before writing
+        _header = json.loads(json.dumps(header))
+        group = self._getGroup(create=True)
+        logger.info(f'saving header to {self._zarrPath}')
+        group.attrs['header'] = _header
+
+    def loadLabels(self) -> pd.DataFrame:
+        group = self._getGroup()
+        if group is None or 'labels' not in group:
+            return
+        labels = group['labels']
+        columns = labels.attrs['columns']
+        return pd.DataFrame({column: labels[column][...] for column in columns},
+                            columns=columns)
+
+    def saveLabels(self, df : pd.DataFrame):
+        from numcodecs import VLenUTF8
+        group = self._getGroup(create=True)
+        logger.info(f'saving label df to {self._zarrPath}')
+        labels = group.create_group('labels', overwrite=True)
+        for column in df.columns:
+            values = df[column].to_numpy()
+            if values.dtype == object:
+                labels.create_dataset(column, data=values.astype(str), dtype=object,
+                                        object_codec=VLenUTF8())
+            else:
+                labels.create_dataset(column, data=values)
+        labels.attrs['columns'] = [str(column) for column in df.columns]
@@ -0,0 +1,131 @@
+"""
+Master summary of all analyzed files, one row per file in an sqlite table.
+
+Rows are upserted by the full path of the raw file, saving the results of one file
+(or one folder) does not rewrite the rest of the summary. Rows are json so new
+header keys do not need a new table.
+"""
+import os
+import json
+import time
+import sqlite3
+from typing import List
+
+import pandas as pd
+
+from napari_dapi_ring_analysis._logger import logger
+
+summaryDropColumns = ['cacheKeys', 'pipeline']
+# header keys that are bookkeeping, not saved in the summary
+
+def _jsonDefault(obj):
+    # numpy scalars in headers
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return str(obj)
+
+def _folderWhere(folderPath : str) -> tuple:
+    """Sql where clause for files in a folder and its sub folders.
+    """
+    folderPath = os.path.normpath(folderPath)
+    _prefix = folderPath + os.sep
+    return 'folder = ? OR substr(folder, 1, ?) = ?', (folderPath, len(_prefix), _prefix)
+
+def _openSummary(dbPath : str) -> sqlite3.Connection:
+    """Open (and make if necc) the summary table.
+    """
+    conn = sqlite3.connect(dbPath, timeout=60)
+    conn.execute("""CREATE TABLE IF NOT EXISTS summary (
+                        path TEXT PRIMARY KEY,
+                        folder TEXT,
+                        updated REAL,
+                        row TEXT)""")
+    conn.execute('CREATE INDEX IF NOT EXISTS summaryFolder ON summary (folder)')
+    return conn
+
+def _makeRow(header : dict, updated : float) -> tuple:
+    _path = header['path']
+    _row = {k: v for k, v in header.items() if k not in summaryDropColumns}
+    return (_path, os.path.split(_path)[0], updated,
+            json.dumps(_row, default=_jsonDefault))
+
+def upsertRows(dbPath : str, headerList : List[dict]):
+    """Insert or replace rows, keyed on header 'path'.
+
+    Args:
+        dbPath: full path to sqlite file
+        headerList: list of analysis header, see oligoAnalysis.getHeader()
+    """
+    _updated = time.time()
+    rowList = [_makeRow(header, _updated) for header in headerList]
+    conn = _openSummary(dbPath)
+    try:
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO summary VALUES (?, ?, ?, ?)', rowList)
+    finally:
+        conn.close()
+
+def replaceFolder(dbPath : str, folderPath : str, headerList : List[dict],
+                    onlyMissing : bool = False):
+    """Replace the rows of one folder, rows of files no longer in headerList are removed.
+
+    Files in sub folders of folderPath are part of the folder.
+
+    Args:
+        dbPath: full path to sqlite file
+        folderPath: folder with czi files
+        headerList: list of analysis header, one per file in the folder
+        onlyMissing: if True then only add rows for files not in the summary
+    """
+    _updated = time.time()
+    rowList = [_makeRow(header, _updated) for header in headerList]
+    _keepPaths = set(_row[0] for _row in rowList)
+    _where, _args = _folderWhere(folderPath)
+    conn = _openSummary(dbPath)
+    try:
+        with conn:
+            _oldPaths = [_path for (_path,) in conn.execute(
+                            f'SELECT path FROM summary WHERE {_where}', _args)]
+            _removed = [(_path,) for _path in _oldPaths if _path not in _keepPaths]
+            conn.executemany('DELETE FROM summary WHERE path = ?', _removed)
+            if onlyMissing:
+                _oldPaths = set(_oldPaths)
+                rowList = [_row for _row in rowList if _row[0] not in _oldPaths]
+            conn.executemany('INSERT OR REPLACE INTO summary VALUES (?, ?, ?, ?)', rowList)
+    finally:
+        conn.close()
+    logger.info(f'{len(rowList)} rows for {folderPath}, removed {len(_removed)}')
+
+def loadSummary(dbPath : str, folderPathList : List[str] = None) -> pd.DataFrame:
+    """Load the summary, one row per file sorted by path.
+
+    Args:
+        dbPath: full path to sqlite file
+        folderPathList: only load files in these folders, None for all
+
+    Returns:
+        pd.DataFrame, empty if dbPath does not exist
+    """
+    if not os.path.isfile(dbPath):
+        logger.warning(f'Did not find summary: {dbPath}')
+        return pd.DataFrame()
+
+    conn = _openSummary(dbPath)
+    try:
+        if folderPathList is None:
+            _rows = conn.execute('SELECT row FROM summary ORDER BY path').fetchall()
+        elif len(folderPathList) == 0:
+            _rows = []
+        else:
+            # one query, files in nested folders are only loaded once
+            _whereList = []
+            _args = ()
+            for folderPath in folderPathList:
+                _where, _folderArgs = _folderWhere(folderPath)
+                _whereList.append(f'({_where})')
+                _args += _folderArgs
+            _rows = conn.execute(f'SELECT row FROM summary WHERE {" OR ".join(_whereList)} ORDER BY path',
+                                    _args).fetchall()
+    finally:
+        conn.close()
+    return pd.DataFrame([json.loads(_row) for (_row,) in _rows])
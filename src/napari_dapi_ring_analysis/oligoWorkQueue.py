@@ -0,0 +1,424 @@
+"""
+Shared folder work queue, run the batch pipeline on several hosts with a shared file system.
+
+No scheduler or broker, everything is a file in the queue folder:
+
+    tasks/<taskId>.json     one per czi file, see oligoPipeline.getTaskList()
+    leases/<taskId>.lease   a worker is running the task, mtime is the last heartbeat
+    done/<taskId>.json      result, header and per stage results
+    failed/<taskId>.json    error of the last attempt
+
+A lease is claimed with an exclusive create (O_CREAT | O_EXCL), only one worker gets it.
+A worker renews its lease while it runs, a lease older than leaseSeconds is from a
+worker that died and can be taken over. Results are written to a temporary file
+and renamed, running a task twice gives the same files (see oligoPipeline).
+"""
+import os
+import json
+import time
+import socket
+import hashlib
+import threading
+import multiprocessing
+from typing import Callable, List
+
+import pandas as pd
+
+from napari_dapi_ring_analysis._logger import logger
+from napari_dapi_ring_analysis import oligoPipeline
+from napari_dapi_ring_analysis import oligoSummary
+
+leaseSeconds = 600
+# a lease without a heartbeat for this long is taken over by another worker
+
+maxAttempts = 3
+# tasks that failed this many times are not claimed again
+
+def _jsonDefault(obj):
+    # numpy scalars in czi headers
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return str(obj)
+
+def _writeJson(path : str, data : dict):
+    """Write json to a temporary file and rename, readers never see a partial file.
+    """
+    _json = json.dumps(data, indent=4, default=_jsonDefault)
+    _tmpPath = f'{path}.{socket.gethostname()}.{os.getpid()}.tmp'
+    with open(_tmpPath, 'w') as f:
+        f.write(_json)
+    os.replace(_tmpPath, path)
+
+def _readJson(path : str) -> dict:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError):
+        return
+
+def getTaskId(task : dict) -> str:
+    """Get the task id of a czi file and its run parameters, stable across hosts.
+
+    The id is <file stub>-<path hash>-<parameter hash>,
+    the same file with new parameters is a new task.
+    """
+    _path = task['path']
+    _file = os.path.split(_path)[1]
+    _pathHash = hashlib.sha1(_path.encode('utf-8')).hexdigest()[0:12]
+    _params = json.dumps({
+        'params': task.get('params'),
+        'stageNames': task.get('stageNames'),
+        'forceStages': task.get('forceStages'),
+    }, sort_keys=True, default=_jsonDefault)
+    _paramsHash = hashlib.sha1(_params.encode('utf-8')).hexdigest()[0:8]
+    return f'{os.path.splitext(_file)[0]}-{_pathHash}-{_paramsHash}'
+
+def _getPathId(taskId : str) -> str:
+    """Get the part of a task id from the file path.
+    """
+    return taskId.rsplit('-', 1)[0]
+
+class workQueue():
+    """Work queue in a shared folder, see module docstring.
+    """
+    def __init__(self, queueFolder : str, leaseSeconds : float = None):
+        """
+        Args:
+            queueFolder: shared folder, made if necc
+            leaseSeconds: if None then use module leaseSeconds
+        """
+        self._queueFolder = queueFolder
+        self._leaseSeconds = leaseSeconds
+        for _folder in ['tasks', 'leases', 'done', 'failed']:
+            os.makedirs(os.path.join(queueFolder, _folder), exist_ok=True)
+
+    @property
+    def leaseSeconds(self) -> float:
+        return leaseSeconds if self._leaseSeconds is None else self._leaseSeconds
+
+    def _getPath(self, folder : str, taskId : str) -> str:
+        _ext = '.lease' if folder == 'leases' else '.json'
+        return os.path.join(self._queueFolder, folder, taskId + _ext)
+
+    def addTasks(self, taskList : List[dict]) -> int:
+        """Add tasks, tasks already in the queue are replaced (done tasks stay done).
+
+        Tasks keep the order they were first added in, across calls.
+        A file added with new parameters replaces the task (and result) with the old parameters.
+
+        Returns:
+            number of tasks added
+        """
+        _taskIds = {}  # keys are path id, values are task id
+        _nextOrder = 0
+        for taskId in self.getTaskIds():
+            _task = _readJson(self._getPath('tasks', taskId))
+            if _task is None:
+                continue
+            _taskIds[_getPathId(taskId)] = (taskId, _task['order'])
+            _nextOrder = max(_nextOrder, _task['order'] + 1)
+
+        for task in taskList:
+            taskId = getTaskId(task)
+            _oldTaskId, _order = _taskIds.get(_getPathId(taskId), (None, None))
+            if _order is None:
+                _order = _nextOrder
+                _nextOrder += 1
+            elif _oldTaskId != taskId:
+                logger.info(f'replacing {_oldTaskId} with new parameters')
+                self._removeTask(_oldTaskId)
+            _taskIds[_getPathId(taskId)] = (taskId, _order)
+            task = dict(task, taskId=taskId, order=_order)
+            _writeJson(self._getPath('tasks', taskId), task)
+        logger.info(f'added {len(taskList)} tasks to {self._queueFolder}')
+        return len(taskList)
+
+    def _removeTask(self, taskId : str):
+        """Remove a task and its result, a running worker keeps its lease until it finishes.
+        """
+        for _folder in ['tasks', 'done', 'failed']:
+            try:
+                os.remove(self._getPath(_folder, taskId))
+            except (FileNotFoundError):
+                pass
+
+    def getTaskIds(self) -> List[str]:
+        _folder = os.path.join(self._queueFolder, 'tasks')
+        return sorted(os.path.splitext(_file)[0] for _file in os.listdir(_folder)
+                        if _file.endswith('.json'))
+
+    def isDone(self, taskId : str) -> bool:
+        return os.path.isfile(self._getPath('done', taskId))
+
+    def _getAttempts(self, taskId : str) -> int:
+        _failed = _readJson(self._getPath('failed', taskId))
+        return 0 if _failed is None else _failed['attempts']
+
+    def _readLease(self, taskId : str) -> dict:
+        """Read a lease, None if there is no lease.
+
+        A lease that is still being written is an empty dict.
+        """
+        return self._readLeaseFile(self._getPath('leases', taskId))
+
+    def _readLeaseFile(self, leasePath : str) -> dict:
+        try:
+            with open(leasePath, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError):
+            return
+        except (json.decoder.JSONDecodeError):
+            return {}
+
+    def _tryLease(self, taskId : str, workerId : str) -> bool:
+        """Atomically claim the lease of a task, take over an expired lease.
+        """
+        leasePath = self._getPath('leases', taskId)
+        try:
+            _mtime = os.path.getmtime(leasePath)
+        except (FileNotFoundError):
+            _mtime = None
+        if _mtime is not None:
+            if time.time() - _mtime < self.leaseSeconds:
+                return False
+            # expired, rename is atomic so only one worker removes it
+            _expiredLease = self._readLeaseFile(leasePath)
+            _stalePath = f'{leasePath}.{workerId}.stale'
+            try:
+                os.rename(leasePath, _stalePath)
+            except (FileNotFoundError):
+                return False
+            # another worker may have taken over between our check and our rename,
+            # then we renamed its new lease and have to put it back
+            _renamedLease = self._readLeaseFile(_stalePath)
+            if (_renamedLease != _expiredLease
+                    or time.time() - os.path.getmtime(_stalePath) < self.leaseSeconds):
+                try:
+                    os.link(_stalePath, leasePath)
+                except (FileExistsError):
+                    # yet another worker has the lease
+                    pass
+                os.remove(_stalePath)
+                return False
+            os.remove(_stalePath)
+            logger.warning(f'{workerId} took over expired lease {taskId} from {_expiredLease.get("workerId")}')
+
+        try:
+            fd = os.open(leasePath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except (FileExistsError):
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'workerId': workerId, 'host': socket.gethostname(),
+                        'pid': os.getpid(), 'claimed': time.time()}, f)
+        return True
+
+    def claim(self, workerId : str) -> dict:
+        """Claim the next task that is not done, not leased and has not failed maxAttempts.
+
+        Returns:
+            task dict, None if there are no tasks to claim
+        """
+        for taskId in self.getTaskIds():
+            if self.isDone(taskId) or self._getAttempts(taskId) >= maxAttempts:
+                continue
+            if not self._tryLease(taskId, workerId):
+                continue
+            if self.isDone(taskId):
+                # finished between our check and our lease
+                self.release(taskId, workerId)
+                continue
+            task = _readJson(self._getPath('tasks', taskId))
+            if task is None:
+                # replaced or removed by addTasks() after we listed it
+                self.release(taskId, workerId)
+                continue
+            return task
+
+    def _isOwner(self, taskId : str, workerId : str) -> bool:
+        _lease = self._readLease(taskId)
+        return _lease is not None and _lease.get('workerId') == workerId
+
+    def renew(self, taskId : str, workerId : str) -> bool:
+        """Heartbeat, keep our lease from expiring.
+
+        Returns:
+            False if the lease is no longer ours (it expired and was taken over)
+        """
+        if not self._isOwner(taskId, workerId):
+            logger.warning(f'{workerId} lost lease {taskId}')
+            return False
+        try:
+            os.utime(self._getPath('leases', taskId))
+        except (FileNotFoundError):
+            return False
+        return True
+
+    def release(self, taskId : str, workerId : str):
+        """Remove our lease, a lease taken over by another worker is kept.
+        """
+        if not self._isOwner(taskId, workerId):
+            return
+        try:
+            os.remove(self._getPath('leases', taskId))
+        except (FileNotFoundError):
+            pass
+
+    def complete(self, taskId : str, workerId : str, result : dict):
+        """Save the result of a task and release its lease.
+        """
+        _writeJson(self._getPath('done', taskId), result)
+        self.release(taskId, workerId)
+
+    def fail(self, taskId : str, workerId : str, error : str):
+        """Record a failed attempt and release the lease so the task can be retried.
+        """
+        _writeJson(self._getPath('failed', taskId), {
+            'workerId': workerId,
+            'error': error,
+            'attempts': self._getAttempts(taskId) + 1,
+        })
+        self.release(taskId, workerId)
+
+    def getStatus(self) -> dict:
+        """Number of tasks that are done, running, failed and pending.
+        """
+        statusDict = {'done': 0, 'running': 0, 'failed': 0, 'pending': 0}
+        for taskId in self.getTaskIds():
+            if self.isDone(taskId):
+                statusDict['done'] += 1
+            elif os.path.isfile(self._getPath('leases', taskId)):
+                statusDict['running'] += 1
+            elif self._getAttempts(taskId) >= maxAttempts:
+                statusDict['failed'] += 1
+            else:
+                statusDict['pending'] += 1
+        return statusDict
+
+    def getResults(self) -> List[dict]:
+        """Results of done tasks, in the order they were added.
+        """
+        resultList = []
+        for taskId in self.getTaskIds():
+            _result = _readJson(self._getPath('done', taskId))
+            if _result is None:
+                continue
+            _task = _readJson(self._getPath('tasks', taskId))
+            resultList.append((_task['order'], _result))
+        return [_result for _order, _result in sorted(resultList, key=lambda x: x[0])]
+
+def enqueueFolders(queueFolder : str, folderPathList : List[str],
+                    cytoSigma : float = 0.7, dapiSigma : float = 3,
+                    stageNames : List[str] = None,
+                    forceStages : List[str] = ()) -> workQueue:
+    """Add one task per czi file in a list of folders, see oligoPipeline.runPipeline().
+    """
+    params = {
+        'cytoSigma': cytoSigma,
+        'dapiSigma': dapiSigma,
+    }
+    taskList = oligoPipeline.getTaskList(folderPathList, params, stageNames=stageNames,
+                                            forceStages=forceStages)
+    queue = workQueue(queueFolder)
+    queue.addTasks(taskList)
+    return queue
+
+def runWorker(queueFolder : str, workerId : str = None, maxTasks : int = None,
+                runTask : Callable = None, leaseSeconds : float = None) -> int:
+    """Claim and run tasks until the queue is empty, run one worker per cpu host (or more).
+
+    While other workers hold leases we keep polling, a lease of a worker
+    that died expires and its task is taken over.
+
+    Args:
+        queueFolder: shared queue folder
+        workerId: if None then use <host>-<pid>
+        maxTasks: stop after this many tasks, None for no limit
+        runTask: called as runTask(task) and returns json serializable result,
+            if None then use oligoPipeline._runFile()
+        leaseSeconds: if None then use module leaseSeconds
+
+    Returns:
+        number of tasks run
+    """
+    if workerId is None:
+        workerId = f'{socket.gethostname()}-{os.getpid()}'
+    if runTask is None:
+        runTask = oligoPipeline._runFile
+
+    queue = workQueue(queueFolder, leaseSeconds=leaseSeconds)
+    numRun = 0
+    while maxTasks is None or numRun < maxTasks:
+        task = queue.claim(workerId)
+        if task is None:
+            _status = queue.getStatus()
+            if _status['pending'] == 0 and _status['running'] == 0:
+                break
+            # wait for running tasks to finish or their lease to expire
+            time.sleep(queue.leaseSeconds / 4)
+            continue
+        taskId = task['taskId']
+        logger.info(f'{workerId} running {taskId}')
+
+        # heartbeat while the task runs
+        _stopEvent = threading.Event()
+        def _heartbeat():
+            while not _stopEvent.wait(queue.leaseSeconds / 4):
+                if not queue.renew(taskId, workerId):
+                    break
+        _heartbeatThread = threading.Thread(target=_heartbeat, daemon=True)
+        _heartbeatThread.start()
+
+        try:
+            result = runTask(task)
+            result = dict(result, workerId=workerId)
+            queue.complete(taskId, workerId, result)
+        except Exception as e:
+            logger.error(f'{workerId} task {taskId} failed: {e}')
+            queue.fail(taskId, workerId, str(e))
+        finally:
+            _stopEvent.set()
+            _heartbeatThread.join()
+        numRun += 1
+
+    logger.info(f'{workerId} ran {numRun} tasks, queue status: {queue.getStatus()}')
+    return numRun
+
+def getSummary(queueFolder : str, summaryPath : str = None) -> pd.DataFrame:
+    """Summary of all done tasks, one row per file, see oligoPipeline.runPipeline().
+
+    Args:
+        queueFolder: shared queue folder
+        summaryPath: if not None then upsert rows into this summary sqlite,
+            done once after the workers finish (sqlite is not safe on network file systems)
+    """
+    queue = workQueue(queueFolder)
+    headerList = [_result['header'] for _result in queue.getResults()]
+    if summaryPath is not None:
+        oligoSummary.upsertRows(summaryPath, headerList)
+    dfMaster = pd.DataFrame(headerList)
+    return dfMaster.drop(columns=oligoSummary.summaryDropColumns, errors='ignore')
+
+def simulateNodes(queueFolder : str, numNodes : int = 3,
+                    runTask : Callable = None, leaseSeconds : float = None) -> List[int]:
+    """Run several workers on this host, each in its own process like separate nodes.
+
+    For testing the queue, see runWorker().
+
+    Args:
+        runTask: must be importable by name in the worker processes
+        leaseSeconds: if None then use module leaseSeconds
+
+    Returns:
+        exit code of each worker process
+    """
+    _context = multiprocessing.get_context('spawn')
+    processList = []
+    for _nodeIdx in range(numNodes):
+        _process = _context.Process(target=runWorker,
+                                    args=(queueFolder, f'node{_nodeIdx}'),
+                                    kwargs={'runTask': runTask, 'leaseSeconds': leaseSeconds})
+        _process.start()
+        processList.append(_process)
+    for _process in processList:
+        _process.join()
+    return [_process.exitcode for _process in processList]